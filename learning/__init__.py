@@ -23,7 +23,7 @@
 ###############################################################################
 
 # Add model building
-from learning.base import Model
+from learning.base import Model, Workspace
 
 # Add models
 from learning.architecture.multioutputs import MultiOutputs
@@ -22,7 +22,6 @@
 # SOFTWARE.
 ###############################################################################
 
-import random
 import copy
 import functools
 import operator
@@ -31,7 +30,9 @@ import numpy
 
 from learning import Model
 from learning import calculate
-from learning.optimize import Problem, BFGS, SteepestDescent
+from learning import dtypes
+from learning import frozen
+from learning.optimize import Problem, BFGS, SteepestDescent, WolfeLineSearch, IncrPrevStep
 from learning.error import MSE
 
 INITIAL_WEIGHTS_RANGE = 0.25
@@ -47,8 +48,14 @@ class MLP(Model):
             Defaults to ReLU hidden followed by linear output.
         optimizer: Optimizer; Optimizer used to optimize weight matrices.
         error_func: ErrorFunc; Error function for optimizing weight matrices.
+        dtype: 'float32' or 'float64'; Type of weights, activations, and jacobians.
+            Defaults to dtypes.get_default_dtype().
     """
-    def __init__(self, shape, transfers=None, optimizer=None, error_func=None):
+    _parameter_attributes = ('_weight_matrices',)
+    _scratch_attributes = ('_weight_inputs', '_transfer_inputs', '_transfer_caches', '_problem')
+    _training_attributes = ('_optimizer',)
+
+    def __init__(self, shape, transfers=None, optimizer=None, error_func=None, dtype=None):
         super(MLP, self).__init__()
 
         if transfers is None:
@@ -62,6 +69,7 @@ class MLP(Model):
                 'Must have exactly 1 transfer between each pair of layers, and after the output')
 
         self._shape = shape
+        self._dtype = dtypes.get_dtype(dtype)
 
         self._weight_matrices = []
         self._setup_weight_matrices()
@@ -94,15 +102,29 @@ class MLP(Model):
         self._error_func = error_func
 
         # Setup activation vectors
+        self._weight_inputs = None
+        self._transfer_inputs = None
+        self._transfer_caches = None
+        self._problem = None
+        self._restore_scratch()
+
+        self.reset()
+
+    def _restore_scratch(self):
+        """Setup activation vectors."""
         # 1 for input, then 2 for each hidden and output (1 for transfer, 1 for perceptron))
         # +1 for biases
-        self._weight_inputs = [numpy.ones(shape[0]+1)]
+        self._weight_inputs = [numpy.ones(self._shape[0]+1, dtype=self._dtype)]
         self._transfer_inputs = []
-        for size in shape[1:]:
-            self._weight_inputs.append(numpy.ones(size+1))
-            self._transfer_inputs.append(numpy.zeros(size))
+        for size in self._shape[1:]:
+            self._weight_inputs.append(numpy.ones(size+1, dtype=self._dtype))
+            self._transfer_inputs.append(numpy.zeros(size, dtype=self._dtype))
 
-        self.reset()
+        # Intermediates of each transfer, reused by backprop
+        self._transfer_caches = [{} for _ in self._shape[1:]]
+
+        # (input_matrix, target_matrix, Problem) of the previous train_step
+        self._problem = None
 
     def _setup_weight_matrices(self):
         """Initialize weight matrices."""
@@ -116,80 +138,257 @@ class MLP(Model):
     def _random_weight_matrix(self, shape):
         """Return a random weight matrix."""
         # TODO: Random weight matrix should be a function user can pass in
-        return (2*numpy.random.random(shape) - 1)*INITIAL_WEIGHTS_RANGE
+        return ((2*numpy.random.random(shape) - 1)*INITIAL_WEIGHTS_RANGE).astype(self._dtype)
 
     def reset(self):
         """Reset this model."""
         self._setup_weight_matrices()
         self._optimizer.reset()
 
-    def activate(self, input_vec):
-        """Return the model outputs for given input_vec."""
+    def freeze(self, dtype=None):
+        """Return an inference-only copy of this model, see learning.frozen."""
+        return frozen.FrozenMLP(self._weight_matrices, self._transfers,
+                                self._dtype if dtype is None else dtypes.get_dtype(dtype))
+
+    def activate(self, input_vec, workspace=None):
+        """Return the model outputs for given input_vec.
+
+        Args:
+            workspace: Optional Workspace. If given, this model is not modified,
+                and outputs are stored in workspace, like activate_batch.
+                Otherwise, activations are kept for backprop.
+        """
         if len(input_vec) != self._shape[0]:
             raise ValueError('input_vec shape == %s, expected %s' % (len(input_vec), self._shape[0]))
 
+        if workspace is not None:
+            return self._propagate(numpy.asarray(input_vec, dtype=self._dtype), workspace)
+
         # [1:] because first component is bias
         self._weight_inputs[0][1:] = input_vec
 
         for i, (weight_matrix, transfer_func) in enumerate(
                 zip(self._weight_matrices, self._transfers)):
             # Track all activations for learning, and layer inputs
-            self._transfer_inputs[i] = numpy.dot(self._weight_inputs[i], weight_matrix)
+            # Written into activation vectors, without allocating
+            numpy.dot(self._weight_inputs[i], weight_matrix, out=self._transfer_inputs[i])
             # [1:] because first component is bias
-            self._weight_inputs[i+1][1:] = transfer_func(self._transfer_inputs[i])
+            transfer_func(self._transfer_inputs[i], out=self._weight_inputs[i+1][1:],
+                          cache=self._transfer_caches[i])
 
         # Return activation of the only layer that feeds into output
         # [1:] because first component is bias
         return numpy.copy(self._weight_inputs[-1][1:])
 
+    def activate_batch(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix.
+
+        All rows are propagated through each layer with a single matrix product.
+        Does not modify this model, see Model.activate_batch for workspace.
+        """
+        input_matrix = numpy.asarray(input_matrix, dtype=self._dtype)
+        if input_matrix.shape[1] != self._shape[0]:
+            raise ValueError('input_matrix shape == %s, expected %s columns' % (
+                input_matrix.shape, self._shape[0]))
+
+        return self._propagate(input_matrix, workspace)
+
+    def _propagate(self, inputs, workspace=None):
+        """Return outputs for inputs, a vector, or a matrix with a sample in each row.
+
+        Does not modify this model.
+        Outputs of each layer are stored in workspace, if given.
+        """
+        outputs = inputs
+        for i, (weight_matrix, transfer_func) in enumerate(
+                zip(self._weight_matrices, self._transfers)):
+            # First row of weight_matrix is bias
+            out = None if workspace is None else workspace.get_buffer(
+                (id(self), i), outputs.shape[:-1] + weight_matrix.shape[1:],
+                numpy.result_type(outputs, weight_matrix))
+            outputs = numpy.dot(outputs, weight_matrix[1:], out=out)
+
+            # Bias and transfer are applied in place
+            outputs += weight_matrix[0]
+            outputs = transfer_func(outputs, out=outputs)
+        return outputs
+
     def train_step(self, input_matrix, target_matrix):
         """Adjust the model towards the targets for given inputs.
 
         Train on a mini-batch.
+        Given the same arrays as the previous train_step,
+        the optimizer reuses the error and jacobian from the end of the previous step.
+        Do not modify arrays in place between calls.
         """
-        problem = Problem(
-            obj_func=functools.partial(_mlp_obj, self, input_matrix, target_matrix),
-            obj_jac_func=functools.partial(_mlp_obj_jac, self, input_matrix, target_matrix))
+        # Targets in another dtype would promote jacobians, and then weights
+        input_matrix = numpy.asarray(input_matrix, dtype=self._dtype)
+        target_matrix = dtypes.as_target_matrix(target_matrix, self._dtype)
 
-        error, flat_weights = self._optimizer.next(problem, _flatten(self._weight_matrices))
+        error, flat_weights = self._optimizer.next(
+            self._get_problem(input_matrix, target_matrix), _flatten(self._weight_matrices))
         self._weight_matrices = _unflatten_weights(flat_weights, self._shape)
 
         return error
 
+    def _get_problem(self, input_matrix, target_matrix):
+        """Return Problem for optimizing weights on given dataset.
+
+        The Problem of the previous train_step is returned for the same arrays,
+        so the optimizer can recognize the problem is unchanged.
+        """
+        # Dropout masks change the problem every step
+        if (self._problem is not None and self._get_masks() is None
+                and self._problem[0] is input_matrix and self._problem[1] is target_matrix):
+            return self._problem[2]
+
+        problem = Problem(
+            obj_func=functools.partial(_mlp_obj, self, input_matrix, target_matrix),
+            obj_jac_func=functools.partial(_mlp_obj_jac, self, input_matrix, target_matrix),
+            objs_func=functools.partial(_mlp_objs, self, input_matrix, target_matrix))
+        self._problem = (input_matrix, target_matrix, problem)
+        return problem
+
     def _get_jacobians(self, input_matrix, target_matrix):
         """Return mean jacobian matrix for each weight matrix.
 
         Also return mean error.
+        All samples are propagated together, with a matrix product for each layer.
         """
-        # Calculate jacobian for each samples
-        sample_jacobians = []
-        errors = []
-        for input_vec, target_vec in zip(input_matrix, target_matrix):
-            error, jacobians = self._get_sample_jacobians(input_vec, target_vec)
-            sample_jacobians.append(jacobians)
-            errors.append(error)
+        output_matrix, activations = self._forward_batch(input_matrix)
+
+        # error_jac is already divided by number of samples,
+        # so summed jacobians are mean jacobians
+        error, error_jac = self._error_func.derivative(output_matrix, target_matrix)
+        return error, self._backprop_batch(activations, error_jac)
 
-        # Average jacobians and error
-        # NOTE: We don't use numpy.mean(sample_jacobians, axis=0) because it can raise errors
-        return numpy.mean(errors), _mean_list_of_list_of_matrices(sample_jacobians)
+    def _get_masks(self):
+        """Return dropout mask for the inputs of each layer, or None.
 
+        Masks have a row for each sample, and None masks nothing.
+        Used by _forward_batch, during training.
+        """
+        return None
 
-    def _get_sample_jacobians(self, input_vec, target_vec):
-        """Return jacobian matrix for each weight matrix
+    def _forward_batch(self, input_matrix):
+        """Return outputs for each row of input_matrix, and activations for _backprop_batch.
 
-        Also return error.
+        Like activate_batch, but activations of every layer are kept.
+        Inputs of each layer are multiplied by masks from _get_masks.
+        """
+        masks = self._get_masks()
+        if masks is None:
+            masks = [None]*len(self._weight_matrices)
+
+        layer_inputs = numpy.asarray(input_matrix, dtype=self._dtype)
+        activations = []
+        for weight_matrix, transfer_func, mask in zip(self._weight_matrices, self._transfers, masks):
+            if mask is not None:
+                # New matrix, outputs of previous layer are kept unmasked for backprop
+                layer_inputs = layer_inputs * mask
+
+            # First row of weight_matrix is bias
+            transfer_inputs = numpy.dot(layer_inputs, weight_matrix[1:])
+            transfer_inputs += weight_matrix[0]
+            cache = {}
+            transfer_outputs = transfer_func(transfer_inputs, cache=cache)
+
+            activations.append((layer_inputs, mask, transfer_inputs, transfer_outputs, cache))
+            layer_inputs = transfer_outputs
+
+        return layer_inputs, activations
+
+    def _forward_outputs(self, input_matrix, weight_stacks=None):
+        """Return outputs for each row of input_matrix, without activations for backprop.
+
+        Like _forward_batch, including masks,
+        but each layer is computed in place, and only outputs are kept.
+        For objective values, when jacobians are not needed.
+
+        Args:
+            weight_stacks: Optional weight matrices of several candidates,
+                stacked for each layer, with shape (num_candidates, ) + weight_matrix.shape.
+                Outputs then have shape (num_candidates, num_samples, num_outputs).
+        """
+        masks = self._get_masks()
+        if masks is None:
+            masks = [None]*len(self._weight_matrices)
+        if weight_stacks is None:
+            weight_stacks = self._weight_matrices
+
+        outputs = numpy.asarray(input_matrix, dtype=self._dtype)
+        for weight_matrix, transfer_func, mask in zip(weight_stacks, self._transfers, masks):
+            if mask is not None:
+                outputs = outputs * mask
+
+            # First row of weight_matrix is bias
+            # Bias and transfer are applied in place
+            outputs = _dot_weights(outputs, weight_matrix[..., 1:, :])
+            outputs += weight_matrix[..., :1, :]
+            outputs = transfer_func(outputs, out=outputs)
+        return outputs
+
+    def _backprop_batch(self, activations, error_jac, input_error=False):
+        """Return jacobian matrix for each weight matrix, summed over samples.
+
+        Args:
+            activations: Activations of each layer, from _forward_batch.
+            error_jac: Derivative of error w.r.t. each row of outputs.
+            input_error: If True, also return derivative of error w.r.t. each row of inputs,
+                for backprop into a model that computes these inputs.
+
+        Returns:
+            list of jacobian matrices, or (jacobians, input_error_matrix) if input_error.
+        """
+        jacobians = []
+        error_matrix = error_jac
+        for i in reversed(range(len(self._weight_matrices))):
+            layer_inputs, mask, transfer_inputs, transfer_outputs, cache = activations[i]
+
+            # Derivative of error w.r.t. transfer inputs
+            error_matrix = self._transfers[i].backprop(
+                transfer_inputs, transfer_outputs, error_matrix, cache)
+            jacobians.append(_get_weight_jacobian(layer_inputs, error_matrix))
+
+            if i > 0 or input_error:
+                # Derivative of error w.r.t. outputs of previous layer, before mask
+                # [1:] because first row corresponds to bias
+                error_matrix = error_matrix.dot(self._weight_matrices[i][1:].T)
+                if mask is not None:
+                    error_matrix *= mask
+
+        jacobians.reverse()
+        if input_error:
+            return jacobians, error_matrix
+        return jacobians
+
+    def _get_backprop_jacobians(self, error_jac):
+        """Return jacobian matrix for each weight matrix.
+
+        Args:
+            error_jac: Derivative of error w.r.t. output vector,
+                from the most recent activate.
         """
-        output_vec = self.activate(input_vec)
+        # Calculate jacobian for each weight matrix
+        jacobians = []
+        for i, error_vec in enumerate(self._backprop(error_jac)):
+            jacobians.append(self._weight_inputs[i][:, None].dot(error_vec[None, :]))
 
-        error, error_jac = self._error_func.derivative(output_vec, target_vec)
+        return jacobians
 
+    def _backprop(self, error_jac):
+        """Return derivative of error w.r.t. transfer inputs of each layer.
+
+        Uses activations from the most recent activate.
+
+        Args:
+            error_jac: Derivative of error w.r.t. output vector.
+        """
         # TODO: Add optimization for cross entropy and softmax output (just o - t)
         # Derivative of error_vec w.r.t. output transfer
-        error_jac = _dot_diag_or_matrix(
-            error_jac,
-            self._transfers[-1].derivative(self._transfer_inputs[-1],
-                                           self._weight_inputs[-1][1:])
-        )
+        error_jac = self._transfers[-1].backprop(
+            self._transfer_inputs[-1], self._weight_inputs[-1][1:], error_jac,
+            self._transfer_caches[-1])
 
         # Calculate error for each row
         error_matrix = [error_jac]
@@ -197,21 +396,15 @@ class MLP(Model):
                 list(enumerate(zip(self._weight_matrices[1:], self._transfers[:-1])))):
             # [1:] because first column corresponds to bias
             error_matrix.append(
-                _dot_diag_or_matrix(
-                    error_matrix[-1].dot(weight_matrix[1:].T),
+                transfer_func.backprop(
                     # [1:] because first component is bias
-                    transfer_func.derivative(self._transfer_inputs[i],
-                                             self._weight_inputs[i+1][1:])
-                    )
+                    self._transfer_inputs[i], self._weight_inputs[i+1][1:],
+                    error_matrix[-1].dot(weight_matrix[1:].T),
+                    self._transfer_caches[i])
             )
-        error_matrix = reversed(error_matrix)
+        error_matrix.reverse()
 
-        # Calculate jacobian for each weight matrix
-        jacobians = []
-        for i, error_vec in enumerate(error_matrix):
-            jacobians.append(self._weight_inputs[i][:, None].dot(error_vec[None, :]))
-
-        return error, jacobians
+        return error_matrix
 
 def _dot_diag_or_matrix(vec, matrix):
     """Dot vector with either vector of diagonals or matrix.
@@ -220,16 +413,41 @@ def _dot_diag_or_matrix(vec, matrix):
     to the diagonals of a jacobian, or a full jacobian.
     The diagonal must be multiplied element-wise, which is equivalent to
     a dot product with a diagonal matrix.
+    For a batch, vec and diagonals have a row for each sample.
     """
-    if len(matrix.shape) == 1:
+    if matrix.shape == vec.shape:
         return vec * matrix
     else:
         return vec.dot(matrix)
 
+def _get_weight_jacobian(layer_inputs, error_matrix):
+    """Return jacobian of a weight matrix, summed over rows of layer_inputs and error_matrix.
+
+    First row is for bias.
+    Sums are accumulated in dtypes.get_accumulate_dtype(), if set.
+    """
+    dtype = error_matrix.dtype
+    accumulate_dtype = dtypes.get_accumulate_dtype()
+    if accumulate_dtype is not None:
+        layer_inputs = layer_inputs.astype(accumulate_dtype, copy=False)
+        error_matrix = error_matrix.astype(accumulate_dtype, copy=False)
+
+    return numpy.vstack([numpy.sum(error_matrix, axis=0),
+                         layer_inputs.T.dot(error_matrix)]).astype(dtype, copy=False)
+
 def _mean_list_of_list_of_matrices(lol_matrices):
-    """Return mean of each matrix in list of lists of matrices."""
+    """Return mean of each matrix in list of lists of matrices.
+
+    Sums are accumulated in dtypes.get_accumulate_dtype(), if set.
+    """
+    dtype = lol_matrices[0][0].dtype
+    accumulate_dtype = dtypes.get_accumulate_dtype()
+
     # Sum matrices
-    mean_matrices = lol_matrices[0]
+    if accumulate_dtype is None:
+        mean_matrices = lol_matrices[0]
+    else:
+        mean_matrices = [matrix.astype(accumulate_dtype) for matrix in lol_matrices[0]]
     for list_of_matrices in lol_matrices[1:]:
         for i, matrix in enumerate(list_of_matrices):
             mean_matrices[i] += matrix
@@ -239,12 +457,18 @@ def _mean_list_of_list_of_matrices(lol_matrices):
         matrix /= len(lol_matrices)
 
     # Return list of mean matrices
-    return mean_matrices
+    return [matrix.astype(dtype, copy=False) for matrix in mean_matrices]
 
 def _mlp_obj(model, input_matrix, target_matrix, parameters):
     model._weight_matrices = _unflatten_weights(parameters, model._shape)
-    return numpy.mean([model._error_func(model.activate(inp_vec), tar_vec)
-                       for inp_vec, tar_vec in zip(input_matrix, target_matrix)])
+    # Same outputs as jacobians, including dropout masks, without backprop
+    return model._error_func(model._forward_outputs(input_matrix), target_matrix)
+
+def _mlp_objs(model, input_matrix, target_matrix, parameters_list):
+    # Outputs of every candidate, in one stacked batch
+    weight_stacks = _unflatten_weights(numpy.array(parameters_list), model._shape)
+    return [model._error_func(output_matrix, target_matrix)
+            for output_matrix in model._forward_outputs(input_matrix, weight_stacks)]
 
 def _mlp_obj_jac(model, input_matrix, target_matrix, parameters):
     # TODO: Refactor so it doesn't need private attributes and methods
@@ -257,110 +481,221 @@ def _flatten(matrices):
     return numpy.hstack([matrix.ravel() for matrix in matrices])
 
 def _unflatten_weights(vector, shape):
+    """Return weight matrices, as views of vector.
+
+    If vector is a matrix, with flat weights in each row,
+    return weight matrices of each row, stacked for each layer.
+    """
     matrices = []
     index = 0
     for i, j in zip(shape[:-1], shape[1:]):
         i += 1 # For bias
         matrices.append(
-            vector[index:index+(i*j)].reshape((i, j))
+            vector[..., index:index+(i*j)].reshape(vector.shape[:-1] + (i, j))
         )
         index += (i*j)
 
     return matrices
 
+def _dot_weights(inputs, weights):
+    """Return matrix product of inputs and weights.
+
+    If weights are stacked for several candidates,
+    return products of each candidate, stacked.
+    """
+    if weights.ndim == 2:
+        return numpy.dot(inputs, weights)
+
+    if inputs.ndim == 2:
+        # Inputs are shared by all candidates,
+        # use one matrix product, with candidate weights side by side
+        num_candidates, num_inputs, num_outputs = weights.shape
+        products = numpy.dot(inputs, weights.transpose(1, 0, 2).reshape(num_inputs, -1))
+        return products.reshape(
+            len(inputs), num_candidates, num_outputs).transpose(1, 0, 2)
+
+    return numpy.matmul(inputs, weights)
+
+def _trunk_obj(trunk, heads, input_matrix, head_target_matrices, parameters):
+    """Return mean error of heads on outputs of trunk, for given trunk parameters.
+
+    Args:
+        head_target_matrices: Target matrix of each head.
+    """
+    trunk._weight_matrices = _unflatten_weights(parameters, trunk._shape)
+
+    features = trunk._forward_outputs(input_matrix)
+    return dtypes.mean([head._error_func(head._forward_outputs(features), target_matrix)
+                        for head, target_matrix in zip(heads, head_target_matrices)])
+
+def _trunk_obj_jac(trunk, heads, input_matrix, head_target_matrices, parameters):
+    """Return mean error of heads, and flattened jacobian, for given trunk parameters.
+
+    All samples are propagated together, through trunk and each head.
+    """
+    trunk._weight_matrices = _unflatten_weights(parameters, trunk._shape)
+
+    features, activations = trunk._forward_batch(input_matrix)
+
+    # Sum derivative of error w.r.t. trunk outputs, from each head
+    error = 0.0
+    features_error = numpy.zeros_like(features)
+    for head, target_matrix in zip(heads, head_target_matrices):
+        head_outputs, head_activations = head._forward_batch(features)
+        head_error, head_error_jac = head._error_func.derivative(head_outputs, target_matrix)
+        error += head_error
+        features_error += head._backprop_batch(head_activations, head_error_jac,
+                                               input_error=True)[1]
+
+    # Mean of heads
+    features_error /= len(heads)
+    return error / len(heads), _flatten(trunk._backprop_batch(activations, features_error))
+
+def _split_trunk_head(model):
+    """Return (trunk, head) MLPs, that together compute the same function as model.
+
+    trunk contains all hidden layers, and outputs the activations of the last hidden layer.
+    head contains only the output layer, and takes the outputs of trunk as inputs.
+    Both copy the weights, optimizer, and error function of model.
+    """
+    if len(model._shape) < 3:
+        raise ValueError('MLP must have a hidden layer to split into trunk and head')
+
+    return _slice_layers(model, 0, len(model._shape)-2), _slice_layers(model, len(model._shape)-2, None)
+
+def _slice_layers(model, start, end):
+    """Return copy of model, with only layers from start to end (exclusive)."""
+    new_model = copy.deepcopy(model)
+
+    layers = slice(start, end)
+    new_model._weight_matrices = new_model._weight_matrices[layers]
+    new_model._transfers = new_model._transfers[layers]
+    new_model._transfer_inputs = new_model._transfer_inputs[layers]
+    new_model._transfer_caches = new_model._transfer_caches[layers]
+
+    # +1 because shape and _weight_inputs include inputs
+    new_model._shape = new_model._shape[start:(None if end is None else end+1)]
+    new_model._weight_inputs = new_model._weight_inputs[start:(None if end is None else end+1)]
+
+    # New optimizer state for new parameters
+    new_model._optimizer.reset()
+
+    return new_model
+
 class DropoutMLP(MLP):
+    """MLP trained with dropout.
+
+    During training, each input and hidden neuron is active with a given probability,
+    drawn for each sample.
+    Active neurons are scaled by 1 / probability (inverted dropout),
+    so after training, the model is activated like an MLP, with unchanged weights.
+
+    Args:
+        input_active_probability: Probability that each input is active.
+        hidden_active_probability: Probability that each hidden neuron is active.
+    """
+    _scratch_attributes = MLP._scratch_attributes + ('_masks', )
+
     def __init__(self, shape, transfers=None, optimizer=None, error_func=None,
-                 input_active_probability=0.8, hidden_active_probability=0.5):
+                 input_active_probability=0.8, hidden_active_probability=0.5, dtype=None):
+        for active_probability in (input_active_probability, hidden_active_probability):
+            if active_probability <= 0.0 or active_probability > 1.0:
+                raise ValueError('0 < active_probability <= 1')
+
         if optimizer is None:
             # Don't use BFGS for Dropout
             # BFGS cannot effectively approximate hessian when problem
             # is constantly changing
-            optimizer = SteepestDescent()
+            # For the same reason, initial step is not extrapolated from the previous step.
+            # A large step can fit the masks of one step, instead of the dataset
+            optimizer = SteepestDescent(WolfeLineSearch(initial_step_getter=IncrPrevStep()))
 
-        super(DropoutMLP, self).__init__(shape, transfers, optimizer, error_func)
+        super(DropoutMLP, self).__init__(shape, transfers, optimizer, error_func, dtype)
 
         # Dropout hyperparams
         self._inp_act_prob = input_active_probability
         self._hid_act_prob = hidden_active_probability
 
-        # We modify transfers to disable hidden neurons
-        # To disable inputs, we need a transfer for the input vector
-        # To re-enable hidden neurons, we need to remember the original transfers
-        self._input_transfer = LinearTransfer()
-        self._real_transfers = self._transfers
-
-        # We perform the post-training procedure on the first activation after training
-        self._during_training = False
-        self._did_post_training = True
-
-    def activate(self, input_vec):
-        """Return the model outputs for given inputs."""
-        # Perform post-training procedure on the first activate after training.
-        # If done during train method, post-training will not occur when model is used
-        # incrementally
-        if (not self._during_training) and (not self._did_post_training):
-            self._post_training()
-            self._did_post_training = True
-
-        # Use input transfer to disable inputs (during training)
-        return super(DropoutMLP, self).activate(self._input_transfer(input_vec))
+    def _restore_scratch(self):
+        """Setup activation vectors, and empty dropout masks."""
+        super(DropoutMLP, self)._restore_scratch()
 
-    def _post_training(self):
-        # Activate all inputs
-        self._input_transfer = LinearTransfer()
+        # Dropout mask for inputs of each layer, from the most recent train_step
+        self._masks = None
 
-        # Activate all hidden
-        self._transfers = self._real_transfers
-
-        # Adjust weight matrices, based on active probabilities
-        for i, _ in enumerate(self._weight_matrices):
-            self._weight_matrices[i] *= self._hid_act_prob
+    def train(self, input_matrix, target_matrix, *args, **kwargs):
+        """Train model to converge on set of patterns, see Model.train."""
+        try:
+            super(DropoutMLP, self).train(input_matrix, target_matrix, *args, **kwargs)
+        finally:
+            # Masks are only needed during training
+            self._masks = None
 
     def train_step(self, input_matrix, target_matrix):
         """Adjust the model towards the targets for given inputs.
 
         Train on a mini-batch.
+        Dropout masks are drawn for each sample,
+        and shared by every objective evaluation of this step.
         """
-        # Enter training mode
-        self._during_training = True
-        self._did_post_training = False
-
-        # Disable inputs
-        self._input_transfer = DropoutTransfer(LinearTransfer(), self._inp_act_prob, self._shape[0])
+        self._draw_masks(len(input_matrix))
+        return super(DropoutMLP, self).train_step(input_matrix, target_matrix)
 
-        # Disable hidden neurons
-        self._disable_hiddens()
+    def _get_masks(self):
+        """Return dropout mask for the inputs of each layer, or None.
 
-        error = super(DropoutMLP, self).train_step(input_matrix, target_matrix)
+        Masks have a row for each sample, and None masks nothing.
+        Used by _forward_batch, during training.
+        """
+        return self._masks
 
-        # No longer in training mode
-        self._during_training = False
+    def _draw_masks(self, num_samples):
+        """Draw new dropout masks, with a row for each sample.
 
-        return error
+        Inputs and hidden neurons are masked, outputs are not.
+        Masks are written into the buffers of the previous train_step,
+        when the number of samples does not change.
+        """
+        active_probabilities = [self._inp_act_prob] + [self._hid_act_prob]*(len(self._shape)-2)
 
-    def _disable_hiddens(self):
-        """Disable random neurons in hidden layers."""
-        dropout_transfers = []
+        masks = []
+        for i, (active_probability, num_neurons) in enumerate(
+                zip(active_probabilities, self._shape[:-1])):
+            if active_probability == 1.0:
+                # All active, no need to mask
+                masks.append(None)
+                continue
 
-        # Don't disable output neurons
-        for transfer_func, num_neurons in zip(self._real_transfers[:-1], self._shape[1:-1]):
-            dropout_transfers.append(
-                DropoutTransfer(transfer_func, self._hid_act_prob, num_neurons)
-            )
+            mask = None if self._masks is None else self._masks[i]
+            if mask is None or mask.shape != (num_samples, num_neurons):
+                mask = numpy.empty((num_samples, num_neurons), dtype=self._dtype)
 
-        # Use original output transfer
-        dropout_transfers.append(self._real_transfers[-1])
+            # Inverted dropout, scale active neurons during training,
+            # instead of weights after training
+            _get_active_neurons(active_probability, mask.shape, out=mask)
+            mask *= 1.0 / active_probability
+            masks.append(mask)
 
-        self._transfers = dropout_transfers
+        self._masks = masks
 
 ################################################
 # Transfer functions
 ################################################
 class Transfer(object):
-    def __call__(self, input_vec):
+    def __call__(self, input_vec, out=None, cache=None):
+        """Return the output of this function.
+
+        Args:
+            out: Optional array to store output in, without allocating.
+                Can be input_vec, to compute in place.
+            cache: Optional dict, owned by the caller for one layer.
+                Intermediates stored in cache are reused by the next
+                derivative or backprop call with the same cache,
+                instead of computing them again.
+        """
         raise NotImplementedError()
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
@@ -369,56 +704,65 @@ class Transfer(object):
         """
         raise NotImplementedError()
 
-class DropoutTransfer(Transfer):
-    def __init__(self, transfer_func, active_probability, num_neurons):
-        self._transfer = transfer_func
-        self._active_neurons = _get_active_neurons(active_probability, num_neurons)
+    def backprop(self, input_vec, output_vec, error_vec, cache=None):
+        """Return derivative of error w.r.t. input_vec.
 
-    def __call__(self, input_vec):
-        return self._transfer(input_vec) * self._active_neurons
-
-    def derivative(self, input_vec, output_vec):
-        """Return the derivative of this function.
-
-        We take both input and output vector because
-        some derivatives can be more efficiently calculated from
-        the output of this function.
+        Args:
+            error_vec: Derivative of error w.r.t. output_vec.
         """
-        return self._transfer.derivative(input_vec, output_vec)
+        return _dot_diag_or_matrix(error_vec, self.derivative(input_vec, output_vec, cache))
+
+def _get_active_neurons(active_probability, shape, out=None):
+    """Return mask of active neurons, 1.0 if active, and 0.0 otherwise.
 
-def _get_active_neurons(active_probability, num_neurons):
-    """Return list of active neurons."""
+    Args:
+        shape: Number of neurons, or (num_samples, num_neurons) for a mask for each sample.
+        out: Optional float array of shape, to store mask in.
+    """
     if active_probability <= 0.0 or active_probability > 1.0:
         raise ValueError('0 < active_probability <= 1')
 
-    active_neurons = [1.0 if random.uniform(0, 1) < active_probability else 0.0
-                      for _ in range(num_neurons)]
+    random_matrix = numpy.random.random_sample(shape)
+    if out is None:
+        out = numpy.empty(random_matrix.shape)
+    numpy.less(random_matrix, active_probability, out=out)
 
-    # Do not allow none active
-    if 1.0 not in active_neurons:
-        active_neurons[random.randint(0, len(active_neurons)-1)] = 1.0
+    # Do not allow none active, for any sample
+    rows = out.reshape((-1, out.shape[-1]))
+    inactive_rows = numpy.flatnonzero(~rows.any(axis=1))
+    rows[inactive_rows, numpy.random.randint(0, rows.shape[1], len(inactive_rows))] = 1.0
 
-    return numpy.array(active_neurons)
+    return out
 
 class LinearTransfer(Transfer):
-    def __call__(self, input_vec):
-        return input_vec
+    def __call__(self, input_vec, out=None, cache=None):
+        if out is None:
+            return input_vec
+        numpy.copyto(out, input_vec)
+        return out
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
         some derivatives can be more efficiently calculated from
         the output of this function.
         """
-        return numpy.ones(input_vec.shape)
+        return numpy.ones_like(input_vec)
+
+    def backprop(self, input_vec, output_vec, error_vec, cache=None):
+        """Return derivative of error w.r.t. input_vec.
+
+        Derivative is 1, so error_vec is returned unchanged.
+        """
+        return error_vec
 
 
 class TanhTransfer(Transfer):
-    def __call__(self, input_vec):
-        return calculate.tanh(input_vec)
+    def __call__(self, input_vec, out=None, cache=None):
+        return calculate.tanh(input_vec, out=out)
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
@@ -433,17 +777,28 @@ class ReluTransfer(Transfer):
 
     Also known as softplus.
     """
-    def __call__(self, input_vec):
-        return calculate.relu(input_vec)
+    def __call__(self, input_vec, out=None, cache=None):
+        if cache is None:
+            return calculate.relu(input_vec, out=out)
+
+        # Derivative is computed with the same exponential,
+        # so backprop does not evaluate exp again
+        return calculate.relu(input_vec, out=out,
+                              dout=_get_cache_buffer(cache, 'derivative', input_vec),
+                              exp_out=_get_cache_buffer(cache, 'exp', input_vec))
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
         some derivatives can be more efficiently calculated from
         the output of this function.
         """
-        return calculate.drelu(input_vec)
+        if cache is not None and 'derivative' in cache:
+            return cache['derivative']
+
+        # Reuse output, instead of computing exp of input again
+        return calculate.drelu(input_vec, output_vec)
 
 
 class LogitTransfer(Transfer):
@@ -456,10 +811,10 @@ class GaussianTransfer(Transfer):
 
         self._variance = variance
 
-    def __call__(self, input_vec):
-        return calculate.gaussian(input_vec, self._variance)
+    def __call__(self, input_vec, out=None, cache=None):
+        return calculate.gaussian(input_vec, self._variance, out=out)
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
@@ -470,10 +825,10 @@ class GaussianTransfer(Transfer):
 
 
 class SoftmaxTransfer(Transfer):
-    def __call__(self, input_vec):
-        return calculate.softmax(input_vec)
+    def __call__(self, input_vec, out=None, cache=None):
+        return calculate.softmax(input_vec, out=out)
 
-    def derivative(self, input_vec, output_vec):
+    def derivative(self, input_vec, output_vec, cache=None):
         """Return the derivative of this function.
 
         We take both input and output vector because
@@ -481,3 +836,23 @@ class SoftmaxTransfer(Transfer):
         the output of this function.
         """
         return calculate.dsoftmax(output_vec)
+
+    def backprop(self, input_vec, output_vec, error_vec, cache=None):
+        """Return derivative of error w.r.t. input_vec.
+
+        Product with the softmax jacobian is computed in O(k),
+        without forming the jacobian.
+        """
+        return calculate.softmax_jvp(output_vec, error_vec)
+
+
+def _get_cache_buffer(cache, key, like):
+    """Return array in cache for key, with the shape and dtype of like.
+
+    Array is reused between calls, and replaced if like changes shape or dtype.
+    """
+    buffer_ = cache.get(key)
+    if buffer_ is None or buffer_.shape != like.shape or buffer_.dtype != like.dtype:
+        buffer_ = numpy.empty_like(like)
+        cache[key] = buffer_
+    return buffer_
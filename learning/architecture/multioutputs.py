@@ -25,11 +25,16 @@
 import copy
 import types
 import pickle
+import functools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import numpy
 
 from learning import Model
-from learning.rlearn import RLTable
+from learning.rlearn import ArrayRLTable
+from learning.architecture import mlp
+from learning.optimize import Problem
 
 class MultiOutputs(Model):
     """Ensemble enabling given model to return a higher dimensional output tensor.
@@ -47,10 +52,44 @@ class MultiOutputs(Model):
         models: list<Model> or Model; List of models,
             or Model that is duplicated by num_outputs
         num_outputs: How many components in target vectors.
+        executor: None, 'thread', or 'process'; How stored models are trained.
+            None trains stored models one after another.
+            'thread' trains stored models concurrently in a thread pool.
+            Effective when stored models spend most of their time in numpy,
+            which releases the GIL.
+            'process' trains stored models concurrently in a process pool.
+            Stored models are pickled to and from worker processes on every call,
+            including every train_step, so arguments passed to train must be picklable.
+            Best suited to train without shared_trunk,
+            where each worker trains a stored model to convergence in one call.
+            Workers are stopped when train returns. Call close to stop workers
+            started by train_step or activate_batch.
+        num_workers: Number of threads or processes used by executor.
+            Defaults to the number of cpus.
+        shared_trunk: If True, models must be an MLP, and all outputs share
+            the hidden layers of this MLP. Only the output layer is duplicated
+            for each output, so activation and training cost grows with the size
+            of the output layer, instead of the whole MLP.
     """
-    def __init__(self, models, num_outputs=None):
+    _parameter_attributes = ('_models', '_trunk')
+    # Pools cannot be pickled or copied, a new one is made when needed
+    _scratch_attributes = ('_pool',)
+
+    def __init__(self, models, num_outputs=None, executor=None, num_workers=None,
+                 shared_trunk=False):
         super(MultiOutputs, self).__init__()
 
+        if executor not in (None, 'thread', 'process'):
+            raise ValueError("executor must be one of (None, 'thread', 'process')")
+
+        # Optional hidden layers shared by all outputs
+        # Stored models are then output layers (heads), taking trunk outputs as inputs
+        self._trunk = None
+        if shared_trunk:
+            if type(models) != mlp.MLP:
+                raise ValueError('If shared_trunk is True, models must be an MLP')
+            self._trunk, models = mlp._split_trunk_head(models)
+
         if isinstance(models, Model):
             # Store copy of model for each output
             if num_outputs is None:
@@ -77,27 +116,59 @@ class MultiOutputs(Model):
 
         # Use reinforcement learning to select which output to update
         # We use different between new and old error as reward
-        self._rl_agent = RLTable([None], range(self._num_outputs),
+        self._rl_agent = ArrayRLTable([None], range(self._num_outputs),
                                  initial_reward=1.0, update_rate=0.25, reward_growth=0.01)
         self._errors = [None]*self._num_outputs
 
+        # Pool for training stored models concurrently
+        # Created when first needed, because pools cannot be pickled
+        self._executor = executor
+        self._num_workers = num_workers
+        self._pool = None
+
     def reset(self):
         """Reset this model."""
         # Reset RL agent
-        self._rl_agent = RLTable([None], range(self._num_outputs))
+        self._rl_agent = ArrayRLTable([None], range(self._num_outputs))
         self._errors = [None]*self._num_outputs
 
         # Reset each stored model
         for model in self._models:
             model.reset()
 
+        if self._trunk is not None:
+            self._trunk.reset()
+
     def activate(self, inputs):
         """Return the model outputs for given inputs.
 
         One output for each stored model.
         """
+        if self._trunk is not None:
+            inputs = self._trunk.activate(inputs)
+
         return [model.activate(inputs) for model in self._models]
 
+    def activate_batch(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix.
+
+        Outputs of each stored model are stacked in columns,
+        matching the shape of target_matrix.
+        workspace is given to the trunk and each stored model, see Model.activate_batch.
+        """
+        if self._trunk is not None:
+            input_matrix = self._trunk.activate_batch(input_matrix, workspace)
+
+        if self._executor == 'thread':
+            # Models are not copied by threads, so activating concurrently is cheap
+            # Each thread allocates, instead of sharing workspace
+            outputs = self._map(_activate_batch_model,
+                                [(model, input_matrix) for model in self._models])
+        else:
+            outputs = [model.activate_batch(input_matrix, workspace) for model in self._models]
+
+        return numpy.stack(outputs, axis=1)
+
     def train_step(self, input_matrix, target_matrix):
         """Adjust the model towards the targets for given inputs.
 
@@ -112,10 +183,20 @@ class MultiOutputs(Model):
         # NOTE: If a stored model doesn't return error, we default to updating all
         # every iteration, because we can't know which is best to update
         #   TODO: Update None errors every iteration, and select one from non-Nones
+        if self._trunk is not None:
+            # Heads learn from outputs of shared trunk
+            head_input_matrix = self._trunk.activate_batch(input_matrix)
+        else:
+            head_input_matrix = input_matrix
+
         if None in self._errors:
-            self._update_all_outputs(input_matrix, target_matrix)
+            self._update_all_outputs(head_input_matrix, target_matrix)
         else:
-            self._update_one_output(input_matrix, target_matrix)
+            self._update_one_output(head_input_matrix, target_matrix)
+
+        if self._trunk is not None:
+            # Shared trunk learns from error of all heads
+            self._update_trunk(input_matrix, target_matrix)
 
         try:
             return sum(self._errors) / len(self._errors)
@@ -128,18 +209,50 @@ class MultiOutputs(Model):
         if len(target_matrix[0]) != self._num_outputs:
             raise ValueError('Target matrix column does not match expected number of outputs')
 
-        # Train each stored model
-        for i, (model, targets) in enumerate(zip(self._models, _transpose_rowcol(target_matrix))):
+        try:
+            self._train(input_matrix, target_matrix, *args, **kwargs)
+        finally:
+            # Don't keep workers alive after training
+            self.close()
+
+    def _train(self, input_matrix, target_matrix, *args, **kwargs):
+        """Train model, see train."""
+        if self._trunk is not None:
+            # Heads cannot train independently when sharing a trunk,
+            # so train all together, with train_step
+            return super(MultiOutputs, self).train(input_matrix, target_matrix, *args, **kwargs)
+
+        if self._executor is None:
+            # Train each stored model
+            for i, (model, targets) in enumerate(zip(self._models, _transpose_rowcol(target_matrix))):
+                if self.logging:
+                    if i != 0:
+                        print
+                    print 'Training Model %d:' % (i+1)
+                else:
+                    model.logging = self.logging
+                model.train(input_matrix, targets, *args, **kwargs)
+        else:
+            # Train all stored models concurrently
+            # Stored models do not log, because their output would interleave
             if self.logging:
-                if i != 0:
-                    print
-                print 'Training Model %d:' % (i+1)
-            else:
-                model.logging = self.logging
-            model.train(input_matrix, targets, *args, **kwargs)
+                print 'Training %d Models with %s executor' % (self._num_outputs, self._executor)
+            for model in self._models:
+                model.logging = False
+
+            self._models = self._map(
+                _train_model,
+                [(model, input_matrix, targets, args, kwargs)
+                 for model, targets in zip(self._models, _transpose_rowcol(target_matrix))])
 
         self.iteration = sum([model.iteration for model in self._models])
 
+    def _restore_snapshot(self, snapshot):
+        """Restore this model to snapshot returned by _take_snapshot."""
+        # Restored model does not own the current pool
+        self.close()
+        super(MultiOutputs, self)._restore_snapshot(snapshot)
+
     def serialize(self):
         """Convert model into string.
 
@@ -150,7 +263,7 @@ class MultiOutputs(Model):
         serialized_models = [(type(model), model.serialize()) for model in self._models]
 
         # Pickle all other attributes
-        attributes = copy.copy(self.__dict__)
+        attributes = self.__getstate__()
         del attributes['_models']
 
         return pickle.dumps((serialized_models, attributes), protocol=2)
@@ -166,7 +279,7 @@ class MultiOutputs(Model):
 
         # Make model, from serialized models and attributes
         model = MultiOutputs.__new__(MultiOutputs)
-        model.__dict__ = attributes
+        model.__setstate__(attributes)
 
         # unserialize each model
         model._models = [class_.unserialize(model_str) for class_, model_str in serialized_models]
@@ -194,8 +307,74 @@ class MultiOutputs(Model):
 
     def _update_all_outputs(self, input_matrix, target_matrix):
         """Update all stored models."""
-        for i, (model, targets) in enumerate(zip(self._models, _transpose_rowcol(target_matrix))):
-            self._errors[i] = model.train_step(input_matrix, targets)
+        results = self._map(
+            _train_step_model,
+            [(model, input_matrix, targets)
+             for model, targets in zip(self._models, _transpose_rowcol(target_matrix))])
+
+        # Process workers return copies of stored models
+        for i, (model, error) in enumerate(results):
+            self._models[i] = model
+            self._errors[i] = error
+
+    def _update_trunk(self, input_matrix, target_matrix):
+        """Update shared trunk, towards minimizing mean error of all heads."""
+        head_target_matrices = list(_transpose_rowcol(target_matrix))
+        problem = Problem(
+            obj_func=functools.partial(mlp._trunk_obj, self._trunk, self._models,
+                                       input_matrix, head_target_matrices),
+            obj_jac_func=functools.partial(mlp._trunk_obj_jac, self._trunk, self._models,
+                                           input_matrix, head_target_matrices))
+
+        _, flat_weights = self._trunk._optimizer.next(
+            problem, mlp._flatten(self._trunk._weight_matrices))
+        self._trunk._weight_matrices = mlp._unflatten_weights(flat_weights, self._trunk._shape)
+
+    def _map(self, func, args_list):
+        """Return func applied to each item in args_list, using executor."""
+        if self._executor is None:
+            return map(func, args_list)
+
+        if self._pool is None:
+            if self._executor == 'thread':
+                self._pool = ThreadPool(self._num_workers)
+            else:
+                self._pool = multiprocessing.Pool(self._num_workers)
+        return self._pool.map(func, args_list)
+
+    def close(self):
+        """Stop the workers of executor, if any.
+
+        Workers are started when first needed, and stopped when train returns.
+        Call close after using train_step or activate_batch directly.
+        A new pool is started if this model is used again.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+################################
+# Executor functions
+################################
+# NOTE: Functions are defined at module level, so process pools can pickle them.
+# Each returns the given model, because process pools modify a copy.
+def _train_model(args):
+    """Train model, and return it."""
+    model, input_matrix, targets, train_args, train_kwargs = args
+    model.train(input_matrix, targets, *train_args, **train_kwargs)
+    return model
+
+def _train_step_model(args):
+    """Perform a train_step with model, and return (model, error)."""
+    model, input_matrix, targets = args
+    error = model.train_step(input_matrix, targets)
+    return model, error
+
+def _activate_batch_model(args):
+    """Return model outputs for input_matrix."""
+    model, input_matrix = args
+    return model.activate_batch(input_matrix)
 
 def _get_reward(old_error, new_error):
     """Return RL agent reward.
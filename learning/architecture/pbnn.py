@@ -25,13 +25,26 @@
 import numpy
 
 from learning import calculate
+from learning import dtypes
+from learning import frozen
 from learning import Model
-from learning import calculate
 
 class PBNN(Model):
-    def __init__(self, variance=None, scale_by_similarity=True, scale_by_class=True):
+    """Probabilistic neural network.
+
+    Targets can be onehot vectors, or integer class indices.
+
+    Args:
+        dtype: 'float32' or 'float64'; Type of stored inputs and targets.
+            Defaults to dtypes.get_default_dtype().
+    """
+    _parameter_attributes = ('_input_matrix', '_target_matrix', '_target_totals')
+
+    def __init__(self, variance=None, scale_by_similarity=True, scale_by_class=True, dtype=None):
         super(PBNN, self).__init__()
 
+        self._dtype = dtypes.get_dtype(dtype)
+
         if variance is None:
             # TODO: Adjust it during training
             self._variance = 1.0
@@ -41,8 +54,8 @@ class PBNN(Model):
         self._scale_by_similarity = scale_by_similarity
 
         self._input_matrix = None # Inputs stored when training
-        self._target_matrix = None # Targets stored when training
-        self._target_totals = None # Sum of rows in target matrix
+        self._target_matrix = None # Targets stored when training, matrix or class indices
+        self._target_totals = None # Sum of rows in target matrix, or count of each class
 
     def reset(self):
         """Reset this model."""
@@ -50,13 +63,30 @@ class PBNN(Model):
         self._target_matrix = None
         self._target_totals = None
 
+    def freeze(self, dtype=None):
+        """Return an inference-only copy of this model, see learning.frozen.
+
+        Stored inputs are kept, with precomputed norms and class scales.
+        """
+        if self._input_matrix is None:
+            raise ValueError('PBNN must be trained before freezing')
+        return frozen.FrozenPBNN(self._input_matrix, self._target_matrix, self._target_totals,
+                                 self._variance, self._scale_by_similarity, self._scale_by_class,
+                                 self._dtype if dtype is None else dtypes.get_dtype(dtype))
+
     def activate(self, inputs):
         """Return the model outputs for given inputs."""
         # Calculate similarity between input and each stored input
         # (gaussian of each distance)
+        inputs = numpy.asarray(inputs, dtype=self._dtype)
         similarities = calculate.gaussian(_distances(inputs, self._input_matrix), self._variance)
         # Then scale each stored target by corresponding similarity, and sum
-        output_vec = _weighted_sum_rows(self._target_matrix, similarities)
+        if self._target_matrix.ndim == 1:
+            # Class indices, sum similarities of each class
+            output_vec = numpy.bincount(self._target_matrix, weights=similarities,
+                                        minlength=len(self._target_totals)).astype(self._dtype)
+        else:
+            output_vec = _weighted_sum_rows(self._target_matrix, similarities)
 
         if self._scale_by_similarity:
             output_vec /= numpy.sum(similarities)
@@ -73,13 +103,16 @@ class PBNN(Model):
 
     def train(self, input_matrix, target_matrix, *args, **kwargs):
         # Store inputs to recall later
-        self._input_matrix = numpy.copy(input_matrix)
+        self._input_matrix = numpy.array(input_matrix, dtype=self._dtype)
 
         # Store targets to recall later
-        self._target_matrix = numpy.copy(target_matrix)
+        self._target_matrix = numpy.array(dtypes.as_target_matrix(target_matrix, self._dtype))
 
         # Calculate target sum now, for efficiency
-        self._target_totals = numpy.sum(self._target_matrix, axis=0)
+        if self._target_matrix.ndim == 1:
+            self._target_totals = numpy.bincount(self._target_matrix).astype(self._dtype)
+        else:
+            self._target_totals = numpy.sum(self._target_matrix, axis=0)
 
 def _distances(x_vec, y_matrix):
     """Return vector of distances between x_vec and each y_matrix row."""
@@ -30,25 +30,38 @@ import numpy
 from learning import Model
 from learning import SOM
 from learning import calculate
+from learning import dtypes
+from learning import frozen
 from learning.optimize import Problem, BFGS, SteepestDescent
 from learning.error import MSE
 
 INITIAL_WEIGHTS_RANGE = 0.25
 
 class RBF(Model):
-    """Radial Basis Function network."""
+    """Radial Basis Function network.
+
+    Args:
+        dtype: 'float32' or 'float64'; Type of weights, clusters, and jacobians.
+            Defaults to dtypes.get_default_dtype().
+    """
+    _parameter_attributes = ('_weight_matrix', '_som')
+    _training_attributes = ('_optimizer',)
+
     def __init__(self, attributes, num_clusters, num_outputs,
                  optimizer=None, error_func=None,
                  variance=None, scale_by_similarity=True,
                  pre_train_clusters=False,
-                 move_rate=0.1, neighborhood=2, neighbor_move_rate=1.0):
+                 move_rate=0.1, neighborhood=2, neighbor_move_rate=1.0, dtype=None):
         super(RBF, self).__init__()
 
+        self._dtype = dtypes.get_dtype(dtype)
+
         # Clustering algorithm
         self._pre_train_clusters = pre_train_clusters
         self._som = SOM(
             attributes, num_clusters,
-            move_rate=move_rate, neighborhood=neighborhood, neighbor_move_rate=neighbor_move_rate)
+            move_rate=move_rate, neighborhood=neighborhood, neighbor_move_rate=neighbor_move_rate,
+            dtype=self._dtype)
 
         # Variance for gaussian
         if variance is None:
@@ -85,10 +98,6 @@ class RBF(Model):
         # Optional scaling output by total gaussian similarity
         self._scale_by_similarity = scale_by_similarity
 
-        # For training
-        self._similarities = None
-        self._total_similarity = None
-
     def reset(self):
         """Reset this model."""
         self._som.reset()
@@ -96,27 +105,52 @@ class RBF(Model):
 
         self._weight_matrix = self._random_weight_matrix(self._weight_matrix.shape)
 
-        self._similarities = None
-        self._total_similarity = None
-
     def _random_weight_matrix(self, shape):
         """Return a random weight matrix."""
         # TODO: Random weight matrix should be a function user can pass in
-        return (2*numpy.random.random(shape) - 1)*INITIAL_WEIGHTS_RANGE
+        return ((2*numpy.random.random(shape) - 1)*INITIAL_WEIGHTS_RANGE).astype(self._dtype)
+
+    def freeze(self, dtype=None):
+        """Return an inference-only copy of this model, see learning.frozen."""
+        return frozen.FrozenRBF(self._som._weights, self._weight_matrix, self._variance,
+                                self._scale_by_similarity,
+                                self._dtype if dtype is None else dtypes.get_dtype(dtype))
 
-    def activate(self, inputs):
-        """Return the model outputs for given inputs."""
-        # Get distance to each cluster center, and apply gaussian for similarity
-        self._similarities = calculate.gaussian(self._som.activate(inputs), self._variance)
+    def activate(self, inputs, workspace=None):
+        """Return the model outputs for given inputs.
 
+        Does not modify this model, see Model.activate_batch for workspace.
+        """
+        return self.activate_batch(numpy.asarray(inputs)[None, :], workspace)[0]
+
+    def activate_batch(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix.
+
+        Does not modify this model, see Model.activate_batch for workspace.
+        """
+        return self._get_output_matrix(self._get_similarity_matrix(input_matrix, workspace),
+                                       workspace)
+
+    def _get_similarity_matrix(self, input_matrix, workspace=None):
+        """Return gaussian similarity of each row of input_matrix to each cluster center."""
+        # Distances are not needed after gaussian, so gaussian is applied in place
+        # Squared distances are used directly, instead of taking sqrt and squaring again
+        squared_distances = self._som._squared_distance_matrix(input_matrix, workspace)
+        return calculate.gaussian_of_squared(squared_distances, self._variance,
+                                             out=squared_distances)
+
+    def _get_output_matrix(self, similarity_matrix, workspace=None):
+        """Return outputs for each row of similarity_matrix."""
         # Get output by weighted summation of similarities, weighted by weights
-        output = numpy.dot(self._similarities, self._weight_matrix)
+        out = None if workspace is None else workspace.get_buffer(
+            (id(self), 'outputs'), (len(similarity_matrix), self._weight_matrix.shape[1]),
+            numpy.result_type(similarity_matrix, self._weight_matrix))
+        output_matrix = numpy.dot(similarity_matrix, self._weight_matrix, out=out)
 
         if self._scale_by_similarity:
-            self._total_similarity = numpy.sum(self._similarities)
-            output /= self._total_similarity
+            output_matrix /= numpy.sum(similarity_matrix, axis=1, keepdims=True)
 
-        return output
+        return output_matrix
 
     def train(self, *args, **kwargs):
         """Train model to converge on a dataset.
@@ -148,6 +182,10 @@ class RBF(Model):
         Optional.
         Model must either override train_step or implement _train_increment.
         """
+        # Targets in another dtype would promote jacobians, and then weights
+        input_matrix = numpy.asarray(input_matrix, dtype=self._dtype)
+        target_matrix = dtypes.as_target_matrix(target_matrix, self._dtype)
+
         # Train RBF
         error, flat_weights = self._optimizer.next(
             Problem(obj_func=lambda xk: self._get_obj(xk, input_matrix, target_matrix),
@@ -164,8 +202,7 @@ class RBF(Model):
     def _get_obj(self, flat_weights, input_matrix, target_matrix):
         """Helper function for Optimizer."""
         self._weight_matrix = flat_weights.reshape(self._weight_matrix.shape)
-        return numpy.mean([self._error_func(self.activate(inp_vec), tar_vec)
-                           for inp_vec, tar_vec in zip(input_matrix, target_matrix)])
+        return self._error_func(self.activate_batch(input_matrix), target_matrix)
 
     def _get_obj_jac(self, flat_weights, input_matrix, target_matrix):
         """Helper function for Optimizer."""
@@ -175,19 +212,14 @@ class RBF(Model):
 
     def _get_jacobian(self, input_matrix, target_matrix):
         """Return jacobian and error for given dataset."""
-        errors, jacobians = zip(*[self._get_sample_jacobian(input_vec, target_vec)
-                                  for input_vec, target_vec in zip(input_matrix, target_matrix)])
-        return numpy.mean(errors), numpy.mean(jacobians, axis=0)
-
-    def _get_sample_jacobian(self, input_vec, target_vec):
-        """Return jacobian and error for given sample."""
-        output_vec = self.activate(input_vec)
+        similarity_matrix = self._get_similarity_matrix(input_matrix)
 
-        error, error_jac = self._error_func.derivative(output_vec, target_vec)
+        # Derivative of mean error w.r.t. each output
+        error, error_jac = self._error_func.derivative(
+            self._get_output_matrix(similarity_matrix), target_matrix)
 
         if self._scale_by_similarity:
-            error_jac /= self._total_similarity
-
-        jacobian = self._similarities[:, None].dot(error_jac[None, :])
+            error_jac /= numpy.sum(similarity_matrix, axis=1, keepdims=True)
 
-        return error, jacobian
+        # Sum of outer product of similarities and error_jac, for each sample
+        return error, similarity_matrix.T.dot(error_jac)
@@ -28,42 +28,71 @@ import numpy
 
 from learning import Model
 from learning import calculate
+from learning import dtypes
 
 class SOM(Model):
+    """Self-organizing map.
+
+    Args:
+        dtype: 'float32' or 'float64'; Type of neuron weights.
+            Defaults to dtypes.get_default_dtype().
+    """
+    _parameter_attributes = ('_weights',)
+    _scratch_attributes = ('_distances',)
+
     def __init__(self, attributes, neurons, 
                  move_rate=0.1, neighborhood=2, neighbor_move_rate=1.0,
-                 initial_weights_range=1.0):
+                 initial_weights_range=1.0, dtype=None):
         super(SOM, self).__init__()
 
         self.move_rate = move_rate
         self.neighborhood = neighborhood
         self.neighbor_move_rate = neighbor_move_rate
         self.initial_weights_range = initial_weights_range
+        self._dtype = dtypes.get_dtype(dtype)
 
         self._size = (neurons, attributes)
-        self._weights = numpy.zeros(self._size)
-        self._distances = numpy.zeros(neurons)
+        self._weights = numpy.zeros(self._size, dtype=self._dtype)
+        self._distances = numpy.zeros(neurons, dtype=self._dtype)
 
         self.reset()
 
     def reset(self):
         """Reset this model."""
         # Randomize weights, between -1 and 1
-        self._weights = (2*numpy.random.random(self._size) - 1)*self.initial_weights_range
-        self._distances = numpy.zeros(self._size)
+        self._weights = ((2*numpy.random.random(self._size) - 1)
+                         *self.initial_weights_range).astype(self._dtype)
+        self._distances = numpy.zeros(self._size, dtype=self._dtype)
 
     def activate(self, inputs):
         """Return the model outputs for given inputs."""
-        diffs = inputs - self._weights
+        diffs = numpy.asarray(inputs, dtype=self._dtype) - self._weights
         self._distances = [numpy.sqrt(d.dot(d)) for d in diffs]
         return numpy.array(self._distances)
 
+    def activate_batch(self, input_matrix, workspace=None):
+        """Return distance of each row of input_matrix to each neuron.
+
+        Does not modify this model, see Model.activate_batch for workspace.
+        """
+        squared_distances = self._squared_distance_matrix(input_matrix, workspace)
+        return numpy.sqrt(squared_distances, out=squared_distances)
+
+    def _squared_distance_matrix(self, input_matrix, workspace=None):
+        """Return squared distance of each row of input_matrix to each neuron."""
+        input_matrix = numpy.asarray(input_matrix, dtype=self._dtype)
+
+        out = None if workspace is None else workspace.get_buffer(
+            (id(self), 'distances'), (len(input_matrix), self._size[0]), self._dtype)
+        return calculate.squared_distance_matrix(input_matrix, self._weights, out=out)
+
     def _train_increment(self, input_vec, target_vec):
         """Train on a single input, target pair.
 
         Optional.
         Model must either override train_step or implement _train_increment.
         """
+        input_vec = numpy.asarray(input_vec, dtype=self._dtype)
         self.activate(input_vec)
         self._move_neurons(input_vec)
 
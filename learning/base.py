@@ -25,10 +25,13 @@
 import random
 import pickle
 import numbers
+import multiprocessing
 
 import numpy
 
 from learning import validation
+from learning import dtypes
+from learning import modelfile
 
 ##############################
 # Pattern selection functions
@@ -65,6 +68,18 @@ def select_random(input_matrix, target_matrix, size=None):
 
 class Model(object):
     """A supervised learning model."""
+    # Attributes holding learned parameters, for binary serialization (save).
+    # Each attribute is a numpy array, a Model, None, or a list or tuple of these.
+    _parameter_attributes = ()
+
+    # Attributes holding temporary values, such as activation buffers.
+    # These are never pickled or saved, and are rebuilt by _restore_scratch.
+    _scratch_attributes = ()
+
+    # Attributes only needed to continue training, such as optimizers.
+    # Each must have a reset method, and is saved in reset state.
+    _training_attributes = ()
+
     def __init__(self):
         self._post_pattern_callback = None
 
@@ -83,18 +98,55 @@ class Model(object):
         """Return the model outputs for given inputs."""
         raise NotImplementedError()
 
+    def activate_batch(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix.
+
+        Optional: Override for models that can activate many inputs at once.
+
+        Args:
+            input_matrix: A matrix with samples in rows and attributes in columns.
+            workspace: Optional Workspace, for buffers of this call.
+                Models that use a workspace are not modified by activate_batch,
+                so many threads can activate one model at once, each with its own Workspace.
+                Returned outputs may be stored in workspace,
+                and overwritten by the next call with the same workspace.
+                Ignored by the default implementation, which calls activate for each row.
+
+        Returns:
+            numpy.array; Outputs stacked in rows.
+        """
+        return numpy.array([self.activate(input_vec) for input_vec in input_matrix])
+
+    def freeze(self, dtype=None):
+        """Return an inference-only copy of this model, see learning.frozen.
+
+        Optional: Override for models that can be frozen.
+
+        Args:
+            dtype: 'float32' or 'float64'; Type of frozen parameters.
+                Defaults to type of this model.
+
+        Returns:
+            learning.frozen.FrozenModel; Model with only a batched predict method.
+        """
+        raise NotImplementedError()
+
     def train(self, input_matrix, target_matrix,
               iterations=1000, retries=0, error_break=0.002,
               error_stagnant_distance=5, error_stagnant_threshold=0.00001,
               error_improve_iters=20,
-              pattern_select_func=select_iterative, post_pattern_callback=None):
+              pattern_select_func=select_iterative, post_pattern_callback=None,
+              parallel_retries=False):
         """Train model to converge on a dataset.
 
         Note: Override this method for batch learning models.
 
         Args:
             input_matrix: A matrix with samples in rows and attributes in columns.
+                Or a learning.data.stream.ChunkedDataset, for datasets larger than memory.
+                Each iteration is then one epoch, with train_step on every chunk.
             target_matrix: A matrix with samples in rows and target values in columns.
+                None when input_matrix is a ChunkedDataset.
             iterations: Max iterations to train model.
             retries: Number of times to reset model and retries if it does not converge.
                 Convergence is defined as reaching error_break.
@@ -107,20 +159,29 @@ class Model(object):
                 or training ends.
             pattern_select_func: Function that takes (input_matrix, target_matrix),
                 and returns a selection of rows. Use partial function to embed arguments.
+            parallel_retries: If True, run all attempts concurrently in a process pool,
+                and keep the best. Model and all arguments must be picklable.
+                Ignored for models that do not declare _parameter_attributes.
         """
         # Make sure matrix parameters are np arrays
         self._reset_bookkeeping()
         self._post_pattern_callback = post_pattern_callback # For calling in other method
 
+        attempt_args = (input_matrix, target_matrix,
+                        iterations, error_break, error_stagnant_distance, error_stagnant_threshold,
+                        error_improve_iters, pattern_select_func, post_pattern_callback)
+        if (parallel_retries and retries > 0
+                and _get_parameter_arrays(self) is not None):
+            self._train_parallel_attempts(retries+1, attempt_args)
+            return
+
         # Initialize variables for retries
-        best_try = (float('inf'), None) # (error, serialized_model)
+        best_error = float('inf')
+        best_snapshot = None
 
         # Learn on each pattern for each iteration
         for attempt in range(retries+1):
-            success = self._train_attempt(
-                input_matrix, target_matrix,
-                iterations, error_break, error_stagnant_distance, error_stagnant_threshold,
-                error_improve_iters, pattern_select_func, post_pattern_callback)
+            success = self._train_attempt(*attempt_args)
 
             # Skip all the tracking and whatnot if there are no retries (optimization)
             if retries == 0:
@@ -132,22 +193,23 @@ class Model(object):
                 return
 
             # TODO: Should use user provided error function
-            attempt_error = validation.get_error(self, input_matrix, target_matrix)
+            attempt_error = self._get_dataset_error(input_matrix, target_matrix)
 
             # End when out of retries, use best attempt so far
             if attempt >= retries:
-                if attempt_error < best_try[0]:
+                if attempt_error < best_error:
                     # Last attempt was our best
                     return
                 else:
                     # Use best attempt
-                    best_model = self.unserialize(best_try[1])
-                    self.__dict__ = best_model.__dict__
+                    self._restore_snapshot(best_snapshot)
                     return
 
             # Keep track of best attempt
-            if attempt_error < best_try[0]:
-                best_try = (attempt_error, self.serialize())
+            # Reuse buffers of previous best attempt
+            if attempt_error < best_error:
+                best_error = attempt_error
+                best_snapshot = self._take_snapshot(best_snapshot)
 
             # Reset for next attempt
             self.reset()
@@ -168,10 +230,14 @@ class Model(object):
         iters_since_improvement = 0
 
         for self.iteration in range(1, iterations+1):
-            selected_patterns = pattern_select_func(input_matrix, target_matrix)
+            if _is_chunked(input_matrix):
+                # One epoch of chunks
+                error = self._train_epoch(input_matrix)
+            else:
+                selected_patterns = pattern_select_func(input_matrix, target_matrix)
 
-            # Learn each selected pattern
-            error = self.train_step(*selected_patterns)
+                # Learn each selected pattern
+                error = self.train_step(*selected_patterns)
 
             # Logging and breaking
             if self.logging:
@@ -183,7 +249,7 @@ class Model(object):
                         # Perform a second test on whole dataset
                         # incase model is training on mini-batches
                         # TODO: Should use user provided error function?
-                        and validation.get_error(self, input_matrix, target_matrix) <= error_break):
+                        and self._get_dataset_error(input_matrix, target_matrix) <= error_break):
                     return True
 
                 # Skip the rest if we're already out of iterations (optimization)
@@ -212,6 +278,111 @@ class Model(object):
 
         return False
 
+    def _train_parallel_attempts(self, num_attempts, attempt_args):
+        """Run training attempts in a process pool, and keep the best.
+
+        The first attempt to converge is used, like sequential retries.
+        Otherwise, the attempt with the lowest error is used.
+        """
+        # Each attempt needs its own random state
+        seeds = [random.randint(0, 2**31-1) for _ in range(num_attempts)]
+
+        pool = multiprocessing.Pool(min(num_attempts, multiprocessing.cpu_count()))
+        try:
+            results = pool.map(
+                _train_attempt_worker,
+                [(self, attempt, seed, attempt_args) for attempt, seed in enumerate(seeds)])
+        finally:
+            pool.close()
+            pool.join()
+
+        # results: [(success, error, snapshot)]
+        converged = [result for result in results if result[0]]
+        if converged:
+            _, _, snapshot = converged[0]
+        else:
+            _, _, snapshot = min(results, key=lambda result: result[1])
+
+        self._restore_snapshot(snapshot)
+
+    def _train_epoch(self, dataset):
+        """Call train_step on each chunk of a ChunkedDataset.
+
+        Return mean error of all samples, or None if train_step does not return error.
+        """
+        total_error = 0.0
+        num_samples = 0
+        for input_matrix, target_matrix in dataset.iter_chunks():
+            error = self.train_step(input_matrix, target_matrix)
+            if error is None:
+                total_error = None
+            elif total_error is not None:
+                total_error += error*len(input_matrix)
+            num_samples += len(input_matrix)
+
+        if total_error is None:
+            return None
+        return total_error / num_samples
+
+    def _get_dataset_error(self, input_matrix, target_matrix):
+        """Return mean squared error of this model on dataset.
+
+        Uses activate_batch and whole matrix operations,
+        unless outputs do not match the shape of target_matrix,
+        see validation.get_error.
+        """
+        if _is_chunked(input_matrix):
+            # Mean of all samples in all chunks
+            total_error = 0.0
+            num_samples = 0
+            for chunk_inputs, chunk_targets in input_matrix.iter_chunks():
+                total_error += (self._get_dataset_error(chunk_inputs, chunk_targets)
+                                * len(chunk_inputs))
+                num_samples += len(chunk_inputs)
+            return total_error / num_samples
+
+        return validation.get_error(self, input_matrix, target_matrix)
+
+    def _take_snapshot(self, snapshot=None):
+        """Return a snapshot of this model, for _restore_snapshot.
+
+        Only parameter arrays and bookkeeping are copied, into the buffers of given snapshot
+        when possible. Models that do not declare _parameter_attributes,
+        or that contain nested models, are serialized,
+        because nested models carry their own training state, ex. optimizers.
+
+        Returns:
+            (parameters, iteration); parameters is a list of arrays, or a serialized model.
+        """
+        parameters = _get_parameter_arrays(self)
+        if parameters is None or _has_nested_models(self):
+            return (self.serialize(), self.iteration)
+
+        buffers = None if snapshot is None else snapshot[0]
+        if (buffers is None or isinstance(buffers, str)
+                or [buffer_.shape for buffer_ in buffers] != [array.shape for array in parameters]):
+            buffers = [numpy.empty_like(array) for array in parameters]
+
+        for buffer_, array in zip(buffers, parameters):
+            numpy.copyto(buffer_, array)
+        return (buffers, self.iteration)
+
+    def _restore_snapshot(self, snapshot):
+        """Restore this model to snapshot returned by _take_snapshot.
+
+        Snapshot arrays are used by this model, and should not be reused.
+        """
+        parameters, iteration = snapshot
+        if isinstance(parameters, str):
+            self.__dict__ = self.unserialize(parameters).__dict__
+        else:
+            _set_parameter_arrays(self, iter(parameters))
+
+            # Training state, ex. optimizer, refers to the parameters of another attempt
+            for attribute in self._training_attributes:
+                getattr(self, attribute).reset()
+
+        self.iteration = iteration
 
     def train_step(self, input_matrix, target_matrix):
         """Adjust the model towards the targets for given inputs.
@@ -258,6 +429,49 @@ class Model(object):
         """
         raise NotImplementedError()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in self._scratch_attributes:
+            state.pop(attribute, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._restore_scratch()
+
+    def _restore_scratch(self):
+        """Rebuild scratch attributes, after unpickling or loading.
+
+        Optional: Override for models with _scratch_attributes.
+        """
+        for attribute in self._scratch_attributes:
+            setattr(self, attribute, None)
+
+    def save(self, file_name):
+        """Save model to file, in compact binary format.
+
+        Only parameters are stored, as raw little-endian arrays.
+        See learning.modelfile.
+        """
+        modelfile.save(self, file_name)
+
+    @classmethod
+    def load(cls, file_name, mmap_mode='c'):
+        """Load model saved with Model.save.
+
+        Args:
+            file_name: Path of saved model.
+            mmap_mode: None, 'r', or 'c'; Memory map parameter arrays,
+                instead of reading them into memory. See modelfile.load.
+
+        Returns:
+            Model; A Model object.
+        """
+        model = modelfile.load(file_name, mmap_mode)
+        if type(model) != cls:
+            raise ValueError('%s does not match this class' % file_name)
+        return model
+
     def serialize(self):
         """Convert model into string.
 
@@ -292,6 +506,118 @@ class Model(object):
             print(tar_vec, '->', self.activate(inp_vec))
 
 
+class Workspace(object):
+    """Buffers for activating models, owned by one caller, such as a thread.
+
+    Give each thread its own Workspace, to activate a shared model without locking.
+    Buffers are allocated on first use, and reused while their shape does not change.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get_buffer(self, key, shape, dtype):
+        """Return array of shape and dtype for key, with uninitialized values.
+
+        The same array is returned for the same key, shape, and dtype.
+        """
+        buffer_ = self._buffers.get(key)
+        if buffer_ is None or buffer_.shape != shape or buffer_.dtype != dtype:
+            buffer_ = numpy.empty(shape, dtype=dtype)
+            self._buffers[key] = buffer_
+        return buffer_
+
+
+def _is_chunked(dataset):
+    """Return True if dataset is a ChunkedDataset."""
+    # Duck typed, so base does not depend on learning.data
+    return hasattr(dataset, 'iter_chunks')
+
+def _train_attempt_worker(args):
+    """Train a copy of model in a worker process.
+
+    Returns (success, error, snapshot).
+    """
+    model, attempt, seed, attempt_args = args
+    random.seed(seed)
+    numpy.random.seed(seed)
+
+    # First attempt continues from given model, like sequential retries
+    if attempt > 0:
+        model.reset()
+
+    success = model._train_attempt(*attempt_args)
+    input_matrix, target_matrix = attempt_args[:2]
+    return (success, model._get_dataset_error(input_matrix, target_matrix),
+            model._take_snapshot())
+
+
+##############################
+# Parameter arrays
+##############################
+def _get_parameter_arrays(model):
+    """Return list of all parameter arrays of model, including nested models.
+
+    Returns None if model, or a nested model, does not declare _parameter_attributes.
+    """
+    if not model._parameter_attributes:
+        return None
+
+    arrays = []
+    for attribute in model._parameter_attributes:
+        if not _add_parameter_arrays(getattr(model, attribute), arrays):
+            return None
+    return arrays
+
+def _has_nested_models(model):
+    """Return True if a parameter attribute of model contains a Model."""
+    return any(_contains_model(getattr(model, attribute))
+               for attribute in model._parameter_attributes)
+
+def _contains_model(value):
+    """Return True if value is, or a list or tuple of value contains, a Model."""
+    if isinstance(value, Model):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(_contains_model(item) for item in value)
+    return False
+
+def _add_parameter_arrays(value, arrays):
+    """Append all arrays in value to arrays.
+
+    Return False if value contains a model without _parameter_attributes.
+    """
+    if isinstance(value, numpy.ndarray):
+        arrays.append(value)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if not _add_parameter_arrays(item, arrays):
+                return False
+    elif isinstance(value, Model):
+        model_arrays = _get_parameter_arrays(value)
+        if model_arrays is None:
+            return False
+        arrays.extend(model_arrays)
+    return True
+
+def _set_parameter_arrays(model, arrays_iter):
+    """Replace each parameter array of model with the next array from arrays_iter.
+
+    Order matches _get_parameter_arrays.
+    """
+    for attribute in model._parameter_attributes:
+        setattr(model, attribute,
+                _replace_parameter_arrays(getattr(model, attribute), arrays_iter))
+
+def _replace_parameter_arrays(value, arrays_iter):
+    """Return value with each array replaced with the next array from arrays_iter."""
+    if isinstance(value, numpy.ndarray):
+        return next(arrays_iter)
+    elif isinstance(value, (list, tuple)):
+        return type(value)([_replace_parameter_arrays(item, arrays_iter) for item in value])
+    elif isinstance(value, Model):
+        _set_parameter_arrays(value, arrays_iter)
+    return value
+
 def _all_close(values, other_value, threshold):
     """Return true if all values are within threshold distance of other_value."""
     for value in values:
@@ -24,11 +24,78 @@
 
 import numpy
 
+# Squared distances below this fraction of |x|^2 + |y|^2 lose most of their
+# precision in the expansion of squared_distance_matrix, and are computed directly
+_CANCELLATION_THRESHOLD = 1e-2
+
+# Max number of values in each block of differences, when computing directly
+_DIRECT_BLOCK_SIZE = 2**20
+
 def distance(vec_a, vec_b):
     # TODO: fix so it works with matrix inputs
     diff = numpy.subtract(vec_a, vec_b)
     return numpy.sqrt(diff.dot(diff))
 
+def distance_matrix(x_matrix, y_matrix, y_squared_norms=None, out=None):
+    """Return distance between each row of x_matrix and each row of y_matrix.
+
+    See squared_distance_matrix.
+
+    Args:
+        y_squared_norms: Optional squared_norms(y_matrix), when y_matrix is reused.
+        out: Optional array of shape (len(x_matrix), len(y_matrix)), to store result in.
+    """
+    out = squared_distance_matrix(x_matrix, y_matrix, y_squared_norms, out)
+    return numpy.sqrt(out, out=out)
+
+def squared_distance_matrix(x_matrix, y_matrix, y_squared_norms=None, out=None):
+    """Return squared distance between each row of x_matrix and each row of y_matrix.
+
+    Computed with a single matrix product, as |x - y|^2 = |x|^2 - 2 x.y + |y|^2.
+    The expansion cancels when rows are close, compared to their norms.
+    In float32, those distances are computed directly from differences of rows.
+
+    Args:
+        y_squared_norms: Optional squared_norms(y_matrix), when y_matrix is reused.
+        out: Optional array of shape (len(x_matrix), len(y_matrix)), to store result in.
+    """
+    if y_squared_norms is None:
+        y_squared_norms = squared_norms(y_matrix)
+    x_squared_norms = squared_norms(x_matrix)
+
+    out = numpy.dot(x_matrix, y_matrix.T, out=out)
+    out *= -2.0
+    out += x_squared_norms[:, None]
+    out += y_squared_norms
+
+    if out.dtype.itemsize < 8 and out.size > 0:
+        # Rounding error of expansion grows with |x|^2 + |y|^2.
+        # Max |y|^2 bounds it without a temporary matrix,
+        # at the cost of computing a few more distances directly
+        thresholds = x_squared_norms + numpy.max(y_squared_norms)
+        thresholds *= _CANCELLATION_THRESHOLD
+
+        # Only search rows with a close distance
+        close_rows = numpy.flatnonzero(numpy.min(out, axis=1) < thresholds)
+        if len(close_rows) > 0:
+            rows, cols = numpy.nonzero(out[close_rows] < thresholds[close_rows, None])
+            _set_direct_squared_distances(x_matrix, y_matrix, out, close_rows[rows], cols)
+
+    # Rounding can make the squared distance of equal rows slightly negative
+    return numpy.maximum(out, 0.0, out=out)
+
+def _set_direct_squared_distances(x_matrix, y_matrix, out, rows, cols):
+    """Set out[rows, cols] to squared distances, computed from differences of rows."""
+    block_size = max(_DIRECT_BLOCK_SIZE // max(x_matrix.shape[1], 1), 1)
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start+block_size]
+        block_cols = cols[start:start+block_size]
+        out[block_rows, block_cols] = squared_norms(x_matrix[block_rows] - y_matrix[block_cols])
+
+def squared_norms(matrix):
+    """Return squared euclidean norm of each row of matrix."""
+    return numpy.einsum('ij,ij->i', matrix, matrix)
+
 def protvecdiv(vec_a, vec_b):
     """Divide vec_a by vec_b.
 
@@ -54,65 +121,121 @@ def protvecdiv(vec_a, vec_b):
 #####################################
 # Common math and transfer functions
 #####################################
-def tanh(x):
+# Each function takes an optional out array, of the shape of the result,
+# to store the result in, without allocating.
+# out can be the input array, to compute in place.
+def tanh(x, out=None):
     """Sigmoid like function using tanh"""
-    return numpy.tanh(x)
+    return numpy.tanh(x, out=out)
 
-def dtanh(y):
+def dtanh(y, out=None):
     """Derivative of sigmoid above"""
-    return 1.0 - y**2
+    out = numpy.multiply(y, y, out=out)
+    return numpy.subtract(1.0, out, out=_inplace(out))
 
-def gaussian(x, variance=1.0):
-    return numpy.exp(-(x**2/variance))
+def gaussian(x, variance=1.0, out=None):
+    out = numpy.square(x, out=out)
+    return gaussian_of_squared(out, variance, out=_inplace(out))
 
-def dgaussian(x, y, variance=1.0):
-    return -2.0*x*y / variance
+def gaussian_of_squared(x_squared, variance=1.0, out=None):
+    """Return gaussian(x), given x squared, ex. squared distances."""
+    out = numpy.true_divide(x_squared, -variance, out=out)
+    return numpy.exp(out, out=_inplace(out))
 
-def relu(x):
-    """Return ln(1 + e^x) for each input value."""
-    # NOTE: numpy.errstate is very expensive, so the following is slower
-    # Maybe numpy will optimize errstate in the future, to make this more effective
-    # try:
-    #     with numpy.errstate(over='raise'):
-    #         return numpy.log(1.0 + numpy.exp(x))
-    # except FloatingPointError:
-    #     with numpy.errstate(over='ignore'):
-    #         out = numpy.log(1.0 + numpy.exp(x))
+def dgaussian(x, y, variance=1.0, out=None):
+    out = numpy.multiply(x, y, out=out)
+    return numpy.multiply(out, -2.0 / variance, out=_inplace(out))
 
-    #     # Replace inf's with corresponding components in x
-    #     # inf is caused by overflow in exp
-    #     infs = out == numpy.Infinity
-    #     out[infs] = x[infs]
+def relu(x, out=None, dout=None, exp_out=None):
+    """Return ln(1 + e^x) for each input value.
 
-    #     return out
+    Args:
+        dout: Optional array to also store drelu(x) in.
+            Computed from the same exponential as relu,
+            so the derivative does not evaluate exp again.
+        exp_out: Optional array to store e^-|x| in, when dout is given.
+    """
+    if dout is None:
+        # logaddexp does not overflow for large x, and returns x instead of inf
+        return numpy.logaddexp(0.0, x, out=out)
 
-    # Don't use try except with numpy.errstate, because it is slow
-    out = numpy.log(1.0 + numpy.exp(x))
+    # With e = e^-|x|, which does not overflow:
+    # drelu(x) = e / (1 + e) for x <= 0, and 1 - e / (1 + e) for x > 0
+    # relu(x) = max(x, 0) + ln(1 + e)
+    exp_out = numpy.abs(x, out=exp_out)
+    numpy.negative(exp_out, out=exp_out)
+    numpy.exp(exp_out, out=exp_out)
 
-    # Replace inf's with corresponding components in x
-    # inf is caused by overflow in exp
-    infs = out == numpy.Infinity
-    out[infs] = x[infs]
+    numpy.add(exp_out, 1.0, out=dout)
+    numpy.divide(exp_out, dout, out=dout)
+    numpy.subtract(1.0, dout, out=dout, where=x > 0.0)
 
+    # x is read last, because out can be x
+    numpy.log1p(exp_out, out=exp_out)
+    out = numpy.maximum(x, 0.0, out=out)
+    out += exp_out
     return out
 
-def drelu(x):
-    """Return the derivative of the softplus relu function for x."""
-    # NOTE: Can be optimized by caching numpy.e**(x) and returning e^x / (e^x + 1)
-    return 1.0 / (1.0 + numpy.exp(-x))
+def drelu(x, y=None, out=None):
+    """Return the derivative of the softplus relu function for x.
 
-def softmax(x):
-    """Return the softmax of vector x."""
+    Args:
+        y: Optional output of relu(x).
+            Reused instead of computing exp(x) again.
+    """
+    if y is None:
+        y = relu(x, out=out)
+        out = _inplace(y)
+
+    # 1 / (1 + e^-x) = 1 - e^-y, because e^y = 1 + e^x
+    out = numpy.negative(y, out=out)
+    out = numpy.expm1(out, out=_inplace(out))
+    return numpy.negative(out, out=_inplace(out))
+
+def softmax(x, out=None):
+    """Return the softmax of vector x.
+
+    If x is a matrix, return the softmax of each row.
+    """
     # Subtract max to prevent overflow
     # Instead results in underflow for small components,
     # which is just zero, and thus acceptable
     # NOTE: Attempting to subtract max only when overflow would occur
     # (ex. try / except block for overflow with numpy.errstate('over': 'raise'))
     # results in worse performance for both the overflow and no overflow cases
-    exp_ = numpy.exp(x  - numpy.max(x))
-    return exp_ / numpy.sum(exp_)
+    out = numpy.subtract(x, numpy.max(x, axis=-1, keepdims=True), out=out,
+                         dtype=numpy.result_type(x, 1.0))
+    numpy.exp(out, out=out)
+    out /= numpy.sum(out, axis=-1, keepdims=True)
+    return out
+
+def log_softmax(x, out=None):
+    """Return the log of the softmax of vector x.
+
+    If x is a matrix, return the log softmax of each row.
+    Does not underflow to log(0) for small components, unlike log(softmax(x)).
+    """
+    # log(softmax(x)) = (x - max) - log(sum(exp(x - max)))
+    shifted = numpy.subtract(x, numpy.max(x, axis=-1, keepdims=True), out=out,
+                             dtype=numpy.result_type(x, 1.0))
+    log_sum = numpy.log(numpy.sum(numpy.exp(shifted), axis=-1, keepdims=True))
+    shifted -= log_sum
+    return shifted
+
+def softmax_jvp(y, v, out=None):
+    """Return the product of the softmax jacobian and vector v, for softmax output y.
+
+    Computes y * (v - v.y) in O(k), without forming the k x k jacobian of dsoftmax.
+    Jacobian is symmetric, so this is also v times the jacobian.
+    If y and v are matrices, return the product for each row.
+    """
+    # Dot product of each row, without a temporary product matrix
+    dots = numpy.einsum('...i,...i->...', v, y)
+    out = numpy.subtract(v, dots[..., None], out=out)
+    out *= y
+    return out
 
-def dsoftmax(y):
+def dsoftmax(y, out=None):
     """Return the derivative of the softmax function for y."""
     # see http://stats.stackexchange.com/questions/79454/softmax-layer-in-a-neural-network
     # Compute matrix J, n x n, with y_i(1 - y_j) on the diagonals
@@ -120,6 +243,16 @@ def dsoftmax(y):
     # When getting erros multiply by error vector (J \vec{e})
 
     # Start with - y_i y_j matrix, then replace diagonal with y_i(1 - y_j)
-    jacobian = -y[:, None] * y
-    jacobian[numpy.diag_indices(y.shape[0])] = y*(1 - y)
+    jacobian = numpy.multiply(y[:, None], y, out=out)
+    numpy.negative(jacobian, out=jacobian)
+    jacobian[numpy.diag_indices(y.shape[0])] += y
     return jacobian
+
+def _inplace(values):
+    """Return values as the out argument of the next operation, if it can be computed in place.
+
+    Scalars, and integer arrays (ex. of integer inputs), cannot store results.
+    """
+    if isinstance(values, numpy.ndarray) and values.dtype.kind in 'fc':
+        return values
+    return None
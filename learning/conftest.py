@@ -22,4 +22,15 @@
 # SOFTWARE.
 ###############################################################################
 
-# Exists so py.test includes this directory in the path
\ No newline at end of file
+# Exists so py.test includes this directory in the path
+import pytest
+
+from learning.data import process
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """Cache datasets in a temporary directory, instead of the user cache."""
+    cache_dir = tmpdir.join('learning_cache')
+    monkeypatch.setenv(process.CACHE_DIR_ENV, str(cache_dir))
+    return cache_dir
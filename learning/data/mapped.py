@@ -0,0 +1,214 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+"""Memory mapped dataset files, and index based dataset operations.
+
+Layout (see learning.fileformat):
+    MAGIC (8 bytes)
+    version, header length (little-endian uint32 each)
+    JSON header
+    Input matrix (contiguous, little-endian, starting at a multiple of ALIGNMENT)
+    Target matrix (contiguous, little-endian, starting at a multiple of ALIGNMENT)
+
+Loaded matrices are numpy.memmap, so the page cache is shared
+by every process reading the same file.
+Shuffling, folds, and batches use index arrays,
+so only the selected rows are read and copied.
+"""
+
+import functools
+import itertools
+
+import numpy
+
+from learning import dtypes
+from learning import fileformat
+from learning.fileformat import ALIGNMENT
+
+MAGIC = 'LRNDATA\0'
+FORMAT_VERSION = 1
+
+
+def save(file_name, input_matrix, target_matrix=None, dtype='float64'):
+    """Save dataset to file_name.
+
+    Args:
+        file_name: Path of dataset file.
+        input_matrix: A matrix with samples in rows and attributes in columns.
+            Or a learning.data.stream.ChunkedDataset with at least one row,
+            written one chunk at a time.
+        target_matrix: A matrix with samples in rows and target values in columns.
+            None when input_matrix is a ChunkedDataset.
+        dtype: 'float32' or 'float64'; Type of stored values.
+            A vector of integer class indices is stored as integers, see learning.error.
+    """
+    dtype = numpy.dtype(dtype).newbyteorder('<')
+    if dtype not in (numpy.dtype('<f4'), numpy.dtype('<f8')):
+        raise ValueError('dtype must be float32 or float64')
+
+    if target_matrix is None:
+        num_rows = len(input_matrix)
+        chunks = input_matrix.iter_chunks()
+    else:
+        if len(input_matrix) != len(target_matrix):
+            raise ValueError('input_matrix and target_matrix must have the same number of rows')
+        num_rows = len(input_matrix)
+        chunks = iter([(input_matrix, target_matrix)])
+
+    # Shape of columns is given by first chunk
+    try:
+        first_chunk = next(chunks)
+    except StopIteration:
+        # Chunked datasets without rows have no chunk to give the shape of columns
+        raise ValueError('Dataset has no rows')
+    input_shape = (num_rows, ) + numpy.shape(first_chunk[0])[1:]
+    target_shape = (num_rows, ) + numpy.shape(first_chunk[1])[1:]
+
+    if dtypes.is_class_index_vector(numpy.asarray(first_chunk[1])):
+        target_dtype = numpy.asarray(first_chunk[1]).dtype.newbyteorder('<')
+    else:
+        target_dtype = dtype
+
+    header, header_json = fileformat.make_header(
+        MAGIC, functools.partial(_make_header, input_shape, target_shape, dtype, target_dtype))
+
+    # Write to temporary file, so readers never see a partial dataset
+    with fileformat.atomic_path(file_name) as temp_path:
+        with open(temp_path, 'wb') as file_:
+            fileformat.write_header(file_, MAGIC, FORMAT_VERSION, header_json)
+            file_.truncate(header['targets']['offset'] + _nbytes(target_shape, target_dtype))
+
+        input_memmap, target_memmap = _open_arrays(temp_path, header, 'r+')
+        row = 0
+        for chunk_inputs, chunk_targets in itertools.chain([first_chunk], chunks):
+            input_memmap[row:row+len(chunk_inputs)] = chunk_inputs
+            target_memmap[row:row+len(chunk_inputs)] = chunk_targets
+            row += len(chunk_inputs)
+        if row != num_rows:
+            raise ValueError('Dataset has %d rows, expected %d' % (row, num_rows))
+
+        for array in (input_memmap, target_memmap):
+            # Arrays without bytes are not memory mapped, see _open_array
+            if isinstance(array, numpy.memmap):
+                array.flush()
+        del input_memmap, target_memmap
+
+
+def load(file_name, mode='r'):
+    """Return (input_matrix, target_matrix) memory mapped from file_name.
+
+    Args:
+        file_name: Path of dataset file made by save.
+        mode: 'r' or 'c'; Read-only or copy-on-write memory mapping.
+    """
+    if mode not in ('r', 'c'):
+        raise ValueError("mode must be one of ('r', 'c')")
+    return _open_arrays(file_name, read_header(file_name), mode)
+
+
+def read_header(file_name):
+    """Return JSON header of dataset file, as dict."""
+    return fileformat.read_header(file_name, MAGIC, FORMAT_VERSION, 'dataset')
+
+
+###############################
+# Indices
+###############################
+def shuffled_indices(num_rows):
+    """Return row indices in random order."""
+    return numpy.random.permutation(num_rows)
+
+
+def fold_indices(num_rows, num_folds, shuffle=False):
+    """Return a list of (training_indices, testing_indices), one for each fold.
+
+    Folds are disjoint, and the last fold includes any remaining rows,
+    like validation.make_cross_validation_sets.
+    """
+    if shuffle:
+        indices = shuffled_indices(num_rows)
+    else:
+        indices = numpy.arange(num_rows)
+
+    fold_size = num_rows // num_folds
+    bounds = [i*fold_size for i in range(num_folds)] + [num_rows]
+
+    folds = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        folds.append((numpy.concatenate([indices[:start], indices[end:]]),
+                      indices[start:end]))
+    return folds
+
+
+def iter_batches(input_matrix, target_matrix, batch_size, indices=None):
+    """Yield (input_matrix, target_matrix) batches of batch_size rows.
+
+    Args:
+        indices: Optional rows to include, in order of batches.
+            Rows are sorted within each batch,
+            so memory mapped files are read sequentially.
+            If None, batches are contiguous views, without copying.
+    """
+    if indices is None:
+        for start in range(0, len(input_matrix), batch_size):
+            yield (input_matrix[start:start+batch_size],
+                   target_matrix[start:start+batch_size])
+    else:
+        for start in range(0, len(indices), batch_size):
+            batch_indices = numpy.sort(indices[start:start+batch_size])
+            yield input_matrix[batch_indices], target_matrix[batch_indices]
+
+
+###############################
+# Helpers
+###############################
+def _make_header(input_shape, target_shape, dtype, target_dtype, data_start):
+    """Return header dict, with input matrix stored from data_start."""
+    target_offset = fileformat.align(data_start + _nbytes(input_shape, dtype))
+    return {
+        'version': FORMAT_VERSION,
+        'num_rows': input_shape[0],
+        'inputs': {'dtype': dtype.str, 'shape': list(input_shape), 'offset': data_start},
+        'targets': {'dtype': target_dtype.str, 'shape': list(target_shape),
+                    'offset': target_offset}
+    }
+
+
+def _open_arrays(file_name, header, mode):
+    """Return (input_matrix, target_matrix) memory maps."""
+    return tuple(_open_array(file_name, header[key], mode) for key in ('inputs', 'targets'))
+
+
+def _open_array(file_name, array_header, mode):
+    """Return memory map described by array_header."""
+    shape = tuple(array_header['shape'])
+    if 0 in shape:
+        # Cannot memory map 0 bytes
+        return numpy.zeros(shape, dtype=array_header['dtype'])
+    return numpy.memmap(file_name, dtype=array_header['dtype'], mode=mode,
+                        offset=array_header['offset'], shape=shape)
+
+
+def _nbytes(shape, dtype):
+    """Return number of bytes in array of shape and dtype."""
+    return int(numpy.prod(shape)) * dtype.itemsize
@@ -22,63 +22,318 @@
 # SOFTWARE.
 ###############################################################################
 
+import os
 import re
+import hashlib
+import logging
 
 import numpy
 
+from learning import dtypes
+from learning import fileformat
 from learning import preprocess
 
-def get_data(file_name, attr_start_pos, attr_end_pos=-1, target_pos=-1, classification=True):
-    if classification:
-        # Get data from file
-        data_file = open(file_name)
-        # Determine the classes
-        classes = set()
-        for line in data_file:
-            attributes = _get_attributes(line)
-            class_ = attributes[target_pos].strip()
-            classes.add(class_)
-        class_dict = {}
-        for i, class_ in enumerate(sorted(classes)): # Sorted for easier validation
-            class_dict[class_] = i
-
-    # Obtain a data point from each line of the file
-    input_matrix = []
-    target_matrix = []
-
-    data_file = open(file_name)
-    for line in data_file:
-        attributes = _get_attributes(line)
+# Directory for cached datasets, when not given to get_data
+CACHE_DIR_ENV = 'LEARNING_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'learning')
+
+# Increment when parsing changes, to invalidate cached datasets
+_CACHE_VERSION = 2
+
+def get_data(file_name, attr_start_pos, attr_end_pos=-1, target_pos=-1, classification=True,
+             cache=True, cache_dir=None, dtype=None, onehot=True):
+    """Return (input_matrix, target_matrix) from a comma or space delimited file.
+
+    Input matrix is rescaled to [-1, 1].
+    Target matrix is onehot for classification, or rescaled to [-1, 1] for regression.
+    Classes are sorted.
 
+    Args:
+        file_name: Path of data file.
+        attr_start_pos: Column of first attribute.
+        attr_end_pos: Column after last attribute.
+        target_pos: Column of target.
+        classification: If True, target is a class, else a number.
+        cache: If True, parsed arrays are stored as .npy files in cache_dir,
+            and loaded with copy-on-write memory mapping.
+            Cache is invalidated when the path, modification time, or size of file_name,
+            or any parse argument, changes.
+            Invalidated arrays of file_name are removed when it is cached again.
+            Arrays of moved or deleted files remain, until removed by clear_cache.
+        cache_dir: Directory for cached arrays.
+            Defaults to $LEARNING_CACHE_DIR, or ~/.cache/learning.
+        dtype: 'float32' or 'float64'; Type of returned matrices.
+            Defaults to dtypes.get_default_dtype().
+        onehot: If False, classification targets are a vector of integer class indices,
+            instead of a onehot matrix. See learning.error.
+
+    Returns:
+        (input_matrix, target_matrix); numpy.memmap if cache is True,
+        or numpy.ndarray if cache is False, or the cache cannot be written.
+    """
+    dtype = dtypes.get_dtype(dtype)
+    if cache:
+        cache_paths = _get_cache_paths(
+            file_name, cache_dir,
+            (attr_start_pos, attr_end_pos, target_pos, classification, dtype.name, onehot))
         try:
-            input = [float(value) for value in attributes[attr_start_pos:attr_end_pos]]
-        except ValueError:
-            continue
+            return tuple(numpy.load(path, mmap_mode='c') for path in cache_paths)
+        except (IOError, ValueError):
+            # Not cached, or cache is unreadable
+            pass
+
+    dataset = _parse_data(file_name, attr_start_pos, attr_end_pos, target_pos, classification,
+                          dtype, onehot)
 
-        if classification:
-            class_ = attributes[target_pos].strip()
-            output = [0.0]*len(classes)
-            # Class dict maps the name to the position
-            # This position is given a value of 1.0
-            output[class_dict[class_]] = 1.0
+    if cache:
+        try:
+            _remove_stale_cache(cache_paths)
+            for path, matrix in zip(cache_paths, dataset):
+                _save_atomic(path, matrix)
+        except (IOError, OSError) as e:
+            logging.warning('Cannot cache %s: %s', file_name, e)
         else:
-            output = [float(attributes[target_pos].strip())]
+            # Same type as later calls, and parsed arrays can be freed
+            return tuple(numpy.load(path, mmap_mode='c') for path in cache_paths)
+
+    return dataset
+
+def clear_cache(cache_dir=None):
+    """Remove all arrays cached by get_data.
+
+    Args:
+        cache_dir: Directory for cached arrays, see get_data.
+    """
+    cache_dir = _get_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return
+
+    for name in os.listdir(cache_dir):
+        if name.endswith(('-inputs.npy', '-targets.npy')):
+            os.remove(os.path.join(cache_dir, name))
+
+def _parse_data(file_name, attr_start_pos, attr_end_pos, target_pos, classification,
+                dtype=None, onehot=True):
+    """Return (input_matrix, target_matrix) parsed from file_name.
 
-        input_matrix.append(input)
-        target_matrix.append(output)
+    File is parsed in a single pass, a block of lines at a time.
+    Rows with attributes (or regression targets) that are not numbers are skipped,
+    and reported with a warning.
+    """
+    input_blocks = []
+    target_blocks = []
+    for inputs, targets in _iter_parsed_blocks(
+            file_name, attr_start_pos, attr_end_pos, target_pos, classification):
+        input_blocks.append(inputs)
+        target_blocks.append(targets)
 
-    # Make numpy arrays
-    input_matrix = numpy.array(input_matrix)
-    target_matrix = numpy.array(target_matrix)
+    if not input_blocks:
+        raise ValueError('%s has no valid rows' % file_name)
+    input_matrix = numpy.concatenate(input_blocks)
+    target_vec = numpy.concatenate(target_blocks)
+
+    if classification:
+        # numpy.unique sorts classes, for easier validation
+        classes, class_indices = numpy.unique(target_vec, return_inverse=True)
+        if onehot:
+            target_matrix = numpy.zeros((len(target_vec), len(classes)),
+                                        dtype=dtypes.get_dtype(dtype))
+            target_matrix[numpy.arange(len(target_vec)), class_indices] = 1.0
+        else:
+            target_matrix = class_indices
+    else:
+        target_matrix = target_vec[:, None]
 
     # Re-scale input matrix to [-1, 1]
-    input_matrix = preprocess.rescale(input_matrix)
+    input_matrix = preprocess.rescale(input_matrix, dtype)
     # Same for target if it is regression
     if classification is False:
-        target_matrix = preprocess.rescale(target_matrix)
+        target_matrix = preprocess.rescale(target_matrix, dtype)
 
     return input_matrix, target_matrix
 
-def _get_attributes(line):
-    line_processed = re.sub(r' +', ',', line.strip())
-    return line_processed.split(',')
+def _iter_parsed_blocks(file_name, attr_start_pos, attr_end_pos, target_pos, classification):
+    """Yield (input_matrix, target_vec) for each block of file_name.
+
+    target_vec contains class names for classification, and numbers otherwise.
+    Malformed rows are skipped, and reported with a warning after the last block.
+    """
+    skipped_lines = []
+    line_offset = 0
+    for lines in _read_line_blocks(file_name):
+        inputs, targets, skipped = _parse_lines(
+            lines, attr_start_pos, attr_end_pos, target_pos, classification)
+        if len(inputs) > 0:
+            yield inputs, targets
+        skipped_lines.extend(line_offset + i + 1 for i in skipped)
+        line_offset += len(lines)
+
+    if skipped_lines:
+        logging.warning('Skipped %d malformed rows in %s, at lines: %s%s',
+                        len(skipped_lines), file_name,
+                        ', '.join(str(line_num) for line_num in skipped_lines[:10]),
+                        ', ...' if len(skipped_lines) > 10 else '')
+
+# Blocks are large enough for efficient bulk conversion,
+# and small enough that a malformed row does not slow down the whole file
+_BLOCK_SIZE = 2**20
+
+_SPACES_RE = re.compile(r' +')
+
+def _read_line_blocks(file_name):
+    """Yield lists of lines from file_name, about _BLOCK_SIZE bytes at a time.
+
+    Lines are stripped, and spaces are replaced with commas.
+    """
+    with open(file_name) as data_file:
+        remainder = ''
+        while True:
+            block = data_file.read(_BLOCK_SIZE)
+            if not block:
+                break
+
+            # Last line may continue in next block
+            block = remainder + block
+            last_newline = block.rfind('\n')
+            if last_newline == -1:
+                remainder = block
+                continue
+            remainder = block[last_newline+1:]
+
+            yield _split_lines(block[:last_newline])
+
+        if remainder:
+            yield _split_lines(remainder)
+
+def _split_lines(block):
+    """Return lines in block, with delimiters normalized to commas."""
+    lines = block.split('\n')
+
+    # Skip string processing for the common case of comma delimited files
+    if ' ' in block or '\t' in block or '\r' in block:
+        lines = [line.strip() for line in lines]
+        if ' ' in block:
+            lines = _SPACES_RE.sub(',', '\n'.join(lines)).split('\n')
+
+    return lines
+
+def _parse_lines(lines, attr_start_pos, attr_end_pos, target_pos, classification):
+    """Return (input_matrix, target_vec, skipped) for lines.
+
+    target_vec contains class names for classification, and numbers otherwise.
+    skipped contains the index of each malformed line.
+    """
+    # Fast path: all lines have the same number of columns, and all values are valid
+    if '' not in lines and len(set([line.count(',') for line in lines])) == 1:
+        num_columns = lines[0].count(',') + 1
+        # Column j of line i is values[i*num_columns + j]
+        values = ','.join(lines).split(',')
+
+        # Convert one column at a time, with list slicing
+        column_indices = range(num_columns)
+        try:
+            input_matrix = numpy.column_stack(
+                [numpy.array(values[j::num_columns], dtype=float)
+                 for j in column_indices[attr_start_pos:attr_end_pos]])
+            target_values = values[column_indices[target_pos]::num_columns]
+            if classification:
+                target_vec = numpy.char.strip(numpy.array(target_values))
+            else:
+                target_vec = numpy.array(target_values, dtype=float)
+        except (ValueError, IndexError):
+            # Find malformed rows
+            pass
+        else:
+            return input_matrix, target_vec, []
+
+    # Slow path: parse each line, to find malformed lines
+    inputs = []
+    targets = []
+    skipped = []
+    for i, line in enumerate(lines):
+        if not line:
+            continue # Blank lines are not rows
+
+        attributes = line.split(',')
+        try:
+            input_vec = [float(value) for value in attributes[attr_start_pos:attr_end_pos]]
+            if classification:
+                target = attributes[target_pos].strip()
+            else:
+                target = float(attributes[target_pos])
+        except (ValueError, IndexError):
+            skipped.append(i)
+            continue
+
+        inputs.append(input_vec)
+        targets.append(target)
+
+    return numpy.array(inputs), numpy.array(targets), skipped
+
+###############################
+# Cache
+###############################
+# Cached file names are {base name}-{path key}-{version key}-{args key}-{inputs|targets}.npy
+_CACHE_FILE_REGEX = re.compile(r'.*-([0-9a-f]{12})-([0-9a-f]{12})-[0-9a-f]{12}-(inputs|targets)\.npy$')
+
+def _get_cache_dir(cache_dir):
+    """Return cache_dir, or the default cache directory if None."""
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    return os.path.expanduser(cache_dir)
+
+def _get_cache_paths(file_name, cache_dir, parse_args):
+    """Return paths of cached (input_matrix, target_matrix) for file_name."""
+    cache_dir = _get_cache_dir(cache_dir)
+
+    file_name = os.path.abspath(file_name)
+    file_stat = os.stat(file_name)
+
+    # Separate keys for the file, its version, and parse arguments,
+    # so arrays of previous versions can be found and removed
+    path_key = _cache_key(file_name)
+    version_key = _cache_key((_CACHE_VERSION, file_stat.st_mtime, file_stat.st_size))
+    args_key = _cache_key(parse_args)
+
+    # Base name makes cache directory easier to inspect
+    prefix = os.path.join(cache_dir, '%s-%s-%s-%s' % (os.path.basename(file_name),
+                                                     path_key, version_key, args_key))
+    return prefix + '-inputs.npy', prefix + '-targets.npy'
+
+def _cache_key(value):
+    """Return short hex key of value."""
+    return hashlib.sha1(repr(value)).hexdigest()[:12]
+
+def _remove_stale_cache(cache_paths):
+    """Remove cached arrays of previous versions of the file of cache_paths."""
+    cache_dir = os.path.dirname(cache_paths[0])
+    if not os.path.isdir(cache_dir):
+        return
+
+    path_key, version_key, _ = _CACHE_FILE_REGEX.match(os.path.basename(cache_paths[0])).groups()
+    for name in os.listdir(cache_dir):
+        match = _CACHE_FILE_REGEX.match(name)
+        if match and match.group(1) == path_key and match.group(2) != version_key:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                # Another process may have removed it
+                pass
+
+def _save_atomic(path, matrix):
+    """Save matrix to .npy file at path.
+
+    Concurrent readers never see a partially written file.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process may have made it
+            if not os.path.isdir(directory):
+                raise
+
+    with fileformat.atomic_path(path) as temp_path:
+        with open(temp_path, 'wb') as file_:
+            numpy.save(file_, matrix)
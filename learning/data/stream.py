@@ -0,0 +1,286 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+"""Datasets read in chunks, for datasets larger than memory.
+
+A ChunkedDataset can be given to Model.train in place of (input_matrix, target_matrix):
+    model.train(FileDataset('big.data', 0, chunk_size=1000), None)
+Each training iteration is one epoch, calling train_step on every chunk.
+"""
+
+import numpy
+
+from learning import dtypes
+from learning import preprocess
+from learning.preprocess import ColumnStats
+from learning.data import process
+
+SCALE_OPTIONS = (None, 'rescale', 'normalize')
+_SCALERS = {'rescale': preprocess.Rescaler, 'normalize': preprocess.Normalizer}
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class ChunkedDataset(object):
+    """Dataset that yields (input_matrix, target_matrix) chunks.
+
+    Args:
+        chunk_size: Max number of rows in each chunk.
+        scale: None, 'rescale', or 'normalize'; Scaling of inputs.
+            'rescale' scales each column to [-1, 1], like preprocess.rescale.
+            'normalize' scales each column to mean 0 and standard deviation 1,
+            like preprocess.normalize.
+            Requires an extra pass over the dataset, to compute statistics.
+        scale_targets: If True, targets are scaled like inputs.
+        dtype: 'float32' or 'float64'; Type of chunks.
+            Defaults to dtypes.get_default_dtype().
+            Statistics are always computed in float64.
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, scale=None, scale_targets=False,
+                 dtype=None):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be >= 1')
+        if scale not in SCALE_OPTIONS:
+            raise ValueError('scale must be one of %s' % (SCALE_OPTIONS, ))
+
+        self.chunk_size = chunk_size
+        self.scale = scale
+        self.scale_targets = scale_targets
+        self.dtype = dtypes.get_dtype(dtype)
+
+        self._stats = None # (input_stats, target_stats), computed when needed
+
+    def iter_chunks(self):
+        """Yield (input_matrix, target_matrix) for each chunk, in order."""
+        for input_matrix, target_matrix in _rechunk(self._iter_raw_blocks(), self.chunk_size):
+            if self.scale is not None:
+                input_scaler, target_scaler = self.get_scalers()
+                input_matrix = input_scaler.transform(input_matrix, dtype=self.dtype)
+                if target_scaler is not None:
+                    target_matrix = target_scaler.transform(target_matrix, dtype=self.dtype)
+
+            # Chunks already in dtype are not copied
+            yield (numpy.asarray(input_matrix, dtype=self.dtype),
+                   dtypes.as_target_matrix(target_matrix, self.dtype))
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def __len__(self):
+        """Return number of rows."""
+        return self.get_stats()[0].count
+
+    def get_stats(self):
+        """Return (input_stats, target_stats) ColumnStats, of unscaled dataset.
+
+        Computed with a pass over the dataset, on first call.
+        """
+        if self._stats is None:
+            input_stats = ColumnStats()
+            target_stats = ColumnStats()
+            for input_matrix, target_matrix in self._iter_raw_blocks():
+                input_stats.update(input_matrix)
+                target_stats.update(target_matrix)
+            self._stats = (input_stats, target_stats)
+        return self._stats
+
+    def get_scalers(self):
+        """Return (input_scaler, target_scaler) preprocess.Scaler used to scale chunks.
+
+        Use to apply the same scaling to new inputs, such as when serving a model.
+        target_scaler is None if targets are not scaled.
+        """
+        if self.scale is None:
+            raise ValueError('Dataset is not scaled')
+
+        input_stats, target_stats = self.get_stats()
+        scaler_class = _SCALERS[self.scale]
+        return (scaler_class(input_stats),
+                scaler_class(target_stats) if self.scale_targets else None)
+
+    def _iter_raw_blocks(self):
+        """Yield (input_matrix, target_matrix) blocks of any size, without scaling."""
+        raise NotImplementedError()
+
+
+class ArrayDataset(ChunkedDataset):
+    """Chunks of arrays, such as numpy.memmap or arrays loaded with mmap_mode.
+
+    Without scaling, chunks of arrays in dtype are views, and do not copy data.
+    """
+    def __init__(self, input_matrix, target_matrix, chunk_size=DEFAULT_CHUNK_SIZE,
+                 scale=None, scale_targets=False, dtype=None):
+        super(ArrayDataset, self).__init__(chunk_size, scale, scale_targets, dtype)
+
+        if len(input_matrix) != len(target_matrix):
+            raise ValueError('input_matrix and target_matrix must have the same number of rows')
+
+        self._input_matrix = input_matrix
+        self._target_matrix = target_matrix
+
+    def __len__(self):
+        """Return number of rows."""
+        return len(self._input_matrix)
+
+    def _iter_raw_blocks(self):
+        """Yield (input_matrix, target_matrix) blocks of any size, without scaling."""
+        for start in range(0, len(self._input_matrix), self.chunk_size):
+            yield (self._input_matrix[start:start+self.chunk_size],
+                   self._target_matrix[start:start+self.chunk_size])
+
+
+class FileDataset(ChunkedDataset):
+    """Chunks parsed from a comma or space delimited file.
+
+    File is parsed like process.get_data, without loading the whole file.
+
+    Args:
+        file_name: Path of data file.
+        attr_start_pos: Column of first attribute.
+        attr_end_pos: Column after last attribute.
+        target_pos: Column of target.
+        classification: If True, target is a class, and target matrix is onehot.
+        classes: Optional list of class names, in order of onehot columns.
+            Discovered with an extra pass over the file if not given,
+            combined with the pass for statistics when scaling.
+        onehot: If False, classification targets are a vector of integer class indices,
+            instead of a onehot matrix. See learning.error.
+    """
+    def __init__(self, file_name, attr_start_pos, attr_end_pos=-1, target_pos=-1,
+                 classification=True, classes=None, onehot=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE, scale=None, scale_targets=False, dtype=None):
+        super(FileDataset, self).__init__(chunk_size, scale, scale_targets, dtype)
+
+        if classification and scale_targets:
+            raise ValueError('Cannot scale onehot targets of classification dataset')
+
+        self._file_name = file_name
+        self._parse_args = (attr_start_pos, attr_end_pos, target_pos, classification)
+        self._classification = classification
+        self._onehot = onehot
+        self._classes = None if classes is None else numpy.array(classes)
+
+    def get_classes(self):
+        """Return array of class names, in order of onehot columns."""
+        if not self._classification:
+            raise ValueError('Regression dataset does not have classes')
+
+        if self._classes is None:
+            # numpy.unique sorts classes, matching process.get_data
+            classes = set()
+            for _, target_vec in process._iter_parsed_blocks(self._file_name, *self._parse_args):
+                classes.update(numpy.unique(target_vec))
+            self._classes = numpy.array(sorted(classes))
+        return self._classes
+
+    def get_stats(self):
+        """Return (input_stats, target_stats) ColumnStats, of unscaled dataset.
+
+        target_stats is None for classification.
+        Computed with a pass over the dataset, on first call.
+        """
+        if self._stats is None and self._classification:
+            # Discover classes in the same pass
+            input_stats = ColumnStats()
+            classes = set()
+            for input_matrix, target_vec in process._iter_parsed_blocks(
+                    self._file_name, *self._parse_args):
+                input_stats.update(input_matrix)
+                classes.update(numpy.unique(target_vec))
+
+            if self._classes is None:
+                self._classes = numpy.array(sorted(classes))
+            self._stats = (input_stats, None)
+
+        return super(FileDataset, self).get_stats()
+
+    def _iter_raw_blocks(self):
+        """Yield (input_matrix, target_matrix) blocks of any size, without scaling."""
+        if self._classification:
+            classes = self.get_classes()
+            # Given classes may not be sorted
+            sorter = numpy.argsort(classes)
+
+        for input_matrix, target_vec in process._iter_parsed_blocks(
+                self._file_name, *self._parse_args):
+            if self._classification:
+                positions = numpy.minimum(
+                    numpy.searchsorted(classes, target_vec, sorter=sorter), len(classes)-1)
+                class_indices = sorter[positions]
+                if (classes[class_indices] != target_vec).any():
+                    raise ValueError('%s contains a class not in classes' % self._file_name)
+
+                if self._onehot:
+                    target_matrix = numpy.zeros((len(target_vec), len(classes)), dtype=self.dtype)
+                    target_matrix[numpy.arange(len(target_vec)), class_indices] = 1.0
+                else:
+                    target_matrix = class_indices
+            else:
+                target_matrix = target_vec[:, None]
+
+            yield input_matrix, target_matrix
+
+
+def _rechunk(blocks, chunk_size):
+    """Yield (input_matrix, target_matrix) chunks of chunk_size rows, from blocks of any size.
+
+    Last chunk may have fewer rows.
+    """
+    pending = [] # (input_matrix, target_matrix) not yet yielded
+    num_pending = 0
+    for input_matrix, target_matrix in blocks:
+        start = 0
+
+        # Complete pending chunk
+        if num_pending > 0:
+            start = chunk_size - num_pending
+            pending.append((input_matrix[:start], target_matrix[:start]))
+            num_pending += len(pending[-1][0])
+            if num_pending < chunk_size:
+                # Whole block is pending
+                continue
+
+            yield _concatenate(pending)
+            pending = []
+            num_pending = 0
+
+        # Yield full chunks directly from block, without copying
+        while len(input_matrix) - start >= chunk_size:
+            yield (input_matrix[start:start+chunk_size],
+                   target_matrix[start:start+chunk_size])
+            start += chunk_size
+
+        if start < len(input_matrix):
+            pending.append((input_matrix[start:], target_matrix[start:]))
+            num_pending = len(input_matrix) - start
+
+    if num_pending > 0:
+        yield _concatenate(pending)
+
+
+def _concatenate(blocks):
+    """Return (input_matrix, target_matrix) of all rows in blocks."""
+    if len(blocks) == 1:
+        return blocks[0]
+    return (numpy.concatenate([block[0] for block in blocks]),
+            numpy.concatenate([block[1] for block in blocks]))
@@ -21,43 +21,73 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 ###############################################################################
-"""Error functions for use with some models."""
+"""Error functions for use with some models.
+
+Error functions take a single output vector and target vector,
+or a matrix of outputs and targets, with samples in rows.
+The error of each sample is the mean over components (the last axis),
+and errors of samples are combined with reduction:
+    'mean': Mean error of samples (default).
+    'sum': Sum of errors of samples.
+    'none': Error of each sample.
+
+Targets can be vectors, or integer class indices.
+A class index c is equivalent to a onehot vector with 1 at c,
+without building the onehot vector.
+A matrix of outputs takes a vector of class indices, one for each row.
+Outputs with a single component have no classes to index,
+so a target for each row (integer or not) is the target value of that row,
+such as binary or integer regression targets.
+"""
 
 import numpy
 
+from learning import dtypes
+
+REDUCTIONS = ('mean', 'sum', 'none')
+
 
 class ErrorFunc(object):
     """An error function."""
-    def __call__(self, vec_a, vec_b):
-        """Return the error between two vectors.
+    def __call__(self, vec_a, vec_b, reduction='mean'):
+        """Return the error between two vectors, or each row of two matrices.
 
         Typically, vec_a with be a model output, and vec_b a target vector.
+
+        Args:
+            reduction: 'mean', 'sum', or 'none'; How errors of rows are combined.
         """
         raise NotImplementedError()
 
-    def derivative(self, vec_a, vec_b):
-        """Return (error, derivative matrix or vector)."""
+    def derivative(self, vec_a, vec_b, reduction='mean'):
+        """Return (error, derivative matrix or vector).
+
+        Derivative is of the reduced error w.r.t. vec_a, with the shape of vec_a.
+        With reduction='none', each row is the derivative of the error of that row.
+        """
         raise NotImplementedError()
 
 
 class MSE(ErrorFunc):
     """Mean squared error."""
-    def __call__(self, vec_a, vec_b):
-        """Return the error between two vectors.
+    def __call__(self, vec_a, vec_b, reduction='mean'):
+        """Return the error between two vectors, or each row of two matrices.
 
         Typically, vec_a with be a model output, and vec_b a target vector.
         """
-        return numpy.mean((numpy.subtract(vec_a, vec_b))**2)
+        error_matrix = _get_error_matrix(vec_a, vec_b)
+        error_matrix **= 2
+        return _reduce(dtypes.mean(error_matrix, axis=-1), reduction)
 
-    def derivative(self, vec_a, vec_b):
+    def derivative(self, vec_a, vec_b, reduction='mean'):
         """Return error, derivative_matrix."""
-        error_vec = numpy.subtract(vec_a, vec_b)
-        mse = numpy.mean(error_vec**2) # For returning error
+        error_matrix = _get_error_matrix(vec_a, vec_b)
+        mse = _reduce(dtypes.mean(error_matrix**2, axis=-1), reduction) # For returning error
 
         # Note that error function is not 0.5*mse, so we multiply by 2
-        error_vec *= (2.0/len(vec_b))
+        error_matrix *= (2.0/(error_matrix.shape[-1]*_get_num_reduced(error_matrix, reduction)))
 
-        return mse, error_vec
+        return mse, error_matrix
 
 
 class CrossEntropy(ErrorFunc):
@@ -66,31 +96,132 @@ class CrossEntropy(ErrorFunc):
     Note that this error function is not symmetric.
     vec_a is expected to be the predicted vector,
     while vec_b is the reference vector.
+
+    Values of vec_a are clamped to at least the smallest positive float of their dtype,
+    so log(0) and x/0 give large finite values, instead of inf,
+    keeping the spirit of cross entropy, while avoiding numerical errors.
+    Negative values of vec_a raise FloatingPointError.
     """
-    def __call__(self, vec_a, vec_b):
-        """Return the error between two vectors.
+    def __call__(self, vec_a, vec_b, reduction='mean'):
+        """Return the error between two vectors, or each row of two matrices.
 
         Typically, vec_a with be a model output, and vec_b a target vector.
-
-        log(0) in vec_a is changed to very negative value, to keep the spirit
-        of cross entropy, while avoiding numerical errors.
         """
+        vec_a, vec_b = _as_float_arrays(vec_a, vec_b)
+        num_components = vec_a.shape[-1]
+
+        if _is_class_index(vec_a, vec_b):
+            # Only the predicted probability of the target class contributes
+            # Divide by length for mean, like below
+            log_a = _clamped_log(vec_a[_get_class_index(vec_a, vec_b)])
+            log_a /= -num_components
+            return _reduce(log_a, reduction)
+
         # Use mean instead of sum, so magnitude is independent of length of vectors
-        with numpy.errstate(invalid='raise', divide='ignore'): # Do not allow log(-)
-            log_a = numpy.log(vec_a)
-        log_a = numpy.nan_to_num(log_a) # Change -inf (from log(0)) to -1.79769313e+308
-        return -numpy.mean(log_a * vec_b)
+        log_a = _clamped_log(vec_a)
+        log_a *= _as_target_values(vec_a, vec_b)
+        errors = dtypes.mean(log_a, axis=-1)
+        errors *= -1.0
+        return _reduce(errors, reduction)
 
-    def derivative(self, vec_a, vec_b):
+    def derivative(self, vec_a, vec_b, reduction='mean'):
         """Return error, derivative_matrix."""
+        vec_a, vec_b = _as_float_arrays(vec_a, vec_b)
         # NOTE: If CE uses sum instead of mean, this would be -(vec_b / vec_a)
+        scale = -1.0 / (vec_a.shape[-1]*_get_num_reduced(vec_a, reduction))
+
+        if _is_class_index(vec_a, vec_b):
+            # Only the component of the target class is non-zero
+            class_index = _get_class_index(vec_a, vec_b)
+            derivative_matrix = numpy.zeros_like(vec_a)
+            derivative_matrix[class_index] = scale / _clamp(vec_a[class_index])
+        else:
+            # 0/0 is 0, x/0 is a large finite value
+            derivative_matrix = _clamp(vec_a)
+            numpy.divide(_as_target_values(vec_a, vec_b), derivative_matrix,
+                         out=derivative_matrix)
+            derivative_matrix *= scale
+
+        return self(vec_a, vec_b, reduction), derivative_matrix
+
+
+def _reduce(errors, reduction):
+    """Return errors of rows combined with reduction."""
+    if reduction == 'mean':
+        return dtypes.mean(errors)
+    elif reduction == 'sum':
+        return numpy.sum(errors, dtype=dtypes.get_accumulate_dtype())
+    elif reduction == 'none':
+        return errors
+    raise ValueError('reduction must be one of %s' % (REDUCTIONS, ))
+
+
+def _get_num_reduced(vec_a, reduction):
+    """Return number of rows that errors are divided by, with reduction."""
+    if reduction == 'mean':
+        # Every axis but the last is rows
+        return vec_a.size // vec_a.shape[-1]
+    return 1
+
+
+def _get_error_matrix(vec_a, vec_b):
+    """Return new array of vec_a - vec_b."""
+    vec_a = numpy.asarray(vec_a)
+    vec_b = numpy.asarray(vec_b)
+    if _is_class_index(vec_a, vec_b):
+        # Subtract onehot vector
+        error_matrix = vec_a.astype(numpy.result_type(vec_a, 1.0))
+        error_matrix[_get_class_index(vec_a, vec_b)] -= 1.0
+        return error_matrix
+    return numpy.subtract(vec_a, _as_target_values(vec_a, vec_b))
+
+
+def _is_class_index(vec_a, vec_b):
+    """Return True if vec_b has an integer class index for each vector in vec_a.
+
+    Vectors with a single component are never indexed,
+    their integer targets are values.
+    """
+    return (vec_b.ndim == vec_a.ndim - 1 and vec_b.dtype.kind in 'iu'
+            and vec_a.shape[-1] > 1)
+
+
+def _as_target_values(vec_a, vec_b):
+    """Return vec_b, with a trailing axis if it has a target value for each vector in vec_a.
+
+    Only for vectors with a single component, so targets do not broadcast across rows.
+    """
+    if vec_b.ndim == vec_a.ndim - 1 and vec_a.shape[-1] == 1:
+        return vec_b[..., None]
+    return vec_b
+
+
+def _get_class_index(vec_a, vec_b):
+    """Return index of target class components in vec_a."""
+    if vec_a.ndim == 1:
+        return vec_b[()]
+    rows = numpy.ix_(*[numpy.arange(length) for length in vec_b.shape])
+    return rows + (vec_b, )
+
+
+def _as_float_arrays(vec_a, vec_b):
+    """Return vec_a as a float array, and vec_b as an array."""
+    vec_a = numpy.asarray(vec_a)
+    if vec_a.dtype.kind != 'f':
+        vec_a = vec_a.astype(numpy.float64)
+    return vec_a, numpy.asarray(vec_b)
+
 
-        # Ignore 0/0 (handled in next line), warn for (x/0),
-        # because this is less likely in practice, and may indicate a problem
-        with numpy.errstate(invalid='ignore', divide='warn'):
-            vec_b_div_vec_a = vec_b / vec_a
+def _clamp(values):
+    """Return new array of values, clamped to at least the smallest positive float."""
+    if numpy.min(values) < 0.0:
+        raise FloatingPointError('CrossEntropy is not defined for negative values')
+    return numpy.maximum(values, numpy.finfo(values.dtype).tiny)
 
-        # Change nan (0/0) to 0, and inf (x/0) to 1.79769313e+308
-        vec_b_div_vec_a = numpy.nan_to_num(vec_b_div_vec_a)
 
-        return self(vec_a, vec_b), vec_b_div_vec_a/(-len(vec_b))
+def _clamped_log(values):
+    """Return new array of log of values, clamped to at least the smallest positive float."""
+    clamped = _clamp(values)
+    if isinstance(clamped, numpy.ndarray):
+        return numpy.log(clamped, out=clamped)
+    return numpy.log(clamped)
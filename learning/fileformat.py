@@ -0,0 +1,120 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+
+"""Helpers shared by the binary file formats of learning.modelfile and learning.data.mapped.
+
+Both formats start with:
+    MAGIC (8 bytes)
+    version, header length (little-endian uint32 each)
+    JSON header
+followed by raw arrays, each starting at a multiple of ALIGNMENT.
+"""
+
+import os
+import json
+import struct
+import tempfile
+import contextlib
+
+ALIGNMENT = 64
+
+_PREFIX_FORMAT = '<II' # version, header length
+
+# umask can only be read by setting it, which is not thread safe, so read once
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def make_header(magic, make_header_func):
+    """Return (header, header_json), with data starting after the header.
+
+    Args:
+        magic: MAGIC of file format.
+        make_header_func: Function that takes the offset of data, and returns header dict.
+    """
+    # Header length depends on offsets, and offsets depend on header length.
+    # Move data start until header fits (offsets only grow by a few digits)
+    prefix_length = len(magic) + struct.calcsize(_PREFIX_FORMAT)
+    data_start = align(prefix_length)
+    while True:
+        header = make_header_func(data_start)
+        header_json = json.dumps(header, sort_keys=True)
+        if prefix_length + len(header_json) <= data_start:
+            return header, header_json
+        data_start = align(prefix_length + len(header_json))
+
+
+def write_header(file_, magic, version, header_json):
+    """Write magic, version, and header_json, from make_header, to start of file_."""
+    file_.write(magic)
+    file_.write(struct.pack(_PREFIX_FORMAT, version, len(header_json)))
+    file_.write(header_json)
+
+
+def read_header(file_name, magic, max_version, description):
+    """Return JSON header of file_name, as dict.
+
+    Args:
+        magic: Expected MAGIC of file format.
+        max_version: Latest supported version of file format.
+        description: Name of file format, for error messages, ex. 'model'.
+    """
+    with open(file_name, 'rb') as file_:
+        if file_.read(len(magic)) != magic:
+            raise ValueError('%s is not a %s file' % (file_name, description))
+
+        version, header_length = struct.unpack(
+            _PREFIX_FORMAT, file_.read(struct.calcsize(_PREFIX_FORMAT)))
+        if version > max_version:
+            raise ValueError('%s file version %d is not supported, '
+                             'expected version <= %d'
+                             % (description.capitalize(), version, max_version))
+
+        return json.loads(file_.read(header_length))
+
+
+@contextlib.contextmanager
+def atomic_path(file_name):
+    """Yield a temporary path, that is renamed to file_name when writing succeeds.
+
+    Readers never see a partially written file.
+    The file has the permissions open would give it, instead of mkstemp's 0600,
+    so files in shared directories can be read by others.
+    The temporary file is removed if writing fails.
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(file_descriptor)
+    try:
+        yield temp_path
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.rename(temp_path, file_name) # Atomic
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def align(offset):
+    """Return offset, rounded up to a multiple of ALIGNMENT."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,308 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+"""Frozen, inference-only models, made by Model.freeze.
+
+A frozen model holds only what predict needs:
+read-only, contiguous parameter arrays, and precomputed values.
+It has no optimizer, error function, activation buffers, or bookkeeping,
+so it is small to save, and fast to load.
+Predict does not modify a frozen model,
+so many threads can predict with one frozen model, each with its own Workspace.
+"""
+
+import pickle
+
+import numpy
+
+from learning import calculate
+from learning import modelfile
+
+
+class FrozenModel(object):
+    """Inference-only model.
+
+    Attributes cannot be set, and parameter arrays are read-only.
+    """
+    # Attributes holding parameters, saved as arrays by modelfile
+    _parameter_attributes = ()
+    _training_attributes = ()
+
+    def __init__(self, **attributes):
+        # Bypass __setattr__, which prevents modification
+        self.__dict__.update(attributes)
+        self._make_read_only()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s cannot be modified' % type(self).__name__)
+
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_read_only()
+
+    def _make_read_only(self):
+        """Make each parameter array read-only."""
+        for attribute in self._parameter_attributes:
+            value = getattr(self, attribute)
+            for array in (value if isinstance(value, (list, tuple)) else [value]):
+                if array is not None:
+                    array.flags.writeable = False
+
+    def predict(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix.
+
+        Args:
+            input_matrix: A matrix with samples in rows and attributes in columns.
+            workspace: Optional Workspace, for buffers of this call.
+                Returned outputs are stored in workspace,
+                and overwritten by the next call with the same workspace.
+
+        Returns:
+            numpy.array; Outputs stacked in rows.
+        """
+        raise NotImplementedError()
+
+    def save(self, file_name):
+        """Save frozen model to file, in compact binary format, see learning.modelfile."""
+        modelfile.save(self, file_name)
+
+    @classmethod
+    def load(cls, file_name, mmap_mode='c'):
+        """Load frozen model saved with FrozenModel.save.
+
+        Args:
+            file_name: Path of saved model.
+            mmap_mode: None, 'r', or 'c'; Memory map parameter arrays,
+                instead of reading them into memory. See modelfile.load.
+        """
+        model = modelfile.load(file_name, mmap_mode)
+        if type(model) != cls:
+            raise ValueError('%s does not match this class' % file_name)
+        return model
+
+    def serialize(self):
+        """Convert frozen model into string, with pickle protocol 2."""
+        return pickle.dumps(self, protocol=2)
+
+    @classmethod
+    def unserialize(cls, serialized_model):
+        """Convert serialized frozen model into FrozenModel."""
+        model = pickle.loads(serialized_model)
+        if type(model) != cls:
+            raise ValueError('serialized_model does not match this class')
+        return model
+
+
+class FrozenMLP(FrozenModel):
+    """Frozen MLP, made by MLP.freeze.
+
+    Args:
+        weight_matrices: Weight matrix of each layer, with bias in first row.
+        transfers: Transfer of each layer.
+        dtype: 'float32' or 'float64'; Type of frozen weights.
+    """
+    _parameter_attributes = ('_weight_matrices', '_biases')
+
+    def __init__(self, weight_matrices, transfers, dtype):
+        super(FrozenMLP, self).__init__(
+            # Bias is separate, so each weight matrix is contiguous
+            _weight_matrices=[_frozen_array(weight_matrix[1:], dtype)
+                              for weight_matrix in weight_matrices],
+            _biases=[_frozen_array(weight_matrix[0], dtype) for weight_matrix in weight_matrices],
+            _transfers=list(transfers),
+            _dtype=numpy.dtype(dtype))
+
+    def predict(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix."""
+        output_matrix = _as_input_matrix(
+            input_matrix, self._weight_matrices[0].shape[0], self._dtype)
+
+        for i, (weight_matrix, bias, transfer_func) in enumerate(
+                zip(self._weight_matrices, self._biases, self._transfers)):
+            out = _get_buffer(workspace, (id(self), i),
+                              (len(output_matrix), weight_matrix.shape[1]), self._dtype)
+            output_matrix = numpy.dot(output_matrix, weight_matrix, out=out)
+
+            # Bias and transfer are applied in place
+            output_matrix += bias
+            output_matrix = transfer_func(output_matrix, out=output_matrix)
+        return output_matrix
+
+
+class FrozenRBF(FrozenModel):
+    """Frozen RBF, made by RBF.freeze.
+
+    Args:
+        centers: Cluster center in each row.
+        weight_matrix: Output weight for each cluster, in rows.
+        variance: Variance of gaussian similarity to each center.
+        scale_by_similarity: If True, outputs are divided by total similarity.
+        dtype: 'float32' or 'float64'; Type of frozen parameters.
+    """
+    _parameter_attributes = ('_centers', '_center_norms', '_weight_matrix')
+
+    def __init__(self, centers, weight_matrix, variance, scale_by_similarity, dtype):
+        centers = _frozen_array(centers, dtype)
+        super(FrozenRBF, self).__init__(
+            _centers=centers,
+            _center_norms=calculate.squared_norms(centers),
+            _weight_matrix=_frozen_array(weight_matrix, dtype),
+            _variance=variance,
+            _scale_by_similarity=scale_by_similarity,
+            _dtype=numpy.dtype(dtype))
+
+    def predict(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix."""
+        input_matrix = _as_input_matrix(input_matrix, self._centers.shape[1], self._dtype)
+
+        similarity_matrix = _get_similarity_matrix(
+            input_matrix, self._centers, self._center_norms, self._variance,
+            _get_buffer(workspace, (id(self), 'similarities'),
+                        (len(input_matrix), len(self._centers)), self._dtype))
+
+        output_matrix = numpy.dot(
+            similarity_matrix, self._weight_matrix,
+            out=_get_buffer(workspace, (id(self), 'outputs'),
+                            (len(input_matrix), self._weight_matrix.shape[1]), self._dtype))
+        if self._scale_by_similarity:
+            output_matrix /= numpy.sum(similarity_matrix, axis=1, keepdims=True)
+        return output_matrix
+
+
+class FrozenPBNN(FrozenModel):
+    """Frozen PBNN, made by PBNN.freeze.
+
+    Args:
+        input_matrix: Stored inputs.
+        target_matrix: Stored targets, as a matrix, or a vector of class indices.
+        target_totals: Sum of rows in target matrix, or count of each class.
+        variance: Variance of gaussian similarity to each stored input.
+        scale_by_similarity: If True, outputs are divided by total similarity.
+        scale_by_class: If True, outputs are divided by target_totals.
+        dtype: 'float32' or 'float64'; Type of frozen parameters.
+    """
+    _parameter_attributes = ('_input_matrix', '_input_norms', '_target_matrix',
+                             '_classes', '_class_starts', '_class_scales')
+
+    def __init__(self, input_matrix, target_matrix, target_totals, variance,
+                 scale_by_similarity, scale_by_class, dtype):
+        if numpy.ndim(target_matrix) == 1:
+            # Class indices are kept, instead of a dense onehot matrix.
+            # Stored samples are sorted by class,
+            # so the output for each class is a sum over a contiguous range of similarities
+            order = numpy.argsort(target_matrix, kind='mergesort')
+            input_matrix = numpy.asarray(input_matrix)[order]
+            classes, class_starts = numpy.unique(numpy.asarray(target_matrix)[order],
+                                                 return_index=True)
+            target_matrix = None
+        else:
+            target_matrix = _frozen_array(target_matrix, dtype)
+            classes = class_starts = None
+
+        if scale_by_class:
+            # Precomputed reciprocal, 0 when target total is 0, like calculate.protvecdiv
+            target_totals = numpy.asarray(target_totals, dtype=dtype)
+            class_scales = numpy.zeros(target_totals.shape, dtype=dtype)
+            numpy.divide(1.0, target_totals, out=class_scales, where=(target_totals != 0))
+        else:
+            class_scales = None
+
+        input_matrix = _frozen_array(input_matrix, dtype)
+        super(FrozenPBNN, self).__init__(
+            _input_matrix=input_matrix,
+            _input_norms=calculate.squared_norms(input_matrix),
+            _target_matrix=target_matrix,
+            _classes=classes,
+            _class_starts=class_starts,
+            _num_outputs=len(target_totals),
+            _class_scales=class_scales,
+            _variance=variance,
+            _scale_by_similarity=scale_by_similarity,
+            _dtype=numpy.dtype(dtype))
+
+    def predict(self, input_matrix, workspace=None):
+        """Return the model outputs for each row of input_matrix."""
+        input_matrix = _as_input_matrix(input_matrix, self._input_matrix.shape[1], self._dtype)
+
+        similarity_matrix = _get_similarity_matrix(
+            input_matrix, self._input_matrix, self._input_norms, self._variance,
+            _get_buffer(workspace, (id(self), 'similarities'),
+                        (len(input_matrix), len(self._input_matrix)), self._dtype))
+
+        # Scale each stored target by corresponding similarity, and sum
+        output_matrix = _get_buffer(workspace, (id(self), 'outputs'),
+                                    (len(input_matrix), self._num_outputs), self._dtype)
+        if output_matrix is None:
+            output_matrix = numpy.empty((len(input_matrix), self._num_outputs), self._dtype)
+        if self._target_matrix is not None:
+            numpy.dot(similarity_matrix, self._target_matrix, out=output_matrix)
+        elif len(self._classes) == self._num_outputs:
+            # Sum similarities of each class
+            numpy.add.reduceat(similarity_matrix, self._class_starts, axis=1, out=output_matrix)
+        else:
+            # Classes without stored samples have 0 output
+            output_matrix.fill(0.0)
+            output_matrix[:, self._classes] = numpy.add.reduceat(
+                similarity_matrix, self._class_starts, axis=1)
+        if self._scale_by_similarity:
+            output_matrix /= numpy.sum(similarity_matrix, axis=1, keepdims=True)
+        if self._class_scales is not None:
+            output_matrix *= self._class_scales
+
+        # Convert outputs to probabilities
+        output_matrix /= numpy.sum(output_matrix, axis=1, keepdims=True)
+        return output_matrix
+
+
+###############################
+# Helpers
+###############################
+def _frozen_array(values, dtype):
+    """Return contiguous copy of values, with dtype."""
+    return numpy.array(values, dtype=dtype, order='C')
+
+
+def _as_input_matrix(input_matrix, num_attributes, dtype):
+    """Return input_matrix as array of dtype, or raise ValueError if shape is wrong."""
+    input_matrix = numpy.asarray(input_matrix, dtype=dtype)
+    if input_matrix.ndim != 2 or input_matrix.shape[1] != num_attributes:
+        raise ValueError('input_matrix shape == %s, expected %s columns' % (
+            input_matrix.shape, num_attributes))
+    return input_matrix
+
+
+def _get_buffer(workspace, key, shape, dtype):
+    """Return buffer of workspace, or None to allocate if workspace is None."""
+    if workspace is None:
+        return None
+    return workspace.get_buffer(key, shape, dtype)
+
+
+def _get_similarity_matrix(input_matrix, centers, center_norms, variance, out):
+    """Return gaussian similarity of each row of input_matrix to each center."""
+    squared_distances = calculate.squared_distance_matrix(input_matrix, centers, center_norms,
+                                                          out=out)
+    return calculate.gaussian_of_squared(squared_distances, variance, out=squared_distances)
@@ -0,0 +1,228 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+"""Compact binary file format for models.
+
+Layout (see learning.fileformat):
+    MAGIC (8 bytes)
+    version, header length (little-endian uint32 each)
+    JSON header (padded to ALIGNMENT)
+    Raw little-endian parameter arrays (each starting at a multiple of ALIGNMENT)
+    Skeleton (pickled model, with parameters replaced by references to arrays)
+
+Only learned parameters are stored as arrays.
+Scratch buffers are not stored, and training state (such as optimizers) is reset.
+Arrays can be memory mapped when loading, so loading is fast,
+and processes loading the same file share memory pages.
+"""
+
+import copy
+import pickle
+import functools
+
+import numpy
+
+from learning import fileformat
+from learning.fileformat import ALIGNMENT
+
+MAGIC = 'LRNMODEL'
+FORMAT_VERSION = 1
+
+
+def save(model, file_name):
+    """Save model to file_name, in compact binary format."""
+    arrays = []
+    skeleton = pickle.dumps(_make_skeleton(model, arrays, ''), protocol=2)
+
+    header, header_json = fileformat.make_header(
+        MAGIC, functools.partial(_make_header, model, arrays, len(skeleton)))
+
+    with fileformat.atomic_path(file_name) as temp_path:
+        with open(temp_path, 'wb') as file_:
+            fileformat.write_header(file_, MAGIC, FORMAT_VERSION, header_json)
+            for (_, array), array_header in zip(arrays, header['arrays']):
+                _pad_to(file_, array_header['offset'])
+                file_.write(array.tostring())
+            _pad_to(file_, header['skeleton']['offset'])
+            file_.write(skeleton)
+
+
+def load(file_name, mmap_mode='c'):
+    """Load model from file_name.
+
+    Args:
+        file_name: Path of file made by save.
+        mmap_mode: None, 'r', or 'c'; How parameter arrays are loaded.
+            None reads arrays into memory.
+            'r' memory maps arrays read-only.
+            'c' memory maps arrays copy-on-write. Pages are shared until written.
+    """
+    if mmap_mode not in (None, 'r', 'c'):
+        raise ValueError("mmap_mode must be one of (None, 'r', 'c')")
+
+    header = read_header(file_name)
+
+    with open(file_name, 'rb') as file_:
+        # Load arrays
+        arrays = {}
+        for array_header in header['arrays']:
+            arrays[array_header['path']] = _read_array(file_, file_name, array_header, mmap_mode)
+
+        # Load skeleton
+        file_.seek(header['skeleton']['offset'])
+        skeleton = pickle.loads(file_.read(header['skeleton']['length']))
+
+    return _fill_skeleton(skeleton, arrays)
+
+
+def read_header(file_name):
+    """Return JSON header of model file, as dict."""
+    return fileformat.read_header(file_name, MAGIC, FORMAT_VERSION, 'model')
+
+
+###############################
+# Skeleton
+###############################
+class _ModelSkeleton(object):
+    """Model, without parameter arrays."""
+    def __init__(self, class_, state):
+        self.class_ = class_
+        self.state = state
+
+
+class _ArrayReference(object):
+    """Placeholder for a parameter array."""
+    def __init__(self, path):
+        self.path = path
+
+
+def _make_skeleton(model, arrays, path):
+    """Return _ModelSkeleton for model.
+
+    Parameter arrays are replaced with _ArrayReference,
+    and appended to arrays as (path, array).
+    """
+    # Scratch attributes are excluded by __getstate__
+    state = model.__getstate__()
+
+    for attribute in model._parameter_attributes:
+        state[attribute] = _make_value_skeleton(
+            state[attribute], arrays, '%s%s' % (path, attribute))
+
+    for attribute in model._training_attributes:
+        # Don't modify given model
+        state[attribute] = copy.deepcopy(state[attribute])
+        state[attribute].reset()
+
+    return _ModelSkeleton(type(model), state)
+
+
+def _make_value_skeleton(value, arrays, path):
+    """Return value with parameter arrays replaced by _ArrayReference."""
+    if value is None:
+        return None
+
+    if isinstance(value, numpy.ndarray):
+        if value.dtype.hasobject:
+            raise ValueError('Cannot save parameter %s with object dtype' % path)
+
+        # Little-endian, and contiguous, for writing raw bytes
+        arrays.append((path, numpy.ascontiguousarray(
+            value, dtype=value.dtype.newbyteorder('<'))))
+        return _ArrayReference(path)
+
+    if isinstance(value, (list, tuple)):
+        return type(value)([_make_value_skeleton(item, arrays, '%s/%d' % (path, i))
+                            for i, item in enumerate(value)])
+
+    if hasattr(value, '_parameter_attributes'): # Nested model
+        return _make_skeleton(value, arrays, '%s/' % path)
+
+    raise TypeError('Cannot save parameter %s of type %s' % (path, type(value)))
+
+
+def _fill_skeleton(value, arrays):
+    """Return value, with each _ModelSkeleton and _ArrayReference replaced."""
+    if isinstance(value, _ArrayReference):
+        return arrays[value.path]
+
+    if isinstance(value, (list, tuple)):
+        return type(value)([_fill_skeleton(item, arrays) for item in value])
+
+    if isinstance(value, _ModelSkeleton):
+        state = value.state
+        for attribute in value.class_._parameter_attributes:
+            state[attribute] = _fill_skeleton(state[attribute], arrays)
+
+        model = value.class_.__new__(value.class_)
+        # Also restores scratch attributes
+        model.__setstate__(state)
+        return model
+
+    return value
+
+
+###############################
+# Helpers
+###############################
+def _read_array(file_, file_name, array_header, mmap_mode):
+    """Return array described by array_header."""
+    dtype = numpy.dtype(array_header['dtype'])
+    shape = tuple(array_header['shape'])
+    size = int(numpy.prod(shape))
+
+    if mmap_mode is None or size == 0: # Cannot memory map 0 bytes
+        file_.seek(array_header['offset'])
+        array = numpy.fromfile(file_, dtype=dtype, count=size).reshape(shape)
+    else:
+        array = numpy.memmap(file_name, dtype=dtype, mode=mmap_mode,
+                             offset=array_header['offset'], shape=shape)
+
+    # Native byte order, for efficient computation
+    return array.astype(dtype.newbyteorder('='), copy=False)
+
+
+def _make_header(model, arrays, skeleton_length, data_start):
+    """Return header dict, with arrays stored from data_start."""
+    array_headers = []
+    offset = data_start
+    for path, array in arrays:
+        array_headers.append({
+            'path': path,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        })
+        offset = fileformat.align(offset + array.nbytes)
+
+    return {
+        'version': FORMAT_VERSION,
+        'class': '%s.%s' % (type(model).__module__, type(model).__name__),
+        'arrays': array_headers,
+        'skeleton': {'offset': offset, 'length': skeleton_length}
+    }
+
+
+def _pad_to(file_, offset):
+    """Write zeros to file_ until offset."""
+    file_.write('\0' * (offset - file_.tell()))
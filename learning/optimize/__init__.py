@@ -37,4 +37,5 @@ from learning.optimize.linesearch import (SetStepSize, BacktrackingLineSearch,
 
 # Optimizers
 from learning.optimize.optimizer import (SteepestDescent,
-                                         SteepestDescentMomentum, BFGS)
+                                         SteepestDescentMomentum, BFGS,
+                                         FletcherReevesCG, PolakRibiereCG)
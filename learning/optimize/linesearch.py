@@ -39,10 +39,14 @@ class StepSizeGetter(object):
 
     Used by Optimizer.
     """
+    # (obj, jac) at x_k + step_size*p_k, for the most recently returned step size.
+    # None if not evaluated by this StepSizeGetter.
+    # Optimizer reuses these values in the next iteration.
+    step_obj_jac = None
 
     def reset(self):
         """Reset parameters."""
-        pass
+        self.step_obj_jac = None
 
     def __call__(self, xk, obj_xk, jac_xk, step_dir, problem):
         """Return step size.
@@ -83,13 +87,26 @@ class SetStepSize(StepSizeGetter):
 
 
 class BacktrackingLineSearch(StepSizeGetter):
-    """Return step size found with backtracking line search."""
+    """Return step size found with backtracking line search.
 
-    def __init__(self, c_1=1e-4, decr_rate=0.9, initial_step_getter=None):
+    Only objective values are evaluated, never jacobians.
+
+    Args:
+        num_candidates: Number of decreasing step sizes evaluated together,
+            with Problem.get_objs.
+            Efficient when the problem evaluates several parameters in one batch,
+            and the first step size is often not accepted.
+    """
+
+    def __init__(self, c_1=1e-4, decr_rate=0.9, initial_step_getter=None, num_candidates=1):
         super(BacktrackingLineSearch, self).__init__()
 
+        if num_candidates < 1:
+            raise ValueError('num_candidates must be >= 1')
+
         self._c_1 = c_1
         self._decr_rate = decr_rate
+        self._num_candidates = num_candidates
 
         if initial_step_getter is None:
             # Slightly more than 1 step up
@@ -122,7 +139,9 @@ class BacktrackingLineSearch(StepSizeGetter):
             problem.get_obj,
             self._c_1,
             initial_step,
-            decr_rate=self._decr_rate)
+            decr_rate=self._decr_rate,
+            objs_func=problem.get_objs,
+            num_candidates=self._num_candidates)
 
         self._initial_step_getter.update(step_size)
 
@@ -167,9 +186,10 @@ class WolfeLineSearch(StepSizeGetter):
         initial_step = self._initial_step_getter(xk, obj_xk, jac_xk, step_dir,
                                                  problem)
 
-        step_size = _line_search_wolfe(xk, obj_xk, jac_xk, step_dir,
-                                       problem.get_obj_jac, self._c_1,
-                                       self._c_2, initial_step)
+        step_size, step_obj, step_jac = _line_search_wolfe(
+            xk, obj_xk, jac_xk, step_dir, problem.get_obj_jac, self._c_1,
+            self._c_2, initial_step)
+        self.step_obj_jac = None if step_obj is None else (step_obj, step_jac)
 
         self._initial_step_getter.update(step_size)
         return step_size
@@ -182,7 +202,9 @@ def _backtracking_line_search(parameters,
                               obj_func,
                               c_1,
                               initial_step,
-                              decr_rate=0.9):
+                              decr_rate=0.9,
+                              objs_func=None,
+                              num_candidates=1):
     """Return step size that satisfies the armijo rule.
 
     Discover step size by decreasing step size in small increments.
@@ -194,6 +216,10 @@ def _backtracking_line_search(parameters,
         step_dir: p_k; Step direction (ex. jacobian in steepest descent) at x_k.
         obj_func: Function taking parameters and returning obj value at given parameters.
         c_1: Strictness parameter for Armijo rule.
+        objs_func: Function taking a list of parameters and returning obj value of each.
+            Used when num_candidates > 1.
+        num_candidates: Number of decreasing step sizes evaluated together.
+            Largest step size satisfying armijo rule is returned.
     """
     if numpy.isnan(obj_xk):
         # Failsafe because _armijo_rule will never return True
@@ -213,22 +239,45 @@ def _backtracking_line_search(parameters,
             )
             return step_size
 
-        obj_xk_plus_ap = obj_func(parameters + step_size * step_dir)
-        if _armijo_rule(step_size, obj_xk, jac_xk, step_dir, obj_xk_plus_ap,
-                        c_1):
-            assert step_size > 0
-            return step_size
+        if num_candidates == 1:
+            step_sizes = [step_size]
+            step_objs = [obj_func(parameters + step_size * step_dir)]
+        else:
+            # Evaluate the next few step sizes together, stopping at the failsafe
+            step_sizes = [step_size * decr_rate**j for j in range(num_candidates)]
+            step_sizes = [candidate for candidate in step_sizes if candidate >= 1e-10]
+            step_objs = objs_func([parameters + candidate * step_dir
+                                   for candidate in step_sizes])
+
+        for step_size, obj_xk_plus_ap in zip(step_sizes, step_objs):
+            if _armijo_rule(step_size, obj_xk, jac_xk, step_dir, obj_xk_plus_ap,
+                            c_1):
+                assert step_size > 0
+                return step_size
 
         # Did not satisfy, decrease step size and try again
         step_size *= decr_rate
 
 
-WOLFE_INCR_RATE = 1.5
+# Failsafe for numerical precision errors preventing convergence
+WOLFE_MAX_ITERATIONS = 100
+
+# When increasing step size, the next step is between
+# step + min * (step - prev_step), and step + max * (step - prev_step)
+WOLFE_EXTRAPOLATE_MIN = 0.5
+WOLFE_EXTRAPOLATE_MAX = 4.0
+
+# Interpolated step sizes are at least this fraction of the interval
+# from either end of the interval
+ZOOM_MARGIN = 0.1
+
+# Bisect if an iteration of zoom does not shrink the interval to this fraction
+ZOOM_MIN_SHRINK = 0.66
 
 
 def _line_search_wolfe(parameters, obj_xk, jac_xk, step_dir, obj_jac_func, c_1,
                        c_2, initial_step):
-    """Return step size that satisfies wolfe conditions.
+    """Return step size that satisfies strong wolfe conditions.
 
     See Numerical Optimization (2nd) pp. 60
 
@@ -237,6 +286,11 @@ def _line_search_wolfe(parameters, obj_xk, jac_xk, step_dir, obj_jac_func, c_1,
     then calls the zoom procedure to fine tune that interval
     until an acceptable step length is discovered.
 
+    Trial step sizes are chosen by cubic interpolation (More-Thuente style),
+    of the objective value and gradient at previously evaluated step sizes.
+    Every evaluated (step_size, obj, grad) is reused, so most searches
+    evaluate only a few step sizes.
+
     args:
         parameters: x_k; Parameter values at current step.
         obj_xk: f(x_k); Objective value at x_k.
@@ -245,6 +299,10 @@ def _line_search_wolfe(parameters, obj_xk, jac_xk, step_dir, obj_jac_func, c_1,
         obj_jac_func: Function taking parameters and returning obj and jac at given parameters.
         c_1: Strictness parameter for Armijo rule.
         c_2: Strictness parameter for curvature condition.
+
+    Returns:
+        (step_size, obj, jac); Objective value and jacobian at x_k + step_size*p_k.
+            obj and jac are None if step_size was not evaluated.
     """
     if numpy.isnan(obj_xk):
         # Failsafe for erroneously calculated obj_xk (usually overflow or x/0)
@@ -252,115 +310,109 @@ def _line_search_wolfe(parameters, obj_xk, jac_xk, step_dir, obj_jac_func, c_1,
         logging.warning(
             'nan objective value in _line_search_wolfe, defaulting to 1e-10 step size'
         )
-        return 1e-10
+        return 1e-10, None, None
 
-    step_zero_obj = obj_xk
     step_zero_grad = jac_xk.dot(step_dir)
 
     # We need the current and previous step size for some operations
-    prev_step_size = 0.0
-    prev_step_obj = step_zero_obj
-    prev_step_grad = step_zero_grad
+    # Each is (step_size, obj, grad, jac)
+    prev_probe = (0.0, obj_xk, step_zero_grad, jac_xk)
 
     step_size = initial_step
     for i in itertools.count(start=1):
-        if i >= 100:
-            # Failsafe for numerical precision errors preventing convergence
-            # This can happen if gradient provides very little improvement
-            # (or is in the wrong direction)
-            logging.warning('Wolfe line search aborting after 100 iterations')
-            return step_size
-
         # Evaluate objective and jacobian for most recent step size
-        step_obj, step_grad = _step_size_obj_jac_func(step_size, parameters,
-                                                      step_dir, obj_jac_func)
-
-        # True if objective did not improve (step_obj >= prev_step_obj), after first iterations,
-        # or armijo condition is False (step_obj > obj_xk + c_1*step_size*step_grad)
-        if ((i > 1 and step_obj >= prev_step_obj)
-                or (step_obj > obj_xk + c_1 * step_size * step_grad)):
-            return _zoom_wolfe(prev_step_size, prev_step_obj, step_size,
-                               parameters, obj_xk, step_zero_grad, step_dir,
-                               obj_jac_func, c_1, c_2)
+        probe = _probe_step(step_size, parameters, step_dir, obj_jac_func)
+        _, step_obj, step_grad, step_jac = probe
+
+        # True if armijo condition is False (step_obj > obj_xk + c_1*step_size*step_zero_grad),
+        # or objective did not improve (step_obj >= prev_step_obj), after first iterations
+        # Non-finite objective (usually overflow) is treated as too large
+        if (not numpy.isfinite(step_obj)
+                or step_obj > obj_xk + c_1 * step_size * step_zero_grad
+                or (i > 1 and step_obj >= prev_probe[1])):
+            return _zoom_wolfe(prev_probe, probe, parameters, obj_xk,
+                               step_zero_grad, step_dir, obj_jac_func, c_1, c_2)
 
         # Check if step size is already an acceptable step length
         # True when gradient is sufficiently small (magnitude wise)
         elif numpy.abs(step_grad) <= -c_2 * step_zero_grad:
-            return step_size
+            return step_size, step_obj, step_jac
 
         # If objective value did not improve (first if statement)
         # and step size needs to increase (non-negative gradient)
         elif step_grad >= 0:
-            return _zoom_wolfe(step_size, step_obj, prev_step_size, parameters,
-                               obj_xk, step_zero_grad, step_dir, obj_jac_func,
-                               c_1, c_2)
+            return _zoom_wolfe(probe, prev_probe, parameters, obj_xk,
+                               step_zero_grad, step_dir, obj_jac_func, c_1, c_2)
 
-        # Increase step size, score current values for comparison to previous
-        prev_step_size = step_size
-        prev_step_obj = step_obj
-        prev_step_grad = step_grad
+        if i >= WOLFE_MAX_ITERATIONS:
+            # Failsafe for numerical precision errors preventing convergence
+            # This can happen if gradient provides very little improvement
+            # (or is in the wrong direction)
+            logging.warning('Wolfe line search aborting after %d iterations',
+                            WOLFE_MAX_ITERATIONS)
+            return step_size, step_obj, step_jac
 
         # Similar to zoom, we need to find a new trial step size
         # somewhere between current, and an arbitrary max
         # alpha_i < alpha_{i+1} < max
-        # "The last step of the algorithm performs extrapolation to find
-        # the next trial value alpha_{i+1}.
-        # To implement this step we can use approaches like the interpolation
+        # "To implement this step we can use approaches like the interpolation
         # procedures above, or we can simply set alpha_{i+1} to some constant
         # multiple of alpha_i.
         # Whichever strategy we use,
         # it is important that the successive steps increase quickly enough to
         # reach the upper limit alpha_max in a finite number of iterations."
         # ~Numerical Optimization (2nd) pp. 61
-        # Use multiply by constant strategy
-        # TODO: Try other interpolation strategies
-        step_size *= WOLFE_INCR_RATE
+        # Use cubic extrapolation, bounded to grow quickly enough
+        step_size = _extrapolate_step(prev_probe, probe)
+        prev_probe = probe
 
 
-def _zoom_wolfe(step_size_low, step_size_low_obj, step_size_high, parameters,
-                step_zero_obj, step_zero_grad, step_dir, obj_jac_func, c_1,
-                c_2):
+def _zoom_wolfe(low, high, parameters, step_zero_obj, step_zero_grad, step_dir,
+                obj_jac_func, c_1, c_2):
     """Zoom into acceptable step size within a given interval.
 
     Args:
-        step_size_low: Step size with low objective value (good)
-        step_size_high: Step size with high objective value (high)
+        low: (step_size, obj, grad, jac); Step size with low objective value (good)
+        high: (step_size, obj, grad, jac); Step size with high objective value (bad)
+
+    Returns:
+        (step_size, obj, jac); Objective value and jacobian at step_size.
     """
     # NOTE: lower objective values are better
-    # (hence step_size_low better than step_size_high)
-    # TODO: Optimize by caching values repeatedly used in inequalities
+    # (hence low better than high)
+    prev_width = abs(high[0] - low[0])
+    bisect = False
 
     for i in itertools.count(start=1):
         # Choose step size
-        # NOTE: step_size should not be too close to low or high
-        # TODO: Test other strategies (see Interpolation subsection of NumOpt)
         # "Interpolate (using quadratic, cubic, or bisection)
         # to find a trial step length alpha_j between alpha_lo and alpha_hi"
         # ~Numerical Optimization (2nd) pp. 61
-        # Use bisection
-        step_size = _bisect_value(
-            min(step_size_low, step_size_high),
-            max(step_size_low, step_size_high))
+        step_size = _interpolate_step(low, high, bisect)
         assert step_size >= 0
 
-        if i >= 100:
+        probe = _probe_step(step_size, parameters, step_dir, obj_jac_func)
+        _, step_obj, step_grad, step_jac = probe
+
+        if i >= WOLFE_MAX_ITERATIONS:
             # Failsafe for numerical precision errors preventing convergence
             # This can happen if gradient provides very little improvement
             # (or is in the wrong direction)
-            logging.warning(
-                'Wolfe line search (zoom) aborting after 100 iterations')
-            return step_size
-
-        step_obj, step_grad = _step_size_obj_jac_func(step_size, parameters,
-                                                      step_dir, obj_jac_func)
+            logging.warning('Wolfe line search (zoom) aborting after %d iterations',
+                            WOLFE_MAX_ITERATIONS)
+            # Best step size found, unless it does not move
+            if low[0] > 0:
+                return low[0], low[1], low[3]
+            return step_size, step_obj, step_jac
 
         # If this step is worse, than the projection from initial parameters
-        # or this step is worse than the current high (bad) step size
-        if (step_obj > step_zero_obj + c_1 * step_size * step_zero_grad
-                or step_obj >= step_size_low_obj):
+        # or this step is worse than the current low (good) step size
+        if (not numpy.isfinite(step_obj)
+                or step_obj > step_zero_obj + c_1 * step_size * step_zero_grad
+                or step_obj >= low[1]):
             # step_size is not an improvement
             # This step size is the new poor valued side of the interval
-            step_size_high = step_size
+            high = probe
 
         # step_size is an improvement
         else:
@@ -368,19 +420,130 @@ def _zoom_wolfe(step_size_low, step_size_low_obj, step_size_high, parameters,
             # (first if statement is false),
             # and step size gradient is sufficiently small (magnitude wise)
             if numpy.abs(step_grad) <= -c_2 * step_zero_grad:
-                return step_size
+                return step_size, step_obj, step_jac
 
             # If good step size is larger than bad step size,
             # and gradient is positive,
             # or vice versa
-            if step_grad * (step_size_high - step_size_low) >= 0:
+            if step_grad * (high[0] - low[0]) >= 0:
                 # Set the current bad step size to the current good step size
                 # Because step_size is better (and will be set so in a couple lines)
-                step_size_high = step_size_low
+                high = low
+
+            low = probe
 
-            # Set step_size_low
-            step_size_low = step_size
-            step_size_low_obj = step_obj
+        # Interpolation can approach one end of the interval very slowly.
+        # Bisect if interval did not shrink enough
+        width = abs(high[0] - low[0])
+        bisect = width > ZOOM_MIN_SHRINK * prev_width
+        prev_width = width
+
+
+def _extrapolate_step(prev_probe, probe):
+    """Return a step size larger than probe, for bracketing.
+
+    Minimizer of cubic interpolating both probes,
+    bounded by WOLFE_EXTRAPOLATE_MIN and WOLFE_EXTRAPOLATE_MAX.
+
+    Args:
+        prev_probe: (step_size, obj, grad, jac) of previous step size.
+        probe: (step_size, obj, grad, jac) of current, larger step size.
+    """
+    distance = probe[0] - prev_probe[0]
+    min_ = probe[0] + WOLFE_EXTRAPOLATE_MIN * distance
+    max_ = probe[0] + WOLFE_EXTRAPOLATE_MAX * distance
+
+    step_size = _cubic_minimizer(prev_probe, probe)
+    if step_size is None or step_size > max_:
+        # Objective is still decreasing quickly
+        return max_
+    return max(step_size, min_)
+
+
+def _interpolate_step(low, high, bisect=False):
+    """Return a step size between low and high, for zoom.
+
+    Minimizer of cubic interpolating both ends of the interval,
+    or quadratic interpolating low obj and grad, and high obj,
+    if cubic has no minimizer in the interval.
+    When high has a larger objective value, the cubic minimizer is used if it is
+    closer to low than the quadratic minimizer, otherwise the average of both
+    (More-Thuente, case 1).
+    Interpolated step sizes are kept ZOOM_MARGIN away from ends of the interval.
+
+    Args:
+        low: (step_size, obj, grad, jac); Step size with low objective value.
+        high: (step_size, obj, grad, jac); Step size with high objective value.
+        bisect: If True, return value half way between low and high.
+    """
+    min_ = min(low[0], high[0])
+    max_ = max(low[0], high[0])
+
+    if not bisect:
+        step_size = _cubic_minimizer(low, high)
+        if step_size is None or not min_ <= step_size <= max_:
+            step_size = _quadratic_minimizer(low, high)
+        elif not high[1] <= low[1]: # Also True for nan
+            # Cubic can be a poor fit, when objective rises quickly
+            quadratic_step_size = _quadratic_minimizer(low, high)
+            if (quadratic_step_size is not None
+                    and abs(quadratic_step_size - low[0]) < abs(step_size - low[0])):
+                step_size = 0.5 * (step_size + quadratic_step_size)
+
+        if step_size is not None and min_ <= step_size <= max_:
+            margin = ZOOM_MARGIN * (max_ - min_)
+            return min(max(step_size, min_ + margin), max_ - margin)
+
+    return _bisect_value(min_, max_)
+
+
+def _cubic_minimizer(probe_a, probe_b):
+    """Return minimizer of cubic interpolating obj and grad of both probes.
+
+    Return None if cubic has no minimizer.
+    See Numerical Optimization (2nd) pp. 59
+    """
+    step_a, obj_a, grad_a = float(probe_a[0]), float(probe_a[1]), float(probe_a[2])
+    step_b, obj_b, grad_b = float(probe_b[0]), float(probe_b[1]), float(probe_b[2])
+    if step_a == step_b:
+        return None
+
+    with numpy.errstate(all='ignore'):
+        d_1 = grad_a + grad_b - 3.0 * (obj_a - obj_b) / (step_a - step_b)
+        radicand = d_1 * d_1 - grad_a * grad_b
+        if not radicand >= 0: # Also False for nan
+            return None
+        d_2 = numpy.sign(step_b - step_a) * numpy.sqrt(radicand)
+
+        denominator = grad_b - grad_a + 2.0 * d_2
+        if denominator == 0:
+            return None
+        step_size = step_b - (step_b - step_a) * (grad_b + d_2 - d_1) / denominator
+
+    if not numpy.isfinite(step_size):
+        return None
+    return step_size
+
+
+def _quadratic_minimizer(probe_a, probe_b):
+    """Return minimizer of quadratic interpolating obj and grad of probe_a, and obj of probe_b.
+
+    Return None if quadratic has no minimizer.
+    """
+    step_a, obj_a, grad_a = float(probe_a[0]), float(probe_a[1]), float(probe_a[2])
+    step_b, obj_b = float(probe_b[0]), float(probe_b[1])
+    distance = step_b - step_a
+
+    with numpy.errstate(all='ignore'):
+        # Twice the coefficient of squared term, times distance^2
+        curvature = 2.0 * (obj_b - obj_a - grad_a * distance)
+        if not curvature > 0: # Also False for nan
+            return None
+        step_size = step_a - grad_a * distance * distance / curvature
+
+    if not numpy.isfinite(step_size):
+        return None
+    return step_size
 
 
 def _bisect_value(min_, max_):
@@ -388,14 +551,17 @@ def _bisect_value(min_, max_):
     return min_ + 0.5 * (max_ - min_)
 
 
-def _step_size_obj_jac_func(step_size, parameters, step_dir, obj_jac_func):
-    """Return objective value and gradient for step size."""
+def _probe_step(step_size, parameters, step_dir, obj_jac_func):
+    """Return (step_size, obj, grad, jac) for step size.
+
+    grad is derivative of objective with respect to step size.
+    """
     step_obj, jac_xk_plus_ap = obj_jac_func(parameters + step_size * step_dir)
     # Derivative of step size objective function, is jacobian
     # dot step direction
     step_grad = jac_xk_plus_ap.dot(step_dir)
 
-    return step_obj, step_grad
+    return step_size, step_obj, step_grad, jac_xk_plus_ap
 
 
 def _wolfe_conditions(step_size, parameters, obj_xk, jac_xk, step_dir,
@@ -46,23 +46,61 @@ class Optimizer(object):
         self.jacobian = None  # Last computed jacobian
         self.hessian = None  # Last computed hessian
 
+        # (problem, parameters, obj, jac) evaluated by line search of previous iteration
+        self._next_obj_jac = None
+
     def reset(self):
         """Reset optimizer parameters."""
         self.jacobian = None
         self.hessian = None
+        self._next_obj_jac = None
+
+    def __getstate__(self):
+        """Return state for pickling, without values of the previous problem."""
+        # Problem functions are often not picklable
+        state = self.__dict__.copy()
+        state['_next_obj_jac'] = None
+        return state
 
     def next(self, problem, parameters):
         """Return next iteration of this optimizer."""
         raise NotImplementedError()
 
+    def _get_obj_jac(self, problem, parameters):
+        """Return objective value and jacobian at parameters.
+
+        Values evaluated by the line search of the previous iteration are reused,
+        if problem is the same instance, and parameters are unchanged.
+        """
+        next_obj_jac = self._next_obj_jac
+        self._next_obj_jac = None
+
+        if next_obj_jac is not None:
+            prev_problem, next_parameters, obj_value, jacobian = next_obj_jac
+            if prev_problem is problem and numpy.array_equal(next_parameters, parameters):
+                return obj_value, jacobian
+
+        return problem.get_obj_jac(parameters)
+
+    def _save_obj_jac(self, problem, next_parameters, step_size_getter):
+        """Save objective value and jacobian at next_parameters, if evaluated by step_size_getter.
+
+        next_parameters must be x_k + step_size*p_k, as evaluated by step_size_getter.
+        """
+        if step_size_getter.step_obj_jac is None:
+            self._next_obj_jac = None
+        else:
+            # Copy, in case caller modifies returned parameters in place
+            self._next_obj_jac = ((problem, next_parameters.copy())
+                                  + tuple(step_size_getter.step_obj_jac))
+
 
 ################################
 # Optimizer Implementations
 ################################
-# TODO: Optimize optimizers by re-using objective and jacobians calculated
-# during line searches. Such as by caching these values, and checking cache before
-# calculating (Problem object can cache these (by parameters), but we need to make sure
-# model do not make another instance of an Problem if the problem is the same)
+# NOTE: Objective and jacobian calculated by line search are re-used
+# by the next iteration, only if the same Problem instance is given.
+# Models should only re-use a Problem instance if the problem is the same.
 class SteepestDescent(Optimizer):
     """Simple steepest descent with constant step size."""
 
@@ -81,17 +119,20 @@ class SteepestDescent(Optimizer):
 
     def next(self, problem, parameters):
         """Return next iteration of this optimizer."""
-        obj_value, self.jacobian = problem.get_obj_jac(parameters)
+        obj_value, self.jacobian = self._get_obj_jac(problem, parameters)
 
         if numpy.linalg.norm(self.jacobian) < JACOBIAN_NORM_BREAK:
             logging.info('Optimizer converged with small jacobian')
             return obj_value, parameters
 
+        step_dir = -self.jacobian
         step_size = self._step_size_getter(
-            parameters, obj_value, self.jacobian, -self.jacobian, problem)
+            parameters, obj_value, self.jacobian, step_dir, problem)
 
         # Take a step down the first derivative direction
-        return obj_value, parameters - step_size * self.jacobian
+        next_parameters = parameters + step_size * step_dir
+        self._save_obj_jac(problem, next_parameters, self._step_size_getter)
+        return obj_value, next_parameters
 
 
 class SteepestDescentMomentum(Optimizer):
@@ -180,7 +221,7 @@ class BFGS(Optimizer):
 
     def next(self, problem, parameters):
         """Return next iteration of this optimizer."""
-        obj_value, self.jacobian = problem.get_obj_jac(parameters)
+        obj_value, self.jacobian = self._get_obj_jac(problem, parameters)
 
         if numpy.linalg.norm(self.jacobian) < JACOBIAN_NORM_BREAK:
             logging.info('Optimizer converged with small jacobian')
@@ -194,14 +235,16 @@ class BFGS(Optimizer):
         step_size = self._step_size_getter(parameters, obj_value,
                                            self.jacobian, step_dir, problem)
 
-        return obj_value, parameters + step_size * step_dir
+        next_parameters = parameters + step_size * step_dir
+        self._save_obj_jac(problem, next_parameters, self._step_size_getter)
+        return obj_value, next_parameters
 
     def _get_approx_inv_hessian(self, parameters, jacobian):
         """Calculate approx inv hessian for this iteration, and return it."""
         # If first iteration
         if self._prev_params is None:
             # Default to identity for approx inv hessian
-            H_kp1 = numpy.identity(parameters.shape[0])
+            H_kp1 = numpy.identity(parameters.shape[0], dtype=parameters.dtype)
 
             # Don't save H_kp1, so we can differentiate between first
             # and second iteration
@@ -227,7 +270,7 @@ class BFGS(Optimizer):
                 #     s_k, y_k)
 
                 # And using unscaled identity instead
-                H_kp1 = _bfgs_eq(numpy.identity(parameters.shape[0]),
+                H_kp1 = _bfgs_eq(numpy.identity(parameters.shape[0], dtype=parameters.dtype),
                                  parameters - self._prev_params,
                                  jacobian - self._prev_jacobian)
 
@@ -279,7 +322,8 @@ def _bfgs_eq(H_k, s_k, y_k):
 
     # More efficient implementation with arrays and fast [:, None] transposes
     # Vectors are row vectors (1d, as given)
-    I = numpy.identity(s_k.shape[0])
+    # Same dtype as parameters, so float32 problems stay float32
+    I = numpy.identity(s_k.shape[0], dtype=s_k.dtype)
 
     # Calculate p_k with failsafe for divide by zero errors
     y_k_dot_s_k = y_k.dot(s_k) # y_k.dot(s_k) == y_k.dot(s_k[:, None])
@@ -297,3 +341,157 @@ def _bfgs_eq(H_k, s_k, y_k):
         .dot(I - (p_k * y_k)[:, None] * (s_k))
         + (p_k_times_s_k[:, None] * s_k)
     )
+
+
+class ConjugateGradient(Optimizer):
+    """Nonlinear conjugate gradient optimizer.
+
+    Ref: Numerical Optimization (2nd) pp. 121
+
+    Each step direction is the negative jacobian,
+    plus beta times the previous step direction.
+    Subclasses define beta.
+    Only the previous jacobian and step direction are stored,
+    so memory is O(n), unlike BFGS.
+
+    The search restarts with the negative jacobian (steepest descent)
+    every restart_iters iterations,
+    when consecutive jacobians are far from orthogonal,
+    or when the step direction is not a descent direction.
+    Restarts also help when the problem changes between iterations,
+    such as with mini-batches.
+
+    NOTE: Step size should satisfy strong Wolfe conditions, with c_2 < 0.5,
+    so step directions are descent directions.
+
+    Args:
+        step_size_getter: StepSizeGetter; Finds step size for each step direction.
+        restart_iters: Restart after this many iterations.
+            Defaults to number of parameters.
+        orthogonality_threshold: Restart if |g_k^T g_{k-1}| / ||g_k||^2
+            is at least this value.
+    """
+
+    def __init__(self, step_size_getter=None, restart_iters=None,
+                 orthogonality_threshold=0.1):
+        super(ConjugateGradient, self).__init__()
+
+        if restart_iters is not None and restart_iters < 1:
+            raise ValueError('restart_iters must be >= 1')
+
+        if step_size_getter is None:
+            step_size_getter = WolfeLineSearch(
+                # Values recommended by Numerical Optimization 2nd, pp. 34
+                c_1=1e-4, c_2=0.1, initial_step_getter=FOChangeInitialStep())
+        self._step_size_getter = step_size_getter
+
+        self._restart_iters = restart_iters
+        self._orthogonality_threshold = orthogonality_threshold
+
+        # Conjugate gradient parameters
+        self._prev_jacobian = None
+        self._prev_step_dir = None
+        self._iters_since_restart = 0
+
+    def reset(self):
+        """Reset optimizer parameters."""
+        super(ConjugateGradient, self).reset()
+        self._step_size_getter.reset()
+
+        # Reset conjugate gradient parameters
+        self._prev_jacobian = None
+        self._prev_step_dir = None
+        self._iters_since_restart = 0
+
+    def next(self, problem, parameters):
+        """Return next iteration of this optimizer."""
+        obj_value, self.jacobian = self._get_obj_jac(problem, parameters)
+
+        if numpy.linalg.norm(self.jacobian) < JACOBIAN_NORM_BREAK:
+            logging.info('Optimizer converged with small jacobian')
+            return obj_value, parameters
+
+        step_dir = self._get_step_dir(parameters, self.jacobian)
+
+        step_size = self._step_size_getter(parameters, obj_value,
+                                           self.jacobian, step_dir, problem)
+
+        # Save values from current iteration for next iteration
+        self._prev_jacobian = self.jacobian
+        self._prev_step_dir = step_dir
+
+        next_parameters = parameters + step_size * step_dir
+        self._save_obj_jac(problem, next_parameters, self._step_size_getter)
+        return obj_value, next_parameters
+
+    def _get_step_dir(self, parameters, jacobian):
+        """Return step direction for this iteration."""
+        restart_iters = self._restart_iters
+        if restart_iters is None:
+            restart_iters = parameters.shape[0]
+
+        jacobian_dot = jacobian.dot(jacobian)
+        if (self._prev_jacobian is None
+                or self._iters_since_restart >= restart_iters
+                # Consecutive jacobians should be nearly orthogonal
+                # ~Numerical Optimization (2nd) pp. 125
+                or (abs(jacobian.dot(self._prev_jacobian))
+                    >= self._orthogonality_threshold * jacobian_dot)):
+            return self._restart(jacobian)
+
+        step_dir = -jacobian + self._get_beta(jacobian, jacobian_dot) * self._prev_step_dir
+        if jacobian.dot(step_dir) >= 0.0:
+            # Not a descent direction, can happen if step size
+            # does not satisfy strong Wolfe conditions
+            return self._restart(jacobian)
+
+        self._iters_since_restart += 1
+        return step_dir
+
+    def _restart(self, jacobian):
+        """Return steepest descent direction, and restart iteration count."""
+        self._iters_since_restart = 1
+        return -jacobian
+
+    def _get_beta(self, jacobian, jacobian_dot):
+        """Return beta, multiplier of previous step direction.
+
+        Args:
+            jacobian: grad_f_k; Jacobian of this iteration.
+            jacobian_dot: grad_f_k^T grad_f_k
+        """
+        raise NotImplementedError()
+
+
+class FletcherReevesCG(ConjugateGradient):
+    """Fletcher-Reeves nonlinear conjugate gradient optimizer.
+
+    beta_k = grad_f_k^T grad_f_k / grad_f_{k-1}^T grad_f_{k-1}
+    Ref: Numerical Optimization (2nd) pp. 121
+    """
+
+    def _get_beta(self, jacobian, jacobian_dot):
+        """Return beta, multiplier of previous step direction."""
+        prev_jacobian_dot = self._prev_jacobian.dot(self._prev_jacobian)
+        if prev_jacobian_dot == 0.0:
+            return 0.0
+        return jacobian_dot / prev_jacobian_dot
+
+
+class PolakRibiereCG(ConjugateGradient):
+    """Polak-Ribiere nonlinear conjugate gradient optimizer.
+
+    beta_k = max(0, grad_f_k^T (grad_f_k - grad_f_{k-1}) / grad_f_{k-1}^T grad_f_{k-1})
+    Ref: Numerical Optimization (2nd) pp. 122
+
+    Usually more effective than Fletcher-Reeves.
+    beta is at least 0 (PR+), which restarts when beta would be negative,
+    and ensures step directions are descent directions.
+    """
+
+    def _get_beta(self, jacobian, jacobian_dot):
+        """Return beta, multiplier of previous step direction."""
+        prev_jacobian_dot = self._prev_jacobian.dot(self._prev_jacobian)
+        if prev_jacobian_dot == 0.0:
+            return 0.0
+        return max(0.0, (jacobian_dot - jacobian.dot(self._prev_jacobian)) / prev_jacobian_dot)
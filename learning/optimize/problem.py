@@ -46,6 +46,12 @@ class Problem(object):
 
         obj_jac_hess: obj_jac_hess_func, (obj_jac_func, hess), (obj_hess_func, jac),
             (obj, jac_hess_func), (obj, jac, hess)
+
+        objs: objs_func, (obj for each parameters)
+
+    objs_func takes a list of parameters, and returns a list of objective values.
+    Give objs_func when objective values of several parameters can be calculated
+    more efficiently together, such as in one stacked batch.
     """
 
     def __init__(self,
@@ -55,7 +61,8 @@ class Problem(object):
                  obj_jac_func=None,
                  obj_hess_func=None,
                  jac_hess_func=None,
-                 obj_jac_hess_func=None):
+                 obj_jac_hess_func=None,
+                 objs_func=None):
         # Get objective function
         if obj_func is not None:
             self.get_obj = obj_func
@@ -149,6 +156,12 @@ class Problem(object):
             self.get_obj_jac_hess = functools.partial(
                 _bundle, (self.get_obj, self.get_jac, self.get_hess))
 
+        # Get objective for each of a list of parameters function
+        if objs_func is not None:
+            self.get_objs = objs_func
+        else:
+            self.get_objs = functools.partial(_map_func, self.get_obj)
+
 
 def _call_return_indices(func, indices, *args, **kwargs):
     """Return indices of func called with *args and **kwargs.
@@ -183,6 +196,11 @@ def _bundle_add_split(f_1, f_2, *args, **kwargs):
     return f_1_values[0], f_2(*args, **kwargs), f_1_values[1]
 
 
+def _map_func(func, args_list):
+    """Return func called with each item in args_list."""
+    return [func(args) for args in args_list]
+
+
 def _tuple_result(func, *args, **kwargs):
     return func(*args, **kwargs), # , makes tuple
 
@@ -27,8 +27,11 @@ import random
 
 import numpy
 
+from learning import dtypes
 from learning.architecture import knn
 
+_STATS_BLOCK_ROWS = 2**16 # Rows of each float64 block, when computing ColumnStats
+
 def shuffle(dataset):
     """Return shuffled (input_matrix, target_matrix) dataset.
 
@@ -40,109 +43,311 @@ def shuffle(dataset):
     random.shuffle(indices)
     return dataset[0][indices], dataset[1][indices]
 
-def make_onehot(vector):
+def make_onehot(vector, dtype=None):
     """Return a matrix of one-hot vectors from a vector of values.
 
     Use to convet a vector of class labels into a target_matrix.
     Each one-hot vector has a single 1.0, and many 0.0s.
-    """
-    # Find classes, and corresponding onehot vectors
-    class_onehots = _class_indices_to_onehots(_class_indices(vector))
+    Columns are classes, in order of first appearance.
 
-    # Add onehot vector to matrix for each value (class) in vector
-    matrix = []
-    for val in vector:
-        # Append a copy of the onehot vector corresponding to this class
-        matrix.append(class_onehots[str(val)].copy())
+    Args:
+        vector: Vector of class labels. Each row is a class, whether vector is 1d, 2d, etc.
+        dtype: 'float32' or 'float64'; Type of returned matrix.
+            Defaults to dtypes.get_default_dtype().
+    """
+    class_indices, num_classes = _get_class_indices(vector)
 
-    return numpy.array(matrix)
+    matrix = numpy.zeros((len(class_indices), num_classes), dtype=dtypes.get_dtype(dtype))
+    matrix[numpy.arange(len(class_indices)), class_indices] = 1.0
+    return matrix
 
-def make_labels(matrix):
+def make_labels(matrix, compact=False):
     """Return a column vector of unique indices.
 
     Use to convert onehot matrix into class labels.
-    """
-    class_indices = _class_indices(matrix)
+    Indices are given to classes in order of first appearance.
 
-    # Make column vector
-    vector = []
-    for row in matrix:
-        vector.append([class_indices[str(row)]])
+    Args:
+        matrix: Matrix of class labels, such as onehot vectors. Each row is a class.
+        compact: If True, return a 1d vector, with the smallest integer type
+            that holds every index.
+    """
+    class_indices, num_classes = _get_class_indices(matrix)
 
-    return numpy.array(vector)
+    if compact:
+        return class_indices.astype(numpy.min_scalar_type(max(num_classes-1, 0)))
+    return class_indices[:, None]
 
-def _class_indices(vector):
-    """Return dict mapping class -> index.
+def _get_class_indices(vector):
+    """Return (class index of each row, number of classes).
 
     Classes get index in order of first appearance.
     """
-    # Find all classes
     # Each unique row is considered a class, whether matrix is 1d, 2d, etc.
     # This alllows it to work with col vectors, or 1d vectors
-    class_indices = {}
-    index = 0
-    for val in vector:
-        key = str(val)
-        if key not in class_indices:
-            class_indices[key] = index
-            index += 1
-    return class_indices
-
-def _class_indices_to_onehots(class_indices):
-    """Return dict mapping class -> onehot_vec."""
-    num_classes = len(class_indices)
-    class_onehots = {}
-    for class_, index in class_indices.iteritems():
-        onehot = numpy.zeros(num_classes)
-        onehot[index] = 1.0
-        class_onehots[class_] = onehot
-    return class_onehots
+    array = numpy.asarray(vector)
+    if len(array) == 0:
+        return numpy.zeros(0, dtype=int), 0
+
+    if array.ndim == 2 and array.shape[1] == 1:
+        array = array[:, 0]
+    elif array.ndim == 2 and _is_onehot(array):
+        # Each class is the column of its 1
+        array = numpy.argmax(array, axis=1)
+
+    if array.ndim == 1 and array.dtype.kind in 'biu':
+        # Small range of integers can be counted, without sorting
+        offsets = array.astype(int) - int(numpy.min(array))
+        if numpy.max(offsets) < 2*len(offsets) + 1024:
+            return _get_offset_class_indices(offsets)
+
+    try:
+        if array.ndim == 1:
+            _, first_indices, class_indices = numpy.unique(
+                array, return_index=True, return_inverse=True)
+        else:
+            _, first_indices, class_indices = numpy.unique(
+                array.reshape(len(array), -1), axis=0, return_index=True, return_inverse=True)
+    except TypeError:
+        # Object arrays, such as ragged rows, cannot be compared by numpy.unique
+        class_dict = {}
+        class_indices = numpy.array([class_dict.setdefault(str(val), len(class_dict))
+                                     for val in vector], dtype=int)
+        return class_indices, len(class_dict)
+
+    # numpy.unique sorts classes, reorder by first appearance
+    ranks = numpy.empty(len(first_indices), dtype=int)
+    ranks[numpy.argsort(first_indices)] = numpy.arange(len(first_indices))
+    return ranks[class_indices], len(first_indices)
+
+def _get_offset_class_indices(offsets):
+    """Return (class index of each row, number of classes), for non-negative integer offsets."""
+    # First index of each offset. When an index is repeated, the last assignment is kept,
+    # so assign in reverse
+    num_rows = len(offsets)
+    first_indices = numpy.full(numpy.max(offsets)+1, num_rows)
+    first_indices[offsets[::-1]] = numpy.arange(num_rows-1, -1, -1)
+
+    classes = numpy.flatnonzero(first_indices < num_rows)
+    classes = classes[numpy.argsort(first_indices[classes])]
+
+    ranks = numpy.empty(len(first_indices), dtype=int)
+    ranks[classes] = numpy.arange(len(classes))
+    return ranks[offsets], len(classes)
+
+def _is_onehot(matrix):
+    """Return True if each row of matrix has a single 1, and 0s."""
+    if matrix.dtype.kind not in 'biuf':
+        return False
+    # With no negatives, a row that sums to 1 with a max of 1 has only 0s otherwise
+    return bool((numpy.min(matrix) >= 0)
+                and (numpy.sum(matrix, axis=1) == 1).all()
+                and (numpy.max(matrix, axis=1) == 1).all())
 
 ########################
 # Normalization
 ########################
-def rescale(matrix):
-    """Scale each column to [-1, 1]."""
-    scaled_matrix = numpy.array(matrix, dtype='float64')
-
-    scaled_matrix -= numpy.min(scaled_matrix, axis=0) # Each col, min of 0
-    scaled_matrix /= numpy.max(scaled_matrix, axis=0) # Each col, max of 1
+def rescale(matrix, dtype=None):
+    """Scale each column to [-1, 1].
 
-    # Scale from [0, 1] to [-1, 1]
-    scaled_matrix *= 2.0
-    scaled_matrix -= 1.0
+    Use Rescaler to apply the same scaling to other matrices.
 
-    return scaled_matrix
+    Args:
+        matrix: A matrix of values.
+        dtype: 'float32' or 'float64'; Type of returned matrix.
+            Defaults to dtypes.get_default_dtype().
+    """
+    return Rescaler().fit_transform(matrix, dtype=dtype)
 
-def normalize(matrix):
+def normalize(matrix, dtype=None):
     """Normalize matrix to a mean of 0 and standard devaiation of 1, for each dimension.
 
     This improves numerical stability and allows for easier gradient descent.
+    Use Normalizer to apply the same normalization to other matrices.
 
     Args:
         matrix: numpy.matrix; A matrix of values.
             We expect each row to be a point, and each column to be a dimension.
+        dtype: 'float32' or 'float64'; Type of returned matrix.
+            Defaults to dtypes.get_default_dtype().
     """
-    np_matrix = numpy.array(matrix, dtype='float64')
-
-    if np_matrix.shape[0] < 2:
+    if len(matrix) < 2:
         raise ValueError('Cannot normalize a matrix with only one row')
 
-    # Subtract the mean of each attribute from that attribute, for each point
-    np_matrix -= numpy.mean(np_matrix, axis=0)
+    return Normalizer().fit_transform(matrix, dtype=dtype)
 
-    # Divide the standard deviation of each attribute from that attribute, for each point
-    try:
-        with numpy.errstate(divide='raise', invalid='raise'):
-            np_matrix /= numpy.std(np_matrix, axis=0)
-    except FloatingPointError:
-        # STD of zero
-        np_matrix /= numpy.std(np_matrix, axis=0)
+class Scaler(object):
+    """Scaling of each column, fit on one dataset, and applied to any matrix.
 
-        # Replace Nan (0 / inf) and inf (x / inf) with 0.0
-        np_matrix[~ numpy.isfinite(np_matrix)] = 0.0
+    Statistics can be fit a chunk at a time with partial_fit,
+    for datasets larger than memory,
+    and scalers fit in different processes can be merged.
 
-    return np_matrix
+    Args:
+        stats: Optional ColumnStats, to scale with statistics computed elsewhere.
+    """
+    def __init__(self, stats=None):
+        if stats is None:
+            stats = ColumnStats()
+        self.stats = stats
+
+    def fit(self, matrix):
+        """Fit statistics of matrix, replacing any previous statistics.
+
+        Returns:
+            self
+        """
+        self.stats = ColumnStats()
+        return self.partial_fit(matrix)
+
+    def partial_fit(self, matrix):
+        """Include rows of matrix in statistics.
+
+        Returns:
+            self
+        """
+        self.stats.update(matrix)
+        return self
+
+    def merge(self, other):
+        """Include statistics of other scaler, such as a scaler fit in another process.
+
+        Returns:
+            self
+        """
+        self.stats.merge(other.stats)
+        return self
+
+    def fit_transform(self, matrix, dtype=None):
+        """Fit statistics of matrix, and return scaled copy of matrix."""
+        return self.fit(matrix).transform(matrix, dtype=dtype)
+
+    def transform(self, matrix, out=None, dtype=None):
+        """Return matrix scaled with fit statistics.
+
+        Columns that are constant in fit statistics are scaled to 0.
+
+        Args:
+            matrix: A matrix of values, with the columns of the fit matrix.
+            out: Optional array to store result in.
+                Pass out=matrix to scale a float array in place, without copying.
+            dtype: 'float32' or 'float64'; Type of returned matrix, when out is None.
+                Defaults to dtypes.get_default_dtype().
+        """
+        offset, divisor = self._get_offset_divisor()
+        # Constant columns have (x - offset) / inf = 0
+        divisor = numpy.where(divisor == 0.0, numpy.inf, divisor)
+
+        out = _get_out(matrix, out, dtype)
+        out -= offset.astype(out.dtype)
+        out /= divisor.astype(out.dtype)
+        return out
+
+    def inverse_transform(self, matrix, out=None, dtype=None):
+        """Return matrix with scaling undone, such as outputs of a model trained on scaled targets.
+
+        Args:
+            matrix: A matrix of scaled values.
+            out: Optional array to store result in. Can be matrix.
+            dtype: 'float32' or 'float64'; Type of returned matrix, when out is None.
+                Defaults to dtypes.get_default_dtype().
+        """
+        offset, divisor = self._get_offset_divisor()
+
+        out = _get_out(matrix, out, dtype)
+        out *= divisor.astype(out.dtype)
+        out += offset.astype(out.dtype)
+        return out
+
+    def _get_offset_divisor(self):
+        """Return (offset, divisor), such that scaled = (matrix - offset) / divisor."""
+        raise NotImplementedError()
+
+class Rescaler(Scaler):
+    """Scale each column to [-1, 1], like rescale."""
+    def _get_offset_divisor(self):
+        """Return (offset, divisor), such that scaled = (matrix - offset) / divisor."""
+        _check_fit(self.stats)
+        # Center of range to 0, and half of range to 1
+        return (self.stats.max + self.stats.min) / 2.0, (self.stats.max - self.stats.min) / 2.0
+
+class Normalizer(Scaler):
+    """Scale each column to mean 0 and standard deviation 1, like normalize."""
+    def _get_offset_divisor(self):
+        """Return (offset, divisor), such that scaled = (matrix - offset) / divisor."""
+        _check_fit(self.stats)
+        return self.stats.mean, self.stats.std
+
+class ColumnStats(object):
+    """Count, min, max, mean, and variance of each column, updated a chunk at a time.
+
+    Statistics are accumulated in float64.
+    """
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = None
+        self._sum_squares = None # Sum of squared differences from mean
+
+    @property
+    def variance(self):
+        """Population variance of each column, like numpy.var."""
+        return self._sum_squares / self.count
+
+    @property
+    def std(self):
+        """Population standard deviation of each column, like numpy.std."""
+        return numpy.sqrt(self.variance)
+
+    def update(self, matrix):
+        """Include rows of matrix in statistics."""
+        matrix = numpy.asarray(matrix)
+
+        # Limit size of float64 copies, for large float32 matrices
+        for start in range(0, len(matrix), _STATS_BLOCK_ROWS):
+            block = numpy.asarray(matrix[start:start+_STATS_BLOCK_ROWS], dtype='float64')
+            mean = numpy.mean(block, axis=0)
+            self._combine(len(block), numpy.min(block, axis=0), numpy.max(block, axis=0),
+                          mean, numpy.sum((block - mean)**2, axis=0))
+
+    def merge(self, other):
+        """Include statistics of other ColumnStats, such as from another process."""
+        if other.count > 0:
+            self._combine(other.count, other.min, other.max, other.mean, other._sum_squares)
+
+    def _combine(self, count, min_, max_, mean, sum_squares):
+        """Include statistics of count other rows."""
+        if self.count == 0:
+            self.min = min_
+            self.max = max_
+            self.mean = mean
+            self._sum_squares = sum_squares
+        else:
+            self.min = numpy.minimum(self.min, min_)
+            self.max = numpy.maximum(self.max, max_)
+
+            # Combine with statistics of previous rows, see Chan et al.
+            total = self.count + count
+            delta = mean - self.mean
+            self.mean = self.mean + delta*(float(count) / total)
+            self._sum_squares = (self._sum_squares + sum_squares
+                                 + delta**2 * (float(self.count) * count / total))
+        self.count += count
+
+def _check_fit(stats):
+    """Raise ValueError if stats do not include any rows."""
+    if stats.count == 0:
+        raise ValueError('Scaler must be fit before transform')
+
+def _get_out(matrix, out, dtype):
+    """Return out, containing values of matrix, or a new array if out is None."""
+    if out is None:
+        return numpy.array(matrix, dtype=dtypes.get_dtype(dtype))
+
+    if out is not matrix:
+        out[...] = matrix
+    return out
 
 def softmax_normalize(matrix):
     """Normalize inputs, while reducing the influence of outliers.
@@ -241,7 +446,8 @@ def _pca_get_eigenvalues(data_matrix):
         numpy.array; Eigenvectors.
     """
     covariance = numpy.cov(data_matrix, rowvar=False)
-    return numpy.linalg.eigh(covariance)
+    eigen_values, eigen_vectors = numpy.linalg.eigh(covariance)
+    return eigen_values, _flip_signs(eigen_vectors.T).T
 
 def _pca_reduce_dimensions(data_matrix, eigen_vectors,
                            selected_dimensions):
@@ -268,11 +474,17 @@ def _pca_reduce_dimensions(data_matrix, eigen_vectors,
     # Perform the reduction using selected eigenvectors
     return numpy.dot(eigen_vectors.T, data_matrix.T).T
 
-def pca(data_matrix, desired_num_dimensions=None, select_dimensions_func=None):
+def pca(data_matrix, desired_num_dimensions=None, select_dimensions_func=None,
+        method='full'):
     """Use principle component analysis to reduce the dimensionality of a data set.
 
     Note: dataset is normalized before analysis, without side effects,
           and resulting matrix is normalized before returning.
+    Use PCA to apply the same reduction to other matrices.
+
+    method is the PCA method used with desired_num_dimensions.
+    Default 'full' is exact, and gives the same result every call.
+    'auto' or 'randomized' can be much faster for large matrices, but are not deterministic.
     """
     if desired_num_dimensions is not None and select_dimensions_func is not None:
         raise ValueError('Use only desired_num_dimensions or num_dimensions_func')
@@ -282,21 +494,194 @@ def pca(data_matrix, desired_num_dimensions=None, select_dimensions_func=None):
     # Normalize
     normalized_matrix = normalize(data_matrix)
 
-    # Perform PCA, using covariance method
-    eigen_values, eigen_vectors = _pca_get_eigenvalues(normalized_matrix)
-
-    # Select eigenvectors, based on user input
     if desired_num_dimensions is not None:
-        selected_dimensions = numpy.argsort(eigen_values)[::-1][:desired_num_dimensions]
-
-    if select_dimensions_func is not None:
+        # Only top components are needed, without covariance matrix
+        reduced_data_matrix = PCA(desired_num_dimensions, method=method).fit_transform(normalized_matrix)
+    else:
+        # Perform PCA, using covariance method,
+        # because select_dimensions_func needs all eigenvalues
+        eigen_values, eigen_vectors = _pca_get_eigenvalues(normalized_matrix)
         selected_dimensions = select_dimensions_func(eigen_values)
 
-    # Perform the pca reduction
-    reduced_data_matrix = _pca_reduce_dimensions(normalized_matrix, eigen_vectors,
-                                                 selected_dimensions)
+        # Perform the pca reduction
+        reduced_data_matrix = _pca_reduce_dimensions(normalized_matrix, eigen_vectors,
+                                                     selected_dimensions)
     return normalize(reduced_data_matrix)
 
+class PCA(object):
+    """Principle component analysis, fit once, and applied to any matrix.
+
+    Components can be fit on a whole matrix with fit,
+    or updated a chunk at a time with partial_fit (incremental PCA, see Ross et al.),
+    for datasets larger than memory.
+    Data is centered, but not scaled. Normalize first if columns have different scales.
+
+    Args:
+        num_components: Number of components to keep.
+        method: 'auto', 'full', or 'randomized'; Decomposition used by fit.
+            'full' uses a singular value decomposition of the data.
+            'randomized' uses a randomized singular value decomposition (see Halko et al.),
+            which is much faster when num_components is small compared to the number of columns.
+            'auto' uses 'randomized' for large matrices, when num_components is small enough.
+        power_iterations: Number of power iterations of 'randomized'.
+            More iterations are more accurate, and slower.
+        oversamples: Number of extra random vectors used by 'randomized'.
+        whiten: If True, transform scales each component to a variance of 1.
+
+    Attributes:
+        components: num_components x columns matrix. Each row is a component,
+            in order of decreasing variance.
+        explained_variance: Variance of data along each component.
+        mean: Mean of each column of fit data.
+    """
+    METHODS = ('auto', 'full', 'randomized')
+
+    def __init__(self, num_components, method='auto', power_iterations=2, oversamples=10,
+                 whiten=False):
+        if num_components < 1:
+            raise ValueError('num_components must be >= 1')
+        if method not in self.METHODS:
+            raise ValueError('method must be one of %s' % (self.METHODS, ))
+
+        self.num_components = num_components
+        self.method = method
+        self.power_iterations = power_iterations
+        self.oversamples = oversamples
+        self.whiten = whiten
+
+        self.components = None
+        self.explained_variance = None
+        self.mean = None
+        self._singular_values = None
+        self._count = 0
+
+    def fit(self, matrix):
+        """Fit components of matrix, replacing any previous components.
+
+        Returns:
+            self
+        """
+        matrix = _float_matrix(matrix)
+        if len(matrix) < self.num_components:
+            raise ValueError('Must fit at least num_components rows')
+
+        self.mean = dtypes.mean(matrix, axis=0)
+        centered_matrix = matrix - self.mean
+
+        if self._use_randomized(centered_matrix.shape):
+            singular_values, components = _randomized_svd(
+                centered_matrix, self.num_components, self.oversamples, self.power_iterations)
+        else:
+            _, singular_values, components = numpy.linalg.svd(centered_matrix, full_matrices=False)
+
+        self._count = len(matrix)
+        self._set_components(singular_values, components)
+        return self
+
+    def partial_fit(self, matrix):
+        """Update components with rows of matrix.
+
+        Each chunk is combined with the components of previous chunks,
+        so only num_components vectors are stored between chunks.
+
+        Returns:
+            self
+        """
+        if self._count == 0:
+            return self.fit(matrix)
+
+        matrix = _float_matrix(matrix)
+        if len(matrix) == 0:
+            return self
+
+        # Update mean, see Chan et al.
+        count = len(matrix)
+        total = self._count + count
+        chunk_mean = dtypes.mean(matrix, axis=0)
+        mean = self.mean + (chunk_mean - self.mean)*(float(count) / total)
+
+        # Decompose previous components (scaled by singular values), centered chunk,
+        # and a row correcting for the change in mean
+        stacked_matrix = numpy.vstack([
+            self._singular_values[:, None] * self.components,
+            matrix - chunk_mean,
+            numpy.sqrt(float(self._count) * count / total) * (self.mean - chunk_mean)
+        ])
+        _, singular_values, components = numpy.linalg.svd(stacked_matrix, full_matrices=False)
+
+        self.mean = mean
+        self._count = total
+        self._set_components(singular_values, components)
+        return self
+
+    def transform(self, matrix):
+        """Return matrix projected onto components."""
+        if self.components is None:
+            raise ValueError('PCA must be fit before transform')
+
+        matrix = numpy.asarray(matrix, dtype=self.components.dtype)
+        reduced_matrix = numpy.dot(matrix - self.mean, self.components.T)
+        if self.whiten:
+            std = numpy.sqrt(self.explained_variance)
+            # Components with no variance are 0
+            reduced_matrix /= numpy.where(std == 0.0, numpy.inf, std)
+        return reduced_matrix
+
+    def fit_transform(self, matrix):
+        """Fit components of matrix, and return matrix projected onto components."""
+        return self.fit(matrix).transform(matrix)
+
+    def _use_randomized(self, shape):
+        """Return True if fit should use a randomized decomposition."""
+        if self.method == 'auto':
+            return max(shape) > 500 and self.num_components < 0.8*min(shape)
+        return self.method == 'randomized'
+
+    def _set_components(self, singular_values, components):
+        """Keep num_components largest components."""
+        self._singular_values = singular_values[:self.num_components]
+        self.components = _flip_signs(components[:self.num_components])
+        # Population variance, like normalize
+        self.explained_variance = self._singular_values**2 / self._count
+
+def _randomized_svd(matrix, num_components, oversamples, power_iterations):
+    """Return (singular_values, right_singular_vectors) of the largest num_components.
+
+    See "Finding structure with randomness", Halko et al.
+    Only matrix products with matrix, and decompositions of small matrices, are needed.
+    """
+    num_vectors = min(num_components + oversamples, min(matrix.shape))
+
+    # Orthonormal basis for the range of matrix
+    random_matrix = numpy.random.normal(size=(matrix.shape[1], num_vectors)).astype(matrix.dtype)
+    basis, _ = numpy.linalg.qr(numpy.dot(matrix, random_matrix))
+    for _ in range(power_iterations):
+        # Re-orthonormalize every product, for stability
+        basis, _ = numpy.linalg.qr(numpy.dot(matrix.T, basis))
+        basis, _ = numpy.linalg.qr(numpy.dot(matrix, basis))
+
+    # Decompose small matrix, projected onto basis
+    _, singular_values, components = numpy.linalg.svd(
+        numpy.dot(basis.T, matrix), full_matrices=False)
+    return singular_values[:num_components], components[:num_components]
+
+def _flip_signs(components):
+    """Return components (in rows) with sign such that the largest component is positive.
+
+    Makes results deterministic, since decompositions can return either sign.
+    """
+    max_indices = numpy.argmax(numpy.abs(components), axis=1)
+    signs = numpy.sign(components[numpy.arange(len(components)), max_indices])
+    signs[signs == 0] = 1
+    return components * signs[:, None]
+
+def _float_matrix(matrix):
+    """Return matrix as a float array, keeping float32 and float64 arrays."""
+    matrix = numpy.asarray(matrix)
+    if matrix.dtype.name not in dtypes.FLOAT_DTYPES:
+        matrix = matrix.astype(dtypes.get_default_dtype())
+    return matrix
+
 
 ##############################
 # All in one dataset cleaning
@@ -23,8 +23,17 @@
 ###############################################################################
 """Reinforcement learning models."""
 
+import random
 import operator
 
+import numpy
+
+SELECTION_STRATEGIES = ('greedy', 'softmax', 'epsilon')
+
+# When the reward offset of ArrayRLTable grows past this magnitude,
+# it is folded into the reward array, to maintain floating point precision
+MAX_REWARD_OFFSET = 1e6
+
 class RLTable(object):
     """Reinforcement learning using a (state, action) -> reward table.
 
@@ -92,6 +101,188 @@ class RLTable(object):
         if self._reward_table[state] == {}:
             self._reward_table.pop(state)
 
+class ArrayRLTable(object):
+    """Reinforcement learning using a (state, action) -> reward table, stored in an array.
+
+    Learns the same rewards as RLTable, but states and actions are mapped to
+    indices of a 2d reward array.
+    Reward growth is tracked as a global offset, so update does not depend on
+    the number of (state, action) pairs,
+    and get_action is a single argmax over a row.
+
+    Args:
+        selection: One of ('greedy', 'softmax', 'epsilon');
+            Strategy for selecting an action in get_action.
+            greedy: Action with largest reward.
+            softmax: Random action, weighted by softmax of reward / temperature.
+            epsilon: Random action with probability epsilon, otherwise greedy.
+        temperature: Temperature for softmax selection.
+            Lower temperatures prefer actions with larger reward more strongly.
+        epsilon: Probability of random action for epsilon selection.
+    """
+    def __init__(self, states, actions, initial_reward=2.0, update_rate=0.5,
+                 reward_growth=0.0, selection='greedy', temperature=1.0, epsilon=0.1):
+        if update_rate <= 0.0 or update_rate > 1.0:
+            raise ValueError('update_rate must be within (0, 1]')
+        if selection not in SELECTION_STRATEGIES:
+            raise ValueError('selection must be one of %s' % (SELECTION_STRATEGIES,))
+        if temperature <= 0.0:
+            raise ValueError('temperature must be > 0')
+        if epsilon < 0.0 or epsilon > 1.0:
+            raise ValueError('epsilon must be within [0, 1]')
+
+        self._initial_reward = initial_reward
+        self._update_rate = update_rate
+        self._reward_growth = reward_growth
+        self._selection = selection
+        self._temperature = temperature
+        self._epsilon = epsilon
+
+        # Map state and action to row and column of reward array
+        self._state_indices = {}
+        self._action_indices = {}
+        self._actions = [] # column -> action
+        self._num_rows = 0 # Rows of reward array in use, others are spare capacity
+        self._free_rows = [] # Rows of deleted states, for re-use
+
+        # Actual reward is stored reward + offset,
+        # so all rewards can grow by changing only the offset
+        self._reward_offset = 0.0
+
+        # Missing (state, action) pairs are -inf, so they are never selected
+        self._reward_array = numpy.full((len(states), len(actions)), -numpy.inf)
+
+        # Make initial table, for each state, action pair
+        if len(set(states)) != len(states) or len(set(actions)) != len(actions):
+            raise ValueError('(state, action) pair already exists')
+        for state in states:
+            self._add_state_index(state)
+        for action in actions:
+            self._add_action_index(action)
+        self._reward_array[:] = initial_reward
+
+    def get_action(self, state):
+        """Return action for this state, selected by selection strategy."""
+        rewards = self._reward_array[self._state_indices[state]]
+
+        if self._selection == 'greedy':
+            index = numpy.argmax(rewards)
+        elif self._selection == 'epsilon':
+            if random.random() < self._epsilon:
+                index = random.choice(numpy.flatnonzero(rewards != -numpy.inf))
+            else:
+                index = numpy.argmax(rewards)
+        else: # softmax
+            index = _softmax_select(rewards, self._temperature)
+
+        return self._actions[index]
+
+    def get_reward(self, state, action):
+        """Return expected reward for given (state, action)."""
+        return self._reward_array[self._get_index(state, action)] + self._reward_offset
+
+    def update(self, state, action, new_reward):
+        """Update reward for given (state, action)."""
+        index = self._get_index(state, action)
+        self._reward_array[index] = _adjust_value(
+            self._reward_array[index] + self._reward_offset, new_reward,
+            self._update_rate) - self._reward_offset
+
+        # Update all reward values by self._reward_growth
+        if self._reward_growth != 0.0:
+            self._reward_offset += self._reward_growth
+
+            # Large offsets lose precision, fold into rewards occasionally
+            if abs(self._reward_offset) > MAX_REWARD_OFFSET:
+                self._reward_array += self._reward_offset
+                self._reward_offset = 0.0
+
+    def add_action(self, state, action):
+        """Add new action to track."""
+        # Get row for given state
+        try:
+            row = self._state_indices[state]
+        except KeyError:
+            row = self._add_state_index(state)
+
+        # Get column for given action
+        try:
+            col = self._action_indices[action]
+        except KeyError:
+            col = self._add_action_index(action)
+
+        # Add action for this state, if it does not exist
+        if self._reward_array[row, col] != -numpy.inf:
+            raise ValueError('(state, action) pair already exists')
+        else:
+            self._reward_array[row, col] = self._initial_reward - self._reward_offset
+
+    def delete_action(self, state, action):
+        """Remove action from tracking."""
+        index = self._get_index(state, action)
+        self._reward_array[index] = -numpy.inf
+
+        # Remove state when it has no actions
+        row = index[0]
+        if (self._reward_array[row] == -numpy.inf).all():
+            self._state_indices.pop(state)
+            self._free_rows.append(row)
+
+    def _get_index(self, state, action):
+        """Return (row, col) of given (state, action) in reward array.
+
+        Raise KeyError if (state, action) is not tracked.
+        """
+        index = (self._state_indices[state], self._action_indices[action])
+        if self._reward_array[index] == -numpy.inf:
+            raise KeyError((state, action))
+        return index
+
+    def _add_state_index(self, state):
+        """Add a row for state, and return its index."""
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = self._num_rows
+            self._num_rows += 1
+            if row >= self._reward_array.shape[0]:
+                self._reward_array = _grow_array(self._reward_array, axis=0)
+        self._state_indices[state] = row
+        return row
+
+    def _add_action_index(self, action):
+        """Add a column for action, and return its index."""
+        col = len(self._actions)
+        self._action_indices[action] = col
+        self._actions.append(action)
+        if col >= self._reward_array.shape[1]:
+            self._reward_array = _grow_array(self._reward_array, axis=1)
+        return col
+
+def _grow_array(array, axis):
+    """Return array with capacity doubled along axis, new items are -inf.
+
+    Doubling keeps the cost of adding many states or actions linear.
+    """
+    shape = list(array.shape)
+    shape[axis] = max(1, shape[axis])
+    return numpy.concatenate((array, numpy.full(shape, -numpy.inf)), axis=axis)
+
+def _softmax_select(rewards, temperature):
+    """Return index selected randomly, weighted by softmax of rewards / temperature.
+
+    -inf rewards are never selected.
+    """
+    # Subtract max to prevent overflow, exp(-inf) is 0
+    cumulative_weights = numpy.cumsum(numpy.exp((rewards - numpy.max(rewards)) / temperature))
+
+    # First index with cumulative weight greater than a random point in [0, total)
+    # Indices with 0 weight never have a cumulative weight greater than the previous index
+    index = numpy.searchsorted(cumulative_weights, random.random()*cumulative_weights[-1],
+                               side='right')
+    # Failsafe for rounding errors, when random point == total
+    return min(index, numpy.flatnonzero(rewards != -numpy.inf)[-1])
+
 def _adjust_value(old_value, new_value, rate):
     """Return old_value, incrementally adjusted towards new_value.
 
@@ -0,0 +1,228 @@
+###############################################################################
+# The MIT License (MIT)
+#
+# Copyright (c) 2017 Justin Lovinger
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+###############################################################################
+"""Serve single-row activations, coalesced into micro-batches.
+
+Many callers, such as threads of an RPC server, submit one input vector each.
+A worker thread collects queued rows into a batch,
+bounded by max_batch_size and max_wait,
+and activates the model once for the whole batch:
+    with BatchServer(model.freeze()) as server:
+        output_vec = server.activate(input_vec)
+"""
+
+import time
+import Queue
+import threading
+
+import numpy
+
+from learning.base import Workspace
+from learning.frozen import FrozenModel
+
+_STOP = object() # Queued by stop, after pending requests
+
+
+class TimeoutError(Exception):
+    """Result of a Future is not ready before timeout."""
+
+
+class Future(object):
+    """Output of one submitted row, set by the worker thread of BatchServer."""
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        """Return True if result or exception is set."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Return output vector, waiting up to timeout seconds (forever if None).
+
+        Raises the exception of activation, if it failed,
+        or TimeoutError if result is not ready before timeout.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('Result not ready after %s seconds' % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def set_result(self, result):
+        """Set output vector, and wake waiting callers."""
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        """Set exception raised by result, and wake waiting callers."""
+        self._exception = exception
+        self._done.set()
+
+
+class BatchServer(object):
+    """Activate a model on single rows, coalesced into micro-batches.
+
+    Rows can be submitted before start, and are activated once started.
+
+    Args:
+        model: Model, activated with activate_batch,
+            or FrozenModel, activated with predict.
+            Model is only activated by the worker thread.
+        max_batch_size: Max number of rows in each batch.
+        max_wait: Max seconds to wait for more rows, after the first row of a batch.
+            Bounds the latency added to each row, when requests are infrequent.
+    """
+    def __init__(self, model, max_batch_size=64, max_wait=0.002):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be >= 1')
+        if max_wait < 0:
+            raise ValueError('max_wait must be >= 0')
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        if isinstance(model, FrozenModel):
+            self._activate_batch = model.predict
+        else:
+            self._activate_batch = model.activate_batch
+
+        # Buffers of worker thread, reused by each batch
+        self._workspace = Workspace()
+
+        self._queue = Queue.Queue() # (input_vec, future)
+        self._thread = None
+        self._stopped = False
+        # Rows are never queued after _STOP
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.num_batches = 0
+        self.num_rows = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start worker thread."""
+        if self._thread is not None:
+            raise ValueError('BatchServer is already started')
+        if self._stopped:
+            raise ValueError('BatchServer is stopped')
+
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True # Don't keep process alive
+        self._thread.start()
+
+    def stop(self):
+        """Activate pending rows, then stop worker thread.
+
+        If never started, pending rows fail with ValueError instead.
+        Rows cannot be submitted after stop.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(_STOP)
+
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            # No worker to activate pending rows, don't leave callers waiting forever
+            while True:
+                request = self._queue.get()
+                if request is _STOP:
+                    break
+                request[1].set_exception(ValueError('BatchServer was stopped before start'))
+
+    def submit(self, input_vec):
+        """Queue input_vec for activation, and return Future of output vector."""
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                raise ValueError('BatchServer is stopped')
+            self._queue.put((input_vec, future))
+        return future
+
+    def activate(self, input_vec, timeout=None):
+        """Return output vector for input_vec, waiting until its batch is activated."""
+        return self.submit(input_vec).result(timeout)
+
+    def _serve(self):
+        """Activate batches of queued rows, until _STOP."""
+        while True:
+            batch = []
+            stop = self._collect_batch(batch)
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    def _collect_batch(self, batch):
+        """Append queued (input_vec, future) to batch, until max_batch_size or max_wait.
+
+        Waits without limit for the first row.
+        Returns True if _STOP was reached.
+        """
+        request = self._queue.get()
+        if request is _STOP:
+            return True
+        batch.append(request)
+
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Rows already queued are taken without waiting
+                request = self._queue.get(timeout=max(deadline - time.time(), 0.0))
+            except Queue.Empty:
+                return False
+            if request is _STOP:
+                return True
+            batch.append(request)
+        return False
+
+    def _run_batch(self, batch):
+        """Activate rows of batch with a single batched pass, and set each future."""
+        try:
+            input_matrix = numpy.array([input_vec for input_vec, _ in batch])
+            # Copied out of workspace, since workspace is reused by the next batch
+            output_matrix = numpy.array(self._activate_batch(input_matrix, self._workspace))
+        except Exception as exception:
+            if len(batch) == 1:
+                batch[0][1].set_exception(exception)
+            else:
+                # One bad row should not fail every row of its batch
+                for request in batch:
+                    self._run_batch([request])
+            return
+
+        self.num_batches += 1
+        self.num_rows += len(batch)
+        for (_, future), output_vec in zip(batch, output_matrix):
+            future.set_result(output_vec)
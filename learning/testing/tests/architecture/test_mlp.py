@@ -7,7 +7,7 @@ import numpy
 from learning.architecture import mlp
 from learning.error import MSE, CrossEntropy
 from learning.data import datasets
-from learning import base, validation
+from learning import base, validation, calculate
 
 from learning.testing import helpers
 
@@ -59,6 +59,36 @@ def test_mlp_classifier_convergence():
     assert validation.get_error(model, *dataset) <= 0.02
 
 
+@pytest.mark.parametrize('error_func', [MSE(), CrossEntropy()])
+def test_mlp_class_index_targets(error_func):
+    # Training with class indices is the same as training with onehot targets
+    input_matrix, target_matrix = datasets.get_xor()
+    model = mlp.MLP((2, 2, 2), transfers=mlp.SoftmaxTransfer(), error_func=error_func)
+    model.logging = False
+    index_model = copy.deepcopy(model)
+
+    model.train(input_matrix, target_matrix, iterations=5)
+    index_model.train(input_matrix, numpy.argmax(target_matrix, axis=1), iterations=5)
+
+    for weight_matrix, index_weight_matrix in zip(model._weight_matrices,
+                                                  index_model._weight_matrices):
+        assert helpers.approx_equal(weight_matrix, index_weight_matrix)
+
+
+def test_mlp_binary_int_targets():
+    # Single output, integer targets are values
+    input_matrix = numpy.random.random((10, 2))
+    int_targets = numpy.random.randint(0, 2, 10)
+    float_targets = int_targets[:, None].astype(float)
+
+    model = mlp.MLP((2, 3, 1))
+    float_model = copy.deepcopy(model)
+    assert helpers.approx_equal(model.train_step(input_matrix, int_targets),
+                                float_model.train_step(input_matrix, float_targets))
+    assert helpers.approx_equal(validation.get_error(model, input_matrix, int_targets),
+                                validation.get_error(model, input_matrix, float_targets))
+
+
 def test_mlp_bias():
     # Should have bias for each layer
     model = mlp.MLP((2, 4, 3))
@@ -86,6 +116,114 @@ def test_mlp_perceptron():
     model._weight_matrices[0][2][0] = 2.0
     assert (model.activate([1, 1]) == [3.0]).all()
 
+@pytest.mark.parametrize('transfers', [None, mlp.SoftmaxTransfer(), mlp.TanhTransfer()])
+def test_mlp_activate_batch(transfers):
+    model = mlp.MLP((2, 3, 2), transfers=transfers)
+    input_matrix = numpy.random.random((5, 2))
+
+    assert helpers.approx_equal(
+        model.activate_batch(input_matrix),
+        [model.activate(input_vec) for input_vec in input_matrix])
+
+def test_mlp_activate_batch_workspace():
+    model = mlp.MLP((2, 3, 2))
+    input_matrix = numpy.random.random((5, 2))
+    expected = model.activate_batch(input_matrix)
+    weight_inputs = copy.deepcopy(model._weight_inputs)
+
+    workspace = base.Workspace()
+    outputs = model.activate_batch(input_matrix, workspace)
+    assert helpers.approx_equal(outputs, expected)
+
+    # Outputs are stored in workspace, and model is not modified
+    assert model.activate_batch(input_matrix, workspace) is outputs
+    assert helpers.approx_equal(model.activate(input_matrix[0], workspace), expected[0])
+    for vec, orig_vec in zip(model._weight_inputs, weight_inputs):
+        assert (vec == orig_vec).all()
+
+
+def test_mlp_activate_batch_threads():
+    import threading
+
+    model = mlp.MLP((4, 8, 3), transfers=mlp.SoftmaxTransfer())
+    input_matrices = [numpy.random.random((20, 4)) for _ in range(8)]
+    expected = [model.activate_batch(input_matrix) for input_matrix in input_matrices]
+
+    # One model, activated by many threads, each with its own workspace
+    outputs = [None]*len(input_matrices)
+    def activate(i):
+        workspace = base.Workspace()
+        for _ in range(20):
+            outputs[i] = numpy.copy(model.activate_batch(input_matrices[i], workspace))
+
+    threads = [threading.Thread(target=activate, args=(i, )) for i in range(len(input_matrices))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for output_matrix, expected_matrix in zip(outputs, expected):
+        assert helpers.approx_equal(output_matrix, expected_matrix)
+
+
+@pytest.mark.parametrize('model', [mlp.MLP((2, 4, 3, 2)),
+                                   mlp.MLP((2, 3, 2), transfers=mlp.SoftmaxTransfer()),
+                                   mlp.DropoutMLP((2, 4, 3, 2))])
+def test_mlp_forward_outputs(model):
+    input_matrix = numpy.random.random((5, 2))
+    if isinstance(model, mlp.DropoutMLP):
+        model._draw_masks(5)
+
+    # Same outputs as _forward_batch, including dropout masks
+    assert helpers.approx_equal(model._forward_outputs(input_matrix),
+                                model._forward_batch(input_matrix)[0])
+
+    # Outputs for each candidate weights
+    parameters_list = [mlp._flatten(model._weight_matrices) + 0.1 * i for i in range(3)]
+    weight_stacks = mlp._unflatten_weights(numpy.array(parameters_list), model._shape)
+    stacked_outputs = model._forward_outputs(input_matrix, weight_stacks)
+    assert stacked_outputs.shape == (3, 5, 2)
+    for parameters, outputs in zip(parameters_list, stacked_outputs):
+        model._weight_matrices = mlp._unflatten_weights(parameters, model._shape)
+        assert helpers.approx_equal(outputs, model._forward_batch(input_matrix)[0])
+
+
+def test_mlp_objs():
+    dataset = (numpy.random.random((5, 2)), numpy.random.random((5, 2)))
+    model = mlp.MLP((2, 4, 2))
+
+    parameters_list = [mlp._flatten(model._weight_matrices) + 0.1 * i for i in range(3)]
+    assert helpers.approx_equal(
+        mlp._mlp_objs(model, dataset[0], dataset[1], parameters_list),
+        [mlp._mlp_obj(model, dataset[0], dataset[1], parameters)
+         for parameters in parameters_list])
+
+
+def test_mlp_train_step_reuses_problem():
+    dataset = (numpy.random.random((10, 2)), numpy.random.random((10, 1)))
+    model = mlp.MLP((2, 3, 1))
+
+    model.train_step(*dataset)
+    problem = model._problem[2]
+    model.train_step(*dataset)
+    assert model._problem[2] is problem
+
+    # New problem for new dataset
+    model.train_step(dataset[0].copy(), dataset[1])
+    assert model._problem[2] is not problem
+
+
+def test_dropout_mlp_train_step_new_problem():
+    # Masks change problem every step
+    dataset = (numpy.random.random((10, 2)), numpy.random.random((10, 1)))
+    model = mlp.DropoutMLP((2, 3, 1))
+
+    model.train_step(*dataset)
+    problem = model._problem[2]
+    model.train_step(*dataset)
+    assert model._problem[2] is not problem
+
+
 def test_mean_list_of_list_of_matrices():
     lol_matrices = [
         [numpy.array([[1, 2], [3, 4]]), numpy.array([[-1, -2], [-3, -4]])],
@@ -174,6 +312,50 @@ def _check_jacobian(make_model_func):
     helpers.check_gradient(f, df, inputs=mlp._flatten(model._weight_matrices), f_shape='scalar')
 
 
+@pytest.mark.parametrize('transfer', [mlp.LinearTransfer(), mlp.TanhTransfer(), mlp.ReluTransfer(),
+                                      mlp.GaussianTransfer(), mlp.SoftmaxTransfer()])
+def test_get_jacobians_batch_equals_per_sample(transfer):
+    model = mlp.MLP((3, 4, 2), transfers=[transfer, mlp.SoftmaxTransfer()],
+                    error_func=CrossEntropy())
+    inp_matrix, tar_matrix = datasets.get_random_classification(10, 3, 2)
+
+    sample_jacobians = []
+    for input_vec, target_vec in zip(inp_matrix, tar_matrix):
+        _, error_jac = model._error_func.derivative(model.activate(input_vec), target_vec)
+        sample_jacobians.append(model._get_backprop_jacobians(error_jac))
+
+    _, jacobians = model._get_jacobians(inp_matrix, tar_matrix)
+    for jacobian, expected in zip(jacobians, mlp._mean_list_of_list_of_matrices(sample_jacobians)):
+        assert helpers.approx_equal(jacobian, expected)
+
+
+def test_backprop_batch_input_error():
+    model = mlp.MLP((3, 4, 2))
+    inp_matrix, tar_matrix = datasets.get_random_regression(10, 3, 2)
+
+    def f(xk):
+        return model._error_func(model.activate_batch(xk.reshape(inp_matrix.shape)), tar_matrix)
+    def df(xk):
+        output_matrix, activations = model._forward_batch(xk.reshape(inp_matrix.shape))
+        _, error_jac = model._error_func.derivative(output_matrix, tar_matrix)
+        return model._backprop_batch(activations, error_jac, input_error=True)[1].ravel()
+
+    helpers.check_gradient(f, df, inputs=inp_matrix.ravel(), f_shape='scalar')
+
+
+def test_split_trunk_head():
+    model = mlp.MLP((2, 3, 4, 2))
+    trunk, head = mlp._split_trunk_head(model)
+
+    assert trunk._shape == (2, 3, 4)
+    assert head._shape == (4, 2)
+
+    # Trunk followed by head should compute the same as model
+    input_vec = numpy.random.random(2)
+    assert helpers.approx_equal(head.activate(trunk.activate(input_vec)),
+                                model.activate(input_vec))
+
+
 ##############################
 # DropoutMLP
 ##############################
@@ -239,86 +421,150 @@ def test_dropout_mlp_classifier_convergence():
     assert validation.get_error(model, *dataset) <= 0.1
 
 
-def test_dropout_mlp_dropout():
+def test_dropout_mlp_masks():
     model = mlp.DropoutMLP((2, 4, 3), input_active_probability=0.5,
-                           hidden_active_probability=0.5)
+                           hidden_active_probability=0.25)
+    model._draw_masks(5)
 
-    # Only bias and active neurons should not be 0
-    model.train_step([[1, 1]], [[1, 1, 1]])
+    # A mask for inputs and hidden neurons, not outputs
+    assert len(model._masks) == 2
+    for mask, shape, active_probability in zip(model._masks, [(5, 2), (5, 4)], [0.5, 0.25]):
+        assert mask.shape == shape
+        assert mask.dtype == model._dtype
 
-    # Should still have DropoutTransfers (until activation outside of training)
+        # Active neurons are scaled, and at least one is active for each sample
+        assert set(numpy.unique(mask)) <= set([0.0, 1.0 / active_probability])
+        assert mask.any(axis=1).all()
 
-    _validate_weight_inputs(model._weight_inputs[0], model._input_transfer._active_neurons)
-    for weight_inputs, transfer_func in zip(model._weight_inputs[1:-1], model._transfers[:-1]):
-        _validate_weight_inputs(weight_inputs, transfer_func._active_neurons)
+    # Buffers are reused for the same number of samples
+    masks = list(model._masks)
+    model._draw_masks(5)
+    for mask, prev_mask in zip(model._masks, masks):
+        assert mask is prev_mask
 
 
-def test_dropout_mlp_post_training():
-    # Post training should happen on first activate after training (train step),
-    # and not more than once, unless training begins again
-    model = mlp.DropoutMLP((2, 4, 3), input_active_probability=0.5,
+def test_dropout_mlp_masks_probability_one():
+    model = mlp.DropoutMLP((2, 4, 3), input_active_probability=1.0,
                            hidden_active_probability=0.5)
+    model._draw_masks(5)
+    assert model._masks[0] is None
+    assert model._masks[1].shape == (5, 4)
 
-    # Train, modifying active neurons and weights
-    model.train_step([[1, 1]], [[1, 1, 1]])
-    pre_procedure_weights = copy.deepcopy(model._weight_matrices)
 
-    # Should call post_training procedure after activate
-    model.activate([1, 1])
-    _validate_post_training(model, pre_procedure_weights)
+@pytest.mark.parametrize('active_probability', [0.0, 1.5])
+def test_dropout_mlp_invalid_probability(active_probability):
+    with pytest.raises(ValueError):
+        mlp.DropoutMLP((2, 4, 3), hidden_active_probability=active_probability)
 
-    # Weights should not change after another activate
-    model.activate([1, 1])
-    _validate_post_training(model, pre_procedure_weights)
 
+def test_dropout_mlp_jacobian():
+    model = mlp.DropoutMLP((3, 6, 2), input_active_probability=0.5,
+                           hidden_active_probability=0.5)
+    inp_matrix, tar_matrix = datasets.get_random_regression(10, 3, 2)
+    model._draw_masks(len(inp_matrix))
 
-def _validate_post_training(model, pre_procedure_weights):
-    for weight_matrix, orig_matrix in zip(model._weight_matrices, pre_procedure_weights):
-        # Weights should be scaled by active probability
-        assert (weight_matrix == orig_matrix*model._hid_act_prob).all()
+    # Objective and jacobian use the same masks
+    f = lambda xk: mlp._mlp_obj(model, inp_matrix, tar_matrix, xk)
+    df = lambda xk: mlp._mlp_obj_jac(model, inp_matrix, tar_matrix, xk)[1]
+    helpers.check_gradient(f, df, inputs=mlp._flatten(model._weight_matrices), f_shape='scalar')
 
-    # All inputs and neurons should be active
-    assert not isinstance(model._input_transfer, mlp.DropoutTransfer)
-    for transfer_func in model._transfers:
-        assert not isinstance(transfer_func, mlp.DropoutTransfer)
 
-    for weight_inputs in model._weight_inputs:
-        _validate_weight_inputs(weight_inputs, [1.0]*(len(weight_inputs)-1))
+def test_dropout_mlp_train_clears_masks():
+    model = mlp.DropoutMLP((2, 4, 3), input_active_probability=0.5,
+                           hidden_active_probability=0.5)
+    model.logging = False
+    model.train([[1, 1], [0, 1]], [[1, 1, 1], [0, 1, 0]], iterations=2)
+    assert model._masks is None
 
+    # Masks of train_step are never pickled
+    model.train_step([[1, 1], [0, 1]], [[1, 1, 1], [0, 1, 0]])
+    assert model._masks is not None
+    assert '_masks' not in model.__getstate__()
 
-def _validate_weight_inputs(weight_inputs, active_neurons):
-    assert len(weight_inputs)-1 == len(active_neurons) # -1 for bias
 
-    assert weight_inputs[0] == 1.0 # Bias
-    for i, active in enumerate(active_neurons):
-        # i+1 to offset from bias
-        if active == 0.0:
-            assert weight_inputs[i+1] == 0.0
-        elif active == 1.0:
-            assert weight_inputs[i+1] != 0.0
-        else:
-            assert 0, 'Invalid active neuron value'
+def test_dropout_mlp_activate_after_training():
+    model = mlp.DropoutMLP((2, 4, 3), input_active_probability=0.5,
+                           hidden_active_probability=0.5)
+    model.train_step([[1, 1], [0, 1]], [[1, 1, 1], [0, 1, 0]])
+    weight_matrices = copy.deepcopy(model._weight_matrices)
+
+    # Nothing is masked, and weights are not rescaled
+    plain_model = mlp.MLP((2, 4, 3))
+    plain_model._weight_matrices = weight_matrices
+    input_matrix = numpy.random.random((3, 2))
+    assert helpers.approx_equal(model.activate_batch(input_matrix),
+                                plain_model.activate_batch(input_matrix))
+    assert helpers.approx_equal(model.activate(input_matrix[0]),
+                                plain_model.activate(input_matrix[0]))
+    for weight_matrix, orig_matrix in zip(model._weight_matrices, weight_matrices):
+        assert (weight_matrix == orig_matrix).all()
 
 ####################
-# DropoutTransfer
+# Active neurons
 ####################
-def test_dropout_transfer_probability_one():
-    length = random.randint(1, 20)
+def test_get_active_neurons_each_sample():
+    # Can't actually be zero, but can be close enough
+    active_neurons = mlp._get_active_neurons(1e-16, (10, 4))
 
-    dropout_transfer = mlp.DropoutTransfer(mlp.LinearTransfer(), 1.0, length)
-    assert (dropout_transfer._active_neurons == numpy.array([1.0]*length)).all(), 'All should be active'
+    # Exactly one active for each sample
+    assert active_neurons.shape == (10, 4)
+    assert (active_neurons.sum(axis=1) == 1.0).all()
 
-    # Random input
-    input_vec = numpy.random.random(length)
-    assert (dropout_transfer(input_vec) == input_vec).all()
 
+def test_get_active_neurons_out():
+    out = numpy.empty((3, 4), dtype='float32')
+    assert mlp._get_active_neurons(0.5, out.shape, out=out) is out
+    assert set(numpy.unique(out)) <= set([0.0, 1.0])
 
-def test_dropout_transfer_probability_zero():
-    length = random.randint(1, 20)
 
-    # Can't actually be zero, but can be close enough
-    dropout_transfer = mlp.DropoutTransfer(mlp.LinearTransfer(), 1e-16, length)
+############################
+# Transfers
+############################
+@pytest.mark.parametrize('transfer', [mlp.LinearTransfer(), mlp.TanhTransfer(), mlp.ReluTransfer(),
+                                      mlp.GaussianTransfer(), mlp.SoftmaxTransfer()])
+def test_transfer_cache_backprop(transfer):
+    input_vec = numpy.random.uniform(-2.0, 2.0, 4)
+    error_vec = numpy.random.random(4)
+
+    cache = {}
+    output_vec = transfer(input_vec, cache=cache)
+    assert helpers.approx_equal(output_vec, transfer(input_vec))
+    assert helpers.approx_equal(
+        transfer.backprop(input_vec, output_vec, error_vec, cache),
+        mlp._dot_diag_or_matrix(error_vec, transfer.derivative(input_vec, output_vec)))
+
+
+def test_relu_transfer_cache_derivative():
+    transfer = mlp.ReluTransfer()
+    input_vec = numpy.array([-1000.0, -1.5, 0.0, 1.0, 1000.0])
+
+    cache = {}
+    output_vec = numpy.empty_like(input_vec)
+    transfer(input_vec, out=output_vec, cache=cache)
+    assert helpers.approx_equal(transfer.derivative(input_vec, output_vec, cache),
+                                calculate.drelu(input_vec))
+
+    # Buffers are reused
+    derivative = cache['derivative']
+    transfer(input_vec, out=output_vec, cache=cache)
+    assert cache['derivative'] is derivative
+
+
+def test_linear_transfer_backprop_is_identity():
+    error_vec = numpy.random.random(3)
+    assert mlp.LinearTransfer().backprop(None, None, error_vec) is error_vec
+
+
+@pytest.mark.parametrize('optimizer', [None, mlp.SteepestDescent()])
+def test_mlp_float32(optimizer):
+    model = mlp.MLP((2, 3, 2), optimizer=optimizer, dtype='float32')
+    input_matrix, target_matrix = datasets.get_xor()
 
-    # Should not allow zero active, defaults to 1
-    assert list(dropout_transfer._active_neurons).count(1.0) == 1
-    assert list(dropout_transfer._active_neurons).count(0.0) == length-1
+    # Weights, activations, and jacobians stay float32, even with float64 dataset
+    model.train(input_matrix, target_matrix, iterations=5)
+    for weight_matrix in model._weight_matrices:
+        assert weight_matrix.dtype == numpy.float32
+    assert model.activate(input_matrix[0]).dtype == numpy.float32
+    assert model.activate_batch(input_matrix).dtype == numpy.float32
+    assert (model._get_jacobians(input_matrix.astype('float32'), target_matrix.astype('float32'))[1][0].dtype
+            == numpy.float32)
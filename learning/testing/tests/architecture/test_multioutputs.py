@@ -2,7 +2,8 @@ import numpy
 import pytest
 
 from learning import Model, MLP, validation
-from learning.architecture import multioutputs
+from learning.data import datasets
+from learning.architecture import multioutputs, mlp
 
 from learning.testing import helpers
 
@@ -55,6 +56,133 @@ def test_nested_multioutputs_train():
     assert model.activate([]) == [[1, 2], [3, 4]]
 
 
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_multioutputs_train_executor(executor):
+    model = multioutputs.MultiOutputs(LearnOutput(1.0), 3, executor=executor)
+    model.logging = False
+    model.train([None], numpy.array([[-1, 1, 2]]))
+
+    assert model.activate([]) == [-1, 1, 2]
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_multioutputs_train_step_executor(executor):
+    model = multioutputs.MultiOutputs(helpers.SetOutputModel(1.0), 2, executor=executor)
+
+    # First train_step updates all outputs
+    assert model.train_step([[None]], numpy.array([[1.0, 0.0]])) == 0.5
+    assert model._errors == [0.0, 1.0]
+    model.close()
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_multioutputs_train_closes_pool(executor):
+    model = multioutputs.MultiOutputs(LearnOutput(1.0), 3, executor=executor)
+    model.logging = False
+    model.train([None], numpy.array([[-1, 1, 2]]))
+    assert model._pool is None
+
+
+def test_multioutputs_train_shared_trunk_closes_pool():
+    model = multioutputs.MultiOutputs(mlp.MLP((2, 3, 1)), 2, executor='thread',
+                                      shared_trunk=True)
+    model.logging = False
+    model.train(*datasets.get_xor(), iterations=2)
+    assert model._pool is None
+
+
+def test_multioutputs_close():
+    model = multioutputs.MultiOutputs(helpers.SetOutputModel(1.0), 2, executor='thread')
+    model.train_step([[None]], numpy.array([[1.0, 0.0]]))
+    assert model._pool is not None
+
+    model.close()
+    assert model._pool is None
+
+    # Pool is started again when needed
+    model.train_step([[None]], numpy.array([[1.0, 0.0]]))
+    model.close()
+
+
+def test_multioutputs_invalid_executor():
+    with pytest.raises(ValueError):
+        multioutputs.MultiOutputs(LearnOutput(1.0), 2, executor='invalid')
+
+
+@pytest.mark.parametrize('executor', [None, 'thread'])
+def test_multioutputs_activate_batch(executor):
+    model = multioutputs.MultiOutputs(
+        [helpers.SetOutputModel([1.0, 2.0]), helpers.SetOutputModel([3.0, 4.0])],
+        executor=executor)
+
+    outputs = model.activate_batch(numpy.zeros((3, 1)))
+    assert isinstance(outputs, numpy.ndarray)
+    assert outputs.shape == (3, 2, 2)
+    assert (outputs == numpy.array([[1.0, 2.0], [3.0, 4.0]])).all()
+
+
+####################
+# Shared trunk
+####################
+def test_multioutputs_shared_trunk_activate():
+    base_model = MLP((3, 4, 2))
+    model = multioutputs.MultiOutputs(base_model, 3, shared_trunk=True)
+
+    # Each head starts as a copy of the output layer of base_model
+    input_vec = numpy.random.random(3)
+    expected = base_model.activate(input_vec)
+    for output in model.activate(input_vec):
+        assert helpers.approx_equal(output, expected)
+
+    assert helpers.approx_equal(
+        model.activate_batch(input_vec[None, :])[0], model.activate(input_vec))
+
+
+def test_multioutputs_shared_trunk_requires_mlp():
+    with pytest.raises(ValueError):
+        multioutputs.MultiOutputs(LearnOutput(1.0), 2, shared_trunk=True)
+
+
+def test_multioutputs_shared_trunk_train():
+    dataset = (numpy.random.random((10, 3)), numpy.random.random((10, 2, 2)))
+    model = multioutputs.MultiOutputs(MLP((3, 4, 2)), 2, shared_trunk=True)
+    model.logging = False
+
+    error = validation.get_error(model, *dataset)
+    model.train(*dataset, iterations=10)
+    assert validation.get_error(model, *dataset) < error
+
+
+def test_multioutputs_shared_trunk_jacobian():
+    dataset = (numpy.random.random((10, 3)), numpy.random.random((10, 2, 2)))
+    model = multioutputs.MultiOutputs(MLP((3, 4, 2)), 2, shared_trunk=True)
+
+    head_targets = list(multioutputs._transpose_rowcol(dataset[1]))
+
+    f = lambda xk: mlp._trunk_obj(model._trunk, model._models, dataset[0], head_targets, xk)
+    df = lambda xk: mlp._trunk_obj_jac(model._trunk, model._models, dataset[0], head_targets, xk)[1]
+    helpers.check_gradient(f, df, inputs=mlp._flatten(model._trunk._weight_matrices), f_shape='scalar')
+
+
+def test_multioutputs_shared_trunk_obj():
+    dataset = (numpy.random.random((10, 3)), numpy.random.random((10, 2, 2)))
+    model = multioutputs.MultiOutputs(MLP((3, 4, 2)), 2, shared_trunk=True)
+    head_targets = list(multioutputs._transpose_rowcol(dataset[1]))
+
+    # Mean error of heads, matching objective of jacobian
+    expected = numpy.mean([
+        numpy.mean([head._error_func(head.activate(model._trunk.activate(input_vec)), target)
+                    for head, target in zip(model._models, target_vec)])
+        for input_vec, target_vec in zip(*dataset)])
+    parameters = mlp._flatten(model._trunk._weight_matrices)
+    assert helpers.approx_equal(
+        mlp._trunk_obj(model._trunk, model._models, dataset[0], head_targets, parameters),
+        expected)
+    assert helpers.approx_equal(
+        mlp._trunk_obj_jac(model._trunk, model._models, dataset[0], head_targets, parameters)[0],
+        expected)
+
+
 def test_get_reward():
     assert multioutputs._get_reward(1.0, 0.0) == 1.0
     assert multioutputs._get_reward(1.0, 0.5) == 0.6
@@ -1,6 +1,10 @@
+import numpy
+
 from learning import PBNN, validation
 from learning.data import datasets
 
+from learning.testing import helpers
+
 
 def test_pbnn_convergence():
     # Run until convergence
@@ -10,3 +14,14 @@ def test_pbnn_convergence():
 
     model.train(*dataset)
     assert validation.get_error(model, *dataset) <= 0.02
+
+
+def test_pbnn_class_index_targets():
+    input_matrix, target_matrix = datasets.get_xor()
+    model = PBNN()
+    model.train(input_matrix, target_matrix)
+    index_model = PBNN()
+    index_model.train(input_matrix, numpy.argmax(target_matrix, axis=1))
+
+    for input_vec in input_matrix:
+        assert helpers.approx_equal(index_model.activate(input_vec), model.activate(input_vec))
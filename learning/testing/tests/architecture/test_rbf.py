@@ -1,8 +1,9 @@
 import random
 
 import pytest
+import numpy
 
-from learning import validation
+from learning import base, validation
 from learning.architecture import rbf
 from learning.data import datasets
 
@@ -33,6 +34,30 @@ def test_rbf_convergence():
     assert validation.get_error(model, *dataset) <= 0.02
 
 
+@pytest.mark.parametrize('scale_by_similarity', [True, False])
+def test_rbf_activate_batch(scale_by_similarity):
+    model = rbf.RBF(3, 4, 2, scale_by_similarity=scale_by_similarity)
+    input_matrix = numpy.random.random((5, 3))
+
+    expected = []
+    for input_vec in input_matrix:
+        similarities = numpy.exp(-numpy.sum((input_vec - model._som._weights)**2, axis=1)
+                                 / model._variance)
+        output_vec = similarities.dot(model._weight_matrix)
+        if scale_by_similarity:
+            output_vec /= numpy.sum(similarities)
+        expected.append(output_vec)
+
+    assert helpers.approx_equal(model.activate_batch(input_matrix), expected)
+    assert helpers.approx_equal(model.activate(input_matrix[0]), expected[0])
+
+    # Outputs are stored in workspace
+    workspace = base.Workspace()
+    outputs = model.activate_batch(input_matrix, workspace)
+    assert helpers.approx_equal(outputs, expected)
+    assert model.activate_batch(input_matrix, workspace) is outputs
+
+
 def test_rbf_obj_and_obj_jac_match():
     """obj and obj_jac functions should return the same obj value."""
     attrs = random.randint(1, 10)
@@ -68,3 +93,13 @@ def _check_jacobian(make_model_func):
     df = lambda xk: model._get_obj_jac(xk, inp_matrix, tar_matrix)[1]
 
     helpers.check_gradient(f, df, inputs=model._weight_matrix.ravel(), f_shape='scalar')
+
+
+def test_rbf_float32():
+    model = rbf.RBF(2, 4, 2, dtype='float32')
+    dataset = datasets.get_xor()
+
+    model.train(*dataset, iterations=5)
+    assert model._weight_matrix.dtype == numpy.float32
+    assert model._som._weights.dtype == numpy.float32
+    assert model.activate(dataset[0][0]).dtype == numpy.float32
@@ -1,6 +1,10 @@
+import numpy
+
 from learning.architecture import som
 from learning.data import datasets
 
+from learning.testing import helpers
+
 def test_som_reduces_distances():
     # SOM functions correctly if is moves neurons towards inputs
     input_matrix, target_matrix = datasets.get_xor()
@@ -26,3 +30,14 @@ def test_som_reduces_distances():
     print new_closest
     for old_c, new_c in zip(all_closest, new_closest):
         assert new_c < old_c
+
+
+def test_som_activate_batch():
+    som_ = som.SOM(3, 4)
+    input_matrix = numpy.random.random((5, 3))
+
+    # Including an input on a neuron, with distance 0
+    input_matrix[0] = som_._weights[1]
+
+    assert helpers.approx_equal(som_.activate_batch(input_matrix),
+                                [som_.activate(input_vec) for input_vec in input_matrix])
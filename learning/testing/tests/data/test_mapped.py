@@ -0,0 +1,144 @@
+import struct
+
+import pytest
+import numpy
+
+from learning.data import mapped, stream
+
+
+def _random_dataset(num_rows=10):
+    return numpy.random.random((num_rows, 3)), numpy.random.random((num_rows, 2))
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_save_load(tmpdir, dtype):
+    input_matrix, target_matrix = _random_dataset()
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, input_matrix, target_matrix, dtype=dtype)
+
+    loaded_inputs, loaded_targets = mapped.load(file_name)
+    assert isinstance(loaded_inputs, numpy.memmap)
+    assert isinstance(loaded_targets, numpy.memmap)
+    assert loaded_inputs.dtype == numpy.dtype(dtype)
+    assert (loaded_inputs == input_matrix.astype(dtype)).all()
+    assert (loaded_targets == target_matrix.astype(dtype)).all()
+
+
+def test_save_chunked_dataset(tmpdir):
+    input_matrix, target_matrix = _random_dataset(11)
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, stream.ArrayDataset(input_matrix, target_matrix, chunk_size=3))
+
+    loaded_inputs, loaded_targets = mapped.load(file_name)
+    assert (loaded_inputs == input_matrix).all()
+    assert (loaded_targets == target_matrix).all()
+
+
+def test_save_load_class_indices(tmpdir):
+    input_matrix = numpy.random.random((10, 3))
+    target_vec = numpy.random.randint(0, 4, 10)
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, input_matrix, target_vec, dtype='float32')
+
+    # Class indices stay integers
+    loaded_inputs, loaded_targets = mapped.load(file_name)
+    assert loaded_inputs.dtype == numpy.float32
+    assert loaded_targets.dtype.kind == 'i'
+    assert (loaded_targets == target_vec).all()
+
+
+@pytest.mark.parametrize('shapes', [((0, 3), (0, 2)), ((5, 0), (5, 2))])
+def test_save_load_empty(tmpdir, shapes):
+    input_matrix, target_matrix = numpy.zeros(shapes[0]), numpy.ones(shapes[1])
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, input_matrix, target_matrix)
+
+    loaded_inputs, loaded_targets = mapped.load(file_name)
+    assert loaded_inputs.shape == input_matrix.shape
+    assert loaded_targets.shape == target_matrix.shape
+    assert (loaded_targets == target_matrix).all()
+
+
+def test_save_empty_chunked_dataset(tmpdir):
+    file_name = tmpdir.join('dataset.lrd')
+    with pytest.raises(ValueError):
+        mapped.save(str(file_name), stream.ArrayDataset(numpy.zeros((0, 3)), numpy.zeros((0, 2))))
+    assert not file_name.check()
+
+
+def test_load_read_only(tmpdir):
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, *_random_dataset())
+
+    input_matrix, _ = mapped.load(file_name)
+    with pytest.raises(ValueError):
+        input_matrix[0, 0] = 1.0
+
+
+def test_header_aligned(tmpdir):
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, *_random_dataset())
+
+    header = mapped.read_header(file_name)
+    assert header['num_rows'] == 10
+    assert header['inputs']['offset'] % mapped.ALIGNMENT == 0
+    assert header['targets']['offset'] % mapped.ALIGNMENT == 0
+
+
+def test_save_invalid_dtype(tmpdir):
+    with pytest.raises(ValueError):
+        mapped.save(str(tmpdir.join('dataset.lrd')), *_random_dataset(), dtype='int32')
+
+
+def test_load_not_dataset_file(tmpdir):
+    file_name = tmpdir.join('dataset.lrd')
+    file_name.write('not a dataset')
+    with pytest.raises(ValueError):
+        mapped.load(str(file_name))
+
+
+def test_load_unsupported_version(tmpdir):
+    file_name = str(tmpdir.join('dataset.lrd'))
+    mapped.save(file_name, *_random_dataset())
+    with open(file_name, 'r+b') as file_:
+        file_.seek(len(mapped.MAGIC))
+        file_.write(struct.pack('<I', mapped.FORMAT_VERSION+1))
+
+    with pytest.raises(ValueError):
+        mapped.load(file_name)
+
+
+############################
+# Indices
+############################
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_fold_indices(shuffle):
+    folds = mapped.fold_indices(10, 3, shuffle=shuffle)
+    assert len(folds) == 3
+    assert [len(testing) for _, testing in folds] == [3, 3, 4]
+
+    # Each row is tested exactly once, and never trained on in the same fold
+    assert sorted(numpy.concatenate([testing for _, testing in folds])) == range(10)
+    for training, testing in folds:
+        assert sorted(numpy.concatenate([training, testing])) == range(10)
+
+
+def test_iter_batches_views():
+    input_matrix, target_matrix = _random_dataset()
+    batches = list(mapped.iter_batches(input_matrix, target_matrix, 4))
+
+    assert [len(batch[0]) for batch in batches] == [4, 4, 2]
+    for batch_inputs, _ in batches:
+        assert numpy.may_share_memory(batch_inputs, input_matrix)
+
+
+def test_iter_batches_indices():
+    input_matrix, target_matrix = _random_dataset()
+    indices = mapped.shuffled_indices(10)
+    batches = list(mapped.iter_batches(input_matrix, target_matrix, 4, indices))
+
+    assert [len(batch[0]) for batch in batches] == [4, 4, 2]
+    for i, (batch_inputs, batch_targets) in enumerate(batches):
+        batch_indices = numpy.sort(indices[i*4:(i+1)*4])
+        assert (batch_inputs == input_matrix[batch_indices]).all()
+        assert (batch_targets == target_matrix[batch_indices]).all()
@@ -0,0 +1,219 @@
+import os
+
+import pytest
+import numpy
+
+from learning import fileformat
+from learning.data import process
+
+from learning.testing import helpers
+
+_DATA = '1.0,2.0,a\n2.0,4.0,b\n3.0,0.0,a\n'
+
+
+def _write_data(tmpdir, data=_DATA):
+    file_name = tmpdir.join('test.data')
+    file_name.write(data)
+    return str(file_name)
+
+
+def test_get_data(tmpdir):
+    file_name = _write_data(tmpdir)
+    input_matrix, target_matrix = process.get_data(file_name, 0, cache=False)
+
+    assert (input_matrix == numpy.array([[-1.0, 0.0], [0.0, 1.0], [1.0, -1.0]])).all()
+    assert (target_matrix == numpy.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]])).all()
+
+
+def test_get_data_class_indices(tmpdir):
+    file_name = _write_data(tmpdir)
+    _, target_matrix = process.get_data(file_name, 0, onehot=False, cache=False)
+
+    assert (target_matrix == numpy.array([0, 1, 0])).all()
+
+
+############################
+# Cache
+############################
+def test_get_data_cache(tmpdir, monkeypatch):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    dataset = process.get_data(file_name, 0, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Should not parse again
+    def fail_parse(*args):
+        assert 0, 'Should load from cache'
+    monkeypatch.setattr(process, '_parse_data', fail_parse)
+
+    cached_dataset = process.get_data(file_name, 0, cache_dir=cache_dir)
+    for matrix, cached_matrix in zip(dataset, cached_dataset):
+        assert isinstance(cached_matrix, numpy.memmap)
+        assert (matrix == cached_matrix).all()
+
+
+def test_get_data_cache_first_call_memmap(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    for matrix in process.get_data(file_name, 0, cache_dir=cache_dir):
+        assert isinstance(matrix, numpy.memmap)
+
+
+def test_get_data_cache_permissions(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    process.get_data(file_name, 0, cache_dir=str(cache_dir))
+
+    # Same permissions as files made by open
+    for path in cache_dir.listdir():
+        assert path.stat().mode & 0o777 == 0o666 & ~fileformat._UMASK
+
+
+def test_get_data_cache_removes_stale(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    process.get_data(file_name, 0, cache_dir=str(cache_dir))
+    process.get_data(file_name, 0, onehot=False, cache_dir=str(cache_dir))
+    assert len(cache_dir.listdir()) == 4
+
+    # Arrays of previous version are removed, for all parse arguments
+    _write_data(tmpdir, _DATA + '4.0,1.0,b\n')
+    input_matrix, _ = process.get_data(file_name, 0, cache_dir=str(cache_dir))
+    assert input_matrix.shape == (4, 2)
+    assert len(cache_dir.listdir()) == 2
+
+    # Other files are kept
+    other_file_name = str(tmpdir.mkdir('other').join('test.data'))
+    with open(other_file_name, 'w') as file_:
+        file_.write(_DATA)
+    process.get_data(other_file_name, 0, cache_dir=str(cache_dir))
+    assert len(cache_dir.listdir()) == 4
+
+
+def test_clear_cache(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = tmpdir.join('cache')
+    process.get_data(file_name, 0, cache_dir=str(cache_dir))
+    cache_dir.join('other.txt').write('')
+
+    process.clear_cache(str(cache_dir))
+    assert [path.basename for path in cache_dir.listdir()] == ['other.txt']
+
+    # Missing cache dir is ignored
+    process.clear_cache(str(tmpdir.join('missing')))
+
+
+def test_get_data_cache_copy_on_write(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    process.get_data(file_name, 0, cache_dir=cache_dir)
+
+    input_matrix, _ = process.get_data(file_name, 0, cache_dir=cache_dir)
+    input_matrix[0, 0] = 100.0
+
+    # Cache file is unchanged
+    input_matrix, _ = process.get_data(file_name, 0, cache_dir=cache_dir)
+    assert input_matrix[0, 0] == -1.0
+
+
+def test_get_data_cache_file_changed(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    process.get_data(file_name, 0, cache_dir=cache_dir)
+
+    _write_data(tmpdir, _DATA + '4.0,1.0,c\n')
+    input_matrix, target_matrix = process.get_data(file_name, 0, cache_dir=cache_dir)
+    assert input_matrix.shape == (4, 2)
+    assert target_matrix.shape == (4, 3)
+
+
+def test_get_data_cache_parse_args_changed(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    process.get_data(file_name, 0, cache_dir=cache_dir)
+
+    input_matrix, _ = process.get_data(file_name, 1, cache_dir=cache_dir)
+    assert input_matrix.shape == (3, 1)
+
+
+def test_get_data_cache_dir_env(tmpdir, monkeypatch):
+    file_name = _write_data(tmpdir)
+    cache_dir = tmpdir.join('env_cache')
+    monkeypatch.setenv(process.CACHE_DIR_ENV, str(cache_dir))
+
+    process.get_data(file_name, 0)
+    assert len(cache_dir.listdir()) == 2
+
+
+def test_get_data_cache_unwritable(tmpdir):
+    file_name = _write_data(tmpdir)
+    # Cache dir cannot be made inside a file
+    cache_dir = str(tmpdir.join('test.data', 'cache'))
+
+    input_matrix, _ = process.get_data(file_name, 0, cache_dir=cache_dir)
+    assert input_matrix.shape == (3, 2)
+
+
+############################
+# Parsing
+############################
+def test_get_data_space_delimited(tmpdir):
+    file_name = _write_data(tmpdir, ' 1  1.0 2.0  a\n2 2.0  4.0 b \n3 3.0 0.0 a\n')
+    input_matrix, target_matrix = process.get_data(file_name, 1, cache=False)
+
+    assert (input_matrix == numpy.array([[-1.0, 0.0], [0.0, 1.0], [1.0, -1.0]])).all()
+    assert (target_matrix == numpy.array([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]])).all()
+
+
+def test_get_data_regression(tmpdir):
+    file_name = _write_data(tmpdir, '1.0,2.0,0.0\n2.0,4.0,5.0\n3.0,0.0,10.0\n')
+    _, target_matrix = process.get_data(file_name, 0, classification=False, cache=False)
+
+    assert (target_matrix == numpy.array([[-1.0], [0.0], [1.0]])).all()
+
+
+def test_get_data_malformed_rows(tmpdir, caplog):
+    file_name = _write_data(tmpdir, '1.0,2.0,a\n?,3.0,c\n2.0,4.0,b\n\n3.0,0.0,a\n')
+    input_matrix, target_matrix = process.get_data(file_name, 0, cache=False)
+
+    # Malformed rows are skipped, and do not add classes
+    assert input_matrix.shape == (3, 2)
+    assert target_matrix.shape == (3, 2)
+
+    # Blank lines are not reported
+    assert 'Skipped 1 malformed rows' in caplog.text
+    assert 'lines: 2' in caplog.text
+
+
+def test_get_data_many_blocks(tmpdir, monkeypatch):
+    data = ''.join('%d,%d,%s\n' % (i, i % 7, 'abc'[i % 3]) for i in range(100))
+    data += '?,1,a\n'
+    file_name = _write_data(tmpdir, data)
+    expected = process.get_data(file_name, 0, cache=False)
+
+    # Lines are split across blocks
+    monkeypatch.setattr(process, '_BLOCK_SIZE', 17)
+    input_matrix, target_matrix = process.get_data(file_name, 0, cache=False)
+
+    assert (input_matrix == expected[0]).all()
+    assert (target_matrix == expected[1]).all()
+    assert input_matrix.shape == (100, 2)
+    assert target_matrix.shape == (100, 3)
+
+
+def test_get_data_no_valid_rows(tmpdir):
+    file_name = _write_data(tmpdir, '?,?,a\n')
+    with pytest.raises(ValueError):
+        process.get_data(file_name, 0, cache=False)
+
+
+def test_get_data_dtype(tmpdir):
+    file_name = _write_data(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    expected = process.get_data(file_name, 0, cache_dir=cache_dir)
+
+    # Cached separately for each dtype
+    dataset = process.get_data(file_name, 0, cache_dir=cache_dir, dtype='float32')
+    for matrix, expected_matrix in zip(dataset, expected):
+        assert matrix.dtype == numpy.float32
+        assert helpers.approx_equal(matrix, expected_matrix, tol=1e-6)
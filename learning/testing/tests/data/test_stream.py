@@ -0,0 +1,212 @@
+import pytest
+import numpy
+
+from learning import preprocess, MLP
+from learning.data import stream, process, datasets
+from learning.optimize import SteepestDescent
+
+from learning.testing import helpers
+
+_DATA = ''.join('%d,%d,%s\n' % (i, (i*7) % 11, 'cab'[i % 3]) for i in range(25))
+
+
+def _write_data(tmpdir, data=_DATA):
+    file_name = tmpdir.join('test.data')
+    file_name.write(data)
+    return str(file_name)
+
+
+def _concatenate_chunks(dataset):
+    chunks = list(dataset.iter_chunks())
+    return (numpy.concatenate([chunk[0] for chunk in chunks]),
+            numpy.concatenate([chunk[1] for chunk in chunks]))
+
+
+############################
+# ArrayDataset
+############################
+def test_array_dataset_chunks():
+    input_matrix = numpy.random.random((10, 3))
+    target_matrix = numpy.random.random((10, 2))
+    dataset = stream.ArrayDataset(input_matrix, target_matrix, chunk_size=4)
+
+    chunks = list(dataset.iter_chunks())
+    assert [len(chunk[0]) for chunk in chunks] == [4, 4, 2]
+    assert len(dataset) == 10
+
+    # Chunks are views
+    for chunk_inputs, chunk_targets in chunks:
+        assert numpy.may_share_memory(chunk_inputs, input_matrix)
+        assert numpy.may_share_memory(chunk_targets, target_matrix)
+
+    assert (_concatenate_chunks(dataset)[0] == input_matrix).all()
+    assert (_concatenate_chunks(dataset)[1] == target_matrix).all()
+
+
+@pytest.mark.parametrize('scale, scale_func', [('rescale', preprocess.rescale),
+                                               ('normalize', preprocess.normalize)])
+def test_array_dataset_scale(scale, scale_func):
+    input_matrix = numpy.random.random((10, 3))
+    target_matrix = numpy.random.random((10, 2))
+    dataset = stream.ArrayDataset(input_matrix, target_matrix, chunk_size=3,
+                                  scale=scale, scale_targets=True)
+
+    scaled_inputs, scaled_targets = _concatenate_chunks(dataset)
+    assert helpers.approx_equal(scaled_inputs, scale_func(input_matrix))
+    assert helpers.approx_equal(scaled_targets, scale_func(target_matrix))
+
+
+def test_array_dataset_invalid_scale():
+    with pytest.raises(ValueError):
+        stream.ArrayDataset(numpy.zeros((2, 2)), numpy.zeros((2, 1)), scale='invalid')
+
+
+############################
+# FileDataset
+############################
+def test_file_dataset_matches_get_data(tmpdir):
+    file_name = _write_data(tmpdir)
+    dataset = stream.FileDataset(file_name, 0, chunk_size=4, scale='rescale')
+
+    expected = process.get_data(file_name, 0, cache=False)
+    input_matrix, target_matrix = _concatenate_chunks(dataset)
+    assert helpers.approx_equal(input_matrix, expected[0])
+    assert (target_matrix == expected[1]).all()
+    assert list(dataset.get_classes()) == ['a', 'b', 'c']
+
+
+def test_file_dataset_regression_matches_get_data(tmpdir):
+    file_name = _write_data(tmpdir, _DATA.replace('a', '1').replace('b', '2').replace('c', '3'))
+    dataset = stream.FileDataset(file_name, 0, classification=False, chunk_size=7,
+                                 scale='rescale', scale_targets=True)
+
+    expected = process.get_data(file_name, 0, classification=False, cache=False)
+    input_matrix, target_matrix = _concatenate_chunks(dataset)
+    assert helpers.approx_equal(input_matrix, expected[0])
+    assert helpers.approx_equal(target_matrix, expected[1])
+
+
+def test_file_dataset_many_blocks(tmpdir, monkeypatch):
+    file_name = _write_data(tmpdir)
+    monkeypatch.setattr(process, '_BLOCK_SIZE', 13)
+
+    dataset = stream.FileDataset(file_name, 0, chunk_size=4)
+    chunks = list(dataset.iter_chunks())
+    assert [len(chunk[0]) for chunk in chunks] == [4]*6 + [1]
+    assert len(dataset) == 25
+
+
+def test_file_dataset_given_classes(tmpdir):
+    file_name = _write_data(tmpdir)
+    dataset = stream.FileDataset(file_name, 0, classes=['c', 'a', 'b'])
+
+    _, target_matrix = _concatenate_chunks(dataset)
+    assert (target_matrix[:3] == numpy.identity(3)).all()
+
+
+def test_file_dataset_class_indices(tmpdir):
+    file_name = _write_data(tmpdir)
+    dataset = stream.FileDataset(file_name, 0, onehot=False, chunk_size=4)
+    expected_targets = numpy.argmax(_concatenate_chunks(stream.FileDataset(file_name, 0))[1],
+                                    axis=1)
+
+    chunks = list(dataset.iter_chunks())
+    assert all(chunk[1].ndim == 1 for chunk in chunks)
+    assert (numpy.concatenate([chunk[1] for chunk in chunks]) == expected_targets).all()
+
+
+def test_file_dataset_unknown_class(tmpdir):
+    file_name = _write_data(tmpdir)
+    dataset = stream.FileDataset(file_name, 0, classes=['a', 'b'])
+
+    with pytest.raises(ValueError):
+        list(dataset.iter_chunks())
+
+
+def test_file_dataset_scale_classification_targets(tmpdir):
+    with pytest.raises(ValueError):
+        stream.FileDataset(_write_data(tmpdir), 0, scale='rescale', scale_targets=True)
+
+
+############################
+# Helpers
+############################
+def test_column_stats():
+    matrix = numpy.random.random((20, 3))
+    stats = stream.ColumnStats()
+    for start in range(0, 20, 6):
+        stats.update(matrix[start:start+6])
+
+    assert stats.count == 20
+    assert (stats.min == numpy.min(matrix, axis=0)).all()
+    assert (stats.max == numpy.max(matrix, axis=0)).all()
+    assert helpers.approx_equal(stats.mean, numpy.mean(matrix, axis=0))
+    assert helpers.approx_equal(stats.std, numpy.std(matrix, axis=0))
+
+
+@pytest.mark.parametrize('block_sizes', [[10], [3, 3, 4], [1]*10, [7, 1, 2], [2, 5, 3]])
+def test_rechunk(block_sizes):
+    input_matrix = numpy.arange(20).reshape(10, 2)
+    target_matrix = numpy.arange(10)[:, None]
+    blocks = []
+    start = 0
+    for size in block_sizes:
+        blocks.append((input_matrix[start:start+size], target_matrix[start:start+size]))
+        start += size
+
+    chunks = list(stream._rechunk(blocks, 4))
+    assert [len(chunk[0]) for chunk in chunks] == [4, 4, 2]
+    assert (numpy.concatenate([chunk[0] for chunk in chunks]) == input_matrix).all()
+    assert (numpy.concatenate([chunk[1] for chunk in chunks]) == target_matrix).all()
+
+
+############################
+# Training
+############################
+def test_model_train_chunked_dataset():
+    input_matrix, target_matrix = datasets.get_and()
+    dataset = stream.ArrayDataset(input_matrix, target_matrix, chunk_size=2)
+
+    model = MLP((2, 3, 2), optimizer=SteepestDescent())
+    model.logging = False
+
+    train_steps = []
+    train_step = model.train_step
+    def record_train_step(input_matrix, target_matrix):
+        train_steps.append(len(input_matrix))
+        return train_step(input_matrix, target_matrix)
+    model.train_step = record_train_step
+
+    error = model._get_dataset_error(dataset, None)
+    model.train(dataset, None, iterations=10, error_break=0.0)
+    assert model._get_dataset_error(dataset, None) < error
+
+    # train_step on each chunk, each iteration
+    assert train_steps == [2, 2]*model.iteration
+
+
+def test_array_dataset_dtype():
+    input_matrix, target_matrix = datasets.get_xor()
+    dataset = stream.ArrayDataset(input_matrix, target_matrix, chunk_size=3, dtype='float32')
+
+    for chunk_inputs, chunk_targets in dataset:
+        assert chunk_inputs.dtype == numpy.float32
+        assert chunk_targets.dtype == numpy.float32
+
+
+def test_get_scalers():
+    input_matrix = numpy.random.random((10, 3))
+    target_matrix = numpy.random.random((10, 2))
+    dataset = stream.ArrayDataset(input_matrix, target_matrix, chunk_size=3, scale='normalize')
+
+    # Same scaling as chunks, for new inputs
+    input_scaler, target_scaler = dataset.get_scalers()
+    assert target_scaler is None
+    assert helpers.approx_equal(input_scaler.transform(input_matrix),
+                                _concatenate_chunks(dataset)[0])
+
+
+def test_get_scalers_not_scaled():
+    dataset = stream.ArrayDataset(*datasets.get_xor())
+    with pytest.raises(ValueError):
+        dataset.get_scalers()
@@ -1,6 +1,9 @@
 import numpy
+import pytest
 
-from learning.optimize import linesearch
+from learning.optimize import Problem, linesearch
+
+from learning.testing import helpers
 
 
 #########################
@@ -58,3 +61,167 @@ def _curvature_test(xk, step_size):
 
     return linesearch._curvature_condition(
         df(xk), -df(xk), df(xk - step_size * df(xk)), 0.1)
+
+
+#########################
+# Backtracking line search
+#########################
+@pytest.mark.parametrize('num_candidates', [2, 5, 50])
+def test_backtracking_line_search_num_candidates(num_candidates):
+    f = lambda vec: vec[0]**2 + 10.0 * vec[1]**2
+    df = lambda vec: numpy.array([2.0 * vec[0], 20.0 * vec[1]])
+    xk = numpy.array([1.0, 1.0])
+
+    batches = []
+    def objs_func(parameters_list):
+        batches.append(len(parameters_list))
+        return [f(parameters) for parameters in parameters_list]
+
+    step_size = linesearch._backtracking_line_search(
+        xk, f(xk), df(xk), -df(xk), f, 1e-4, 10.0, decr_rate=0.5,
+        objs_func=objs_func, num_candidates=num_candidates)
+
+    # Same step size as evaluating one at a time
+    assert step_size == linesearch._backtracking_line_search(
+        xk, f(xk), df(xk), -df(xk), f, 1e-4, 10.0, decr_rate=0.5)
+    assert all(batch <= num_candidates for batch in batches)
+    assert len(batches) == -(-8 // num_candidates)
+
+
+def test_backtracking_line_search_uses_get_objs():
+    f = lambda vec: vec[0]**2 + vec[1]**2
+    df = lambda vec: numpy.array([2.0 * vec[0], 2.0 * vec[1]])
+    xk = numpy.array([1.0, 1.0])
+
+    batches = []
+    def objs_func(parameters_list):
+        batches.append(len(parameters_list))
+        return [f(parameters) for parameters in parameters_list]
+
+    step_size_getter = linesearch.BacktrackingLineSearch(num_candidates=3)
+    step_size = step_size_getter(xk, f(xk), df(xk), -df(xk),
+                                 Problem(obj_func=f, jac_func=df, objs_func=objs_func))
+    assert linesearch._armijo_rule(step_size, f(xk), df(xk), -df(xk),
+                                   f(xk - step_size * df(xk)), 1e-4)
+    assert batches and all(batch == 3 for batch in batches)
+
+
+def test_backtracking_line_search_invalid_num_candidates():
+    with pytest.raises(ValueError):
+        linesearch.BacktrackingLineSearch(num_candidates=0)
+
+
+#########################
+# Wolfe line search
+#########################
+def _rosenbrock(vec):
+    return (1.0 - vec[0])**2 + 100.0 * (vec[1] - vec[0]**2)**2
+
+
+def _rosenbrock_jac(vec):
+    return numpy.array([-2.0 * (1.0 - vec[0]) - 400.0 * vec[0] * (vec[1] - vec[0]**2),
+                        200.0 * (vec[1] - vec[0]**2)])
+
+
+@pytest.mark.parametrize('initial_step', [1e-4, 1.0, 1e4])
+def test_line_search_wolfe(initial_step):
+    xk = numpy.array([-1.2, 1.0])
+    step_dir = -_rosenbrock_jac(xk)
+
+    evaluations = []
+    def obj_jac_func(vec):
+        evaluations.append(vec)
+        return _rosenbrock(vec), _rosenbrock_jac(vec)
+
+    step_size, step_obj, step_jac = linesearch._line_search_wolfe(
+        xk, _rosenbrock(xk), _rosenbrock_jac(xk), step_dir, obj_jac_func, 1e-4, 0.1,
+        initial_step)
+
+    assert linesearch._wolfe_conditions(
+        step_size, xk, _rosenbrock(xk), _rosenbrock_jac(xk), step_dir,
+        _rosenbrock(xk + step_size * step_dir), _rosenbrock_jac(xk + step_size * step_dir),
+        1e-4, 0.1)
+    assert len(evaluations) < 15
+
+    # Values at accepted step size are returned
+    assert step_obj == _rosenbrock(xk + step_size * step_dir)
+    assert (step_jac == _rosenbrock_jac(xk + step_size * step_dir)).all()
+
+
+def test_line_search_wolfe_quadratic_interpolation():
+    # Interpolation finds the minimum of a quadratic
+    f = lambda vec: vec[0]**2 + 10.0 * vec[1]**2
+    df = lambda vec: numpy.array([2.0 * vec[0], 20.0 * vec[1]])
+    xk = numpy.array([1.0, 1.0])
+
+    evaluations = []
+    def obj_jac_func(vec):
+        evaluations.append(vec)
+        return f(vec), df(vec)
+
+    step_size, _, _ = linesearch._line_search_wolfe(
+        xk, f(xk), df(xk), -df(xk), obj_jac_func, 1e-4, 1e-3, 1.0)
+
+    # Minimum along -df(xk) is at 101 / 2020
+    assert helpers.approx_equal(step_size, 101.0 / 2020.0)
+    assert len(evaluations) <= 3
+
+
+def test_line_search_wolfe_overflow():
+    # Large step sizes overflow, and must be avoided
+    f = lambda vec: numpy.inf if vec[0] < -1.0 else vec[0]**2
+    df = lambda vec: numpy.array([2.0 * vec[0]])
+    xk = numpy.array([1.0])
+
+    step_size, step_obj, _ = linesearch._line_search_wolfe(
+        xk, f(xk), df(xk), -df(xk), lambda vec: (f(vec), df(vec)), 1e-4, 0.9, 100.0)
+
+    assert step_size > 0
+    assert numpy.isfinite(step_obj)
+    assert step_obj < f(xk)
+
+
+def test_wolfe_line_search_step_obj_jac():
+    f = lambda vec: vec[0]**2 + vec[1]**2
+    df = lambda vec: numpy.array([2.0 * vec[0], 2.0 * vec[1]])
+    xk = numpy.array([1.0, 1.0])
+
+    step_size_getter = linesearch.WolfeLineSearch()
+    step_size = step_size_getter(xk, f(xk), df(xk), -df(xk), Problem(obj_func=f, jac_func=df))
+
+    step_obj, step_jac = step_size_getter.step_obj_jac
+    assert step_obj == f(xk - step_size * df(xk))
+    assert (step_jac == df(xk - step_size * df(xk))).all()
+
+    step_size_getter.reset()
+    assert step_size_getter.step_obj_jac is None
+
+
+def test_cubic_minimizer():
+    # f(x) = x^3 - 3x, minimum at 1
+    f = lambda x: x**3 - 3.0 * x
+    df = lambda x: 3.0 * x**2 - 3.0
+    assert helpers.approx_equal(
+        linesearch._cubic_minimizer((0.0, f(0.0), df(0.0)), (2.0, f(2.0), df(2.0))), 1.0)
+    assert helpers.approx_equal(
+        linesearch._cubic_minimizer((2.0, f(2.0), df(2.0)), (0.5, f(0.5), df(0.5))), 1.0)
+
+    # Linear function has no minimizer
+    assert linesearch._cubic_minimizer((0.0, 0.0, -1.0), (1.0, -1.0, -1.0)) is None
+
+
+def test_quadratic_minimizer():
+    # f(x) = (x - 1)^2
+    assert helpers.approx_equal(
+        linesearch._quadratic_minimizer((0.0, 1.0, -2.0), (3.0, 4.0)), 1.0)
+
+    # Concave function has no minimizer
+    assert linesearch._quadratic_minimizer((0.0, 0.0, -1.0), (1.0, -2.0)) is None
+
+
+def test_interpolate_step_in_interval():
+    # Minimizer is at the end of the interval, step size is kept away from end
+    step_size = linesearch._interpolate_step((0.0, 1.0, -2.0), (1.0, 0.0, 0.0))
+    assert 0.0 < step_size <= 1.0 - linesearch.ZOOM_MARGIN
+
+    assert linesearch._interpolate_step((0.0, 1.0, -2.0), (1.0, 0.0, 0.0), bisect=True) == 0.5
@@ -1,8 +1,11 @@
 import numpy
 
+import pytest
+
 from learning.optimize import (Problem, BacktrackingLineSearch,
                                WolfeLineSearch, BFGS, SteepestDescent,
-                               SteepestDescentMomentum)
+                               SteepestDescentMomentum, FletcherReevesCG,
+                               PolakRibiereCG)
 from learning.optimize import optimizer
 
 from learning.testing import helpers
@@ -54,6 +57,105 @@ def test_steepest_descent_wolfe_line_search():
         SteepestDescent(step_size_getter=WolfeLineSearch()))
 
 
+######################
+# Conjugate gradient
+######################
+@pytest.mark.parametrize('optimizer_class', [FletcherReevesCG, PolakRibiereCG])
+def test_conjugate_gradient_wolfe_line_search(optimizer_class):
+    check_optimize_sphere_function(optimizer_class())
+
+
+@pytest.mark.parametrize('optimizer_class', [FletcherReevesCG, PolakRibiereCG])
+def test_conjugate_gradient_quadratic(optimizer_class):
+    # Converges much faster than steepest descent, on a poorly conditioned problem
+    weights = numpy.linspace(1.0, 100.0, 10)
+    problem = Problem(obj_jac_func=lambda vec: (0.5 * (weights * vec).dot(vec), weights * vec))
+
+    def optimize(my_optimizer):
+        vec = numpy.ones(10)
+        for _ in range(30):
+            obj_value, vec = my_optimizer.next(problem, vec)
+        return obj_value
+
+    assert optimize(optimizer_class()) < 1e-10
+    assert optimize(optimizer_class()) < 1e-3 * optimize(SteepestDescent())
+
+
+def test_conjugate_gradient_restart_iters():
+    my_optimizer = PolakRibiereCG(restart_iters=2)
+    my_optimizer._prev_jacobian = numpy.array([1.0, 0.0])
+    my_optimizer._prev_step_dir = numpy.array([-1.0, 0.0])
+
+    jacobian = numpy.array([0.0, 1.0])
+    my_optimizer._iters_since_restart = 1
+    assert not (my_optimizer._get_step_dir(numpy.zeros(2), jacobian) == -jacobian).all()
+
+    # Restart with steepest descent
+    assert (my_optimizer._get_step_dir(numpy.zeros(2), jacobian) == -jacobian).all()
+    assert my_optimizer._iters_since_restart == 1
+
+
+def test_conjugate_gradient_restart_not_orthogonal():
+    my_optimizer = FletcherReevesCG()
+    my_optimizer._prev_jacobian = numpy.array([1.0, 0.0])
+    my_optimizer._prev_step_dir = numpy.array([-1.0, 0.0])
+    my_optimizer._iters_since_restart = 1
+
+    jacobian = numpy.array([1.0, 1.0])
+    assert (my_optimizer._get_step_dir(numpy.zeros(2), jacobian) == -jacobian).all()
+
+
+def test_polak_ribiere_beta_non_negative():
+    my_optimizer = PolakRibiereCG()
+    my_optimizer._prev_jacobian = numpy.array([1.0, 0.0])
+
+    jacobian = numpy.array([2.0, 0.0])
+    assert my_optimizer._get_beta(jacobian, jacobian.dot(jacobian)) == 2.0
+
+    jacobian = numpy.array([0.5, 0.0])
+    assert my_optimizer._get_beta(jacobian, jacobian.dot(jacobian)) == 0.0
+
+
+def test_conjugate_gradient_invalid_restart_iters():
+    with pytest.raises(ValueError):
+        PolakRibiereCG(restart_iters=0)
+
+
+######################
+# Reuse line search values
+######################
+def test_optimizer_reuses_line_search_obj_jac():
+    calls = []
+    def obj_jac_func(vec):
+        calls.append(vec)
+        return vec[0]**2 + 10.0 * vec[1]**2, numpy.array([2.0 * vec[0], 20.0 * vec[1]])
+
+    problem = Problem(obj_jac_func=obj_jac_func)
+    my_optimizer = BFGS()
+    obj_value, vec = my_optimizer.next(problem, numpy.array([10.0, 10.0]))
+    num_calls = len(calls)
+
+    # Obj and jac at vec were evaluated by line search
+    assert (calls[-1] == vec).all()
+    next_obj_value, _ = my_optimizer.next(problem, vec.copy())
+    assert next_obj_value == vec[0]**2 + 10.0 * vec[1]**2
+    assert (calls[num_calls] != vec).any()
+
+
+def test_optimizer_does_not_reuse_obj_jac_of_other_problem():
+    calls = []
+    def obj_jac_func(vec):
+        calls.append(vec)
+        return vec[0]**2 + 10.0 * vec[1]**2, numpy.array([2.0 * vec[0], 20.0 * vec[1]])
+
+    my_optimizer = SteepestDescent()
+    _, vec = my_optimizer.next(Problem(obj_jac_func=obj_jac_func), numpy.array([10.0, 10.0]))
+    num_calls = len(calls)
+
+    my_optimizer.next(Problem(obj_jac_func=obj_jac_func), vec)
+    assert (calls[num_calls] == vec).all()
+
+
 ######################
 # Helpers
 ######################
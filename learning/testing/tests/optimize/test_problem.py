@@ -90,3 +90,21 @@ def test_optimizer_get_obj_jac_hess_individual_obj_jac_hess():
         jac_func=lambda x: x + 1,
         hess_func=lambda x: x + 2)
     assert tuple(problem.get_obj_jac_hess(1)) == (1, 2, 3)
+
+
+##################################
+# Problem._get_objs
+##################################
+def test_optimizer_get_objs_objs_func():
+    problem = Problem(obj_func=lambda x: x, objs_func=lambda xs: [x + 1 for x in xs])
+    assert problem.get_objs([1, 2]) == [2, 3]
+
+
+def test_optimizer_get_objs_obj_func():
+    problem = Problem(obj_func=lambda x: x)
+    assert problem.get_objs([1, 2]) == [1, 2]
+
+
+def test_optimizer_get_objs_obj_jac_func():
+    problem = Problem(obj_jac_func=lambda x: (x, x + 1))
+    assert problem.get_objs([1, 2]) == [1, 2]
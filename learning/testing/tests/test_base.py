@@ -6,6 +6,7 @@ import numpy
 
 from learning import graph
 from learning import base
+from learning import validation
 from learning.data import datasets
 from learning.architecture import mlp, rbf
 
@@ -150,6 +151,140 @@ def test_break_on_no_improvement():
              error_improve_iters=5)
     assert nn.iteration == 9
 
+def test_model_train_retry_keeps_best_attempt(monkeypatch):
+    dataset = datasets.get_xor()
+    model = mlp.MLP((2, 2, 2))
+    model.logging = False
+
+    # Record error and parameters of each attempt
+    attempts = []
+    train_attempt = mlp.MLP._train_attempt
+    def record_train_attempt(self, *args):
+        train_attempt(self, *args)
+        attempts.append((self._get_dataset_error(*dataset), copy.deepcopy(self._weight_matrices)))
+        return False # Never converge
+    monkeypatch.setattr(mlp.MLP, '_train_attempt', record_train_attempt)
+
+    model.train(*dataset, iterations=2, retries=3)
+    assert len(attempts) == 4
+
+    best_error, best_weights = min(attempts, key=lambda attempt: attempt[0])
+    assert model._get_dataset_error(*dataset) == best_error
+    for weight_matrix, best_matrix in zip(model._weight_matrices, best_weights):
+        assert (weight_matrix == best_matrix).all()
+
+def test_multioutputs_train_retry_keeps_best_attempt(monkeypatch):
+    from learning.architecture import multioutputs
+
+    dataset = datasets.get_xor()
+    model = multioutputs.MultiOutputs(mlp.MLP((2, 3, 1)), 2, shared_trunk=True)
+    model.logging = False
+
+    # Record error and copy of model after each attempt
+    attempts = []
+    train_attempt = multioutputs.MultiOutputs._train_attempt
+    def record_train_attempt(self, *args):
+        train_attempt(self, *args)
+        attempts.append((self._get_dataset_error(*dataset), copy.deepcopy(self)))
+        return False # Never converge
+    monkeypatch.setattr(multioutputs.MultiOutputs, '_train_attempt', record_train_attempt)
+
+    model.train(*dataset, iterations=3, retries=3)
+    assert len(attempts) == 4
+
+    # Best attempt is restored, including training state of nested models
+    best_error, best_model = min(attempts, key=lambda attempt: attempt[0])
+    assert model._get_dataset_error(*dataset) == best_error
+    assert model.iteration == best_model.iteration
+    assert model._errors == best_model._errors
+    assert (model._rl_agent._reward_array == best_model._rl_agent._reward_array).all()
+    for head, best_head in zip(model._models, best_model._models):
+        assert (head._optimizer._prev_jacobian == best_head._optimizer._prev_jacobian).all()
+    assert (model._trunk._optimizer._prev_inv_hessian
+            == best_model._trunk._optimizer._prev_inv_hessian).all()
+
+def test_model_train_parallel_retries():
+    dataset = datasets.get_xor()
+    model = mlp.MLP((2, 2, 2))
+    model.logging = False
+
+    model.train(*dataset, iterations=2, retries=2, error_break=0.0,
+                parallel_retries=True)
+    assert model.iteration == 2
+    assert helpers.approx_equal(model._get_dataset_error(*dataset),
+                                validation.get_error(model, *dataset))
+
+def test_model_train_parallel_retries_without_parameters():
+    # Falls back to sequential retries
+    model = helpers.SetOutputModel(1.0)
+    model.logging = False
+    model.train([[]], [[0.0]], iterations=2, retries=2, parallel_retries=True)
+
+def test_get_dataset_error():
+    dataset = datasets.get_xor()
+    model = mlp.MLP((2, 3, 2))
+    assert helpers.approx_equal(model._get_dataset_error(*dataset),
+                                validation.get_error(model, *dataset))
+
+def test_get_dataset_error_ragged_outputs():
+    class RaggedModel(helpers.EmptyModel):
+        def activate(self, inputs):
+            return numpy.ones(inputs[0])
+
+    model = RaggedModel()
+    dataset = ([[1], [2]], [[1.0], [1.0, 0.0]])
+    assert model._get_dataset_error(*dataset) == validation.get_error(model, *dataset) == 0.25
+
+def test_snapshot_restore():
+    model = mlp.MLP((2, 3, 2))
+    weight_matrices = copy.deepcopy(model._weight_matrices)
+
+    snapshot = model._take_snapshot()
+    model.reset()
+    model._restore_snapshot(snapshot)
+    for weight_matrix, expected in zip(model._weight_matrices, weight_matrices):
+        assert (weight_matrix == expected).all()
+
+def test_snapshot_reuses_buffers():
+    model = mlp.MLP((2, 3, 2))
+    snapshot = model._take_snapshot()
+    model.reset()
+
+    new_snapshot = model._take_snapshot(snapshot)
+    assert all(buffer_ is new_buffer for buffer_, new_buffer in zip(snapshot[0], new_snapshot[0]))
+    for buffer_, weight_matrix in zip(new_snapshot[0], model._weight_matrices):
+        assert (buffer_ == weight_matrix).all()
+
+def test_snapshot_restore_iteration():
+    model = mlp.MLP((2, 3, 2))
+    model.iteration = 5
+    snapshot = model._take_snapshot()
+
+    model.iteration = 10
+    model._restore_snapshot(snapshot)
+    assert model.iteration == 5
+
+def test_snapshot_restore_without_parameters():
+    model = helpers.SetOutputModel(1.0)
+    snapshot = model._take_snapshot()
+    model.output = numpy.array(2.0)
+
+    model._restore_snapshot(snapshot)
+    assert model.output == 1.0
+
+def test_get_parameter_arrays_nested():
+    from learning.architecture import multioutputs
+
+    model = multioutputs.MultiOutputs(mlp.MLP((2, 3, 2)), 2)
+    arrays = base._get_parameter_arrays(model)
+    assert len(arrays) == 4
+
+    base._set_parameter_arrays(model, iter([numpy.zeros(array.shape) for array in arrays]))
+    assert (model.activate_batch(numpy.ones((1, 2))) == 0.0).all()
+
+    assert base._get_parameter_arrays(
+        multioutputs.MultiOutputs(helpers.SetOutputModel(1.0), 2)) is None
+
 @pytest.mark.skip(reason='Hard to test, but not hard to implement')
 def test_model_train_retry():
     # Model should reset and retry if it doesn't converge
@@ -174,3 +309,50 @@ def test_unserialize_wrong_type():
     """Model.unserialize should raise error if serialized model is of wrong type."""
     with pytest.raises(ValueError):
         base.Model.unserialize(helpers.SetOutputModel(1.0).serialize())
+
+def test_save_load(tmpdir):
+    model = mlp.MLP((2, 3, 2))
+    file_name = str(tmpdir.join('model.lrn'))
+    model.save(file_name)
+
+    loaded_model = mlp.MLP.load(file_name)
+    assert isinstance(loaded_model, mlp.MLP)
+    input_vec = numpy.random.random(2)
+    assert helpers.approx_equal(loaded_model.activate(input_vec), model.activate(input_vec))
+
+def test_load_wrong_type(tmpdir):
+    """Model.load should raise error if saved model is of wrong type."""
+    file_name = str(tmpdir.join('model.lrn'))
+    mlp.MLP((2, 3, 2)).save(file_name)
+    with pytest.raises(ValueError):
+        rbf.RBF.load(file_name)
+
+def test_get_dataset_error_class_indices():
+    input_matrix, target_matrix = datasets.get_xor()
+    model = mlp.MLP((2, 3, 2))
+    assert helpers.approx_equal(
+        model._get_dataset_error(input_matrix, numpy.argmax(target_matrix, axis=1)),
+        model._get_dataset_error(input_matrix, target_matrix))
+
+
+######################
+# Workspace
+######################
+def test_workspace_get_buffer():
+    workspace = base.Workspace()
+    buffer_ = workspace.get_buffer('key', (2, 3), numpy.float32)
+    assert buffer_.shape == (2, 3)
+    assert buffer_.dtype == numpy.float32
+
+    # Reused for the same key, shape, and dtype
+    assert workspace.get_buffer('key', (2, 3), numpy.float32) is buffer_
+    assert workspace.get_buffer('other', (2, 3), numpy.float32) is not buffer_
+
+    # Replaced if shape or dtype changes
+    assert workspace.get_buffer('key', (4, 3), numpy.float32).shape == (4, 3)
+    assert workspace.get_buffer('key', (4, 3), numpy.float64).dtype == numpy.float64
+
+
+def test_model_activate_batch_ignores_workspace():
+    model = helpers.SetOutputModel([1.0, 2.0])
+    assert (model.activate_batch(numpy.zeros((3, 1)), base.Workspace()) == [1.0, 2.0]).all()
@@ -7,6 +7,51 @@ import numpy
 from learning import calculate
 from learning.testing import helpers
 
+def test_distance_matrix():
+    x_matrix = numpy.random.random((4, 3))
+    y_matrix = numpy.random.random((5, 3))
+    y_matrix[0] = x_matrix[0] # Distance 0
+
+    expected = [[calculate.distance(x_vec, y_vec) for y_vec in y_matrix] for x_vec in x_matrix]
+    assert helpers.approx_equal(calculate.distance_matrix(x_matrix, y_matrix), expected)
+    assert helpers.approx_equal(
+        calculate.distance_matrix(x_matrix, y_matrix, calculate.squared_norms(y_matrix)), expected)
+
+    out = numpy.empty((4, 5))
+    assert calculate.distance_matrix(x_matrix, y_matrix, out=out) is out
+
+def test_squared_distance_matrix():
+    x_matrix = numpy.random.random((4, 3))
+    y_matrix = numpy.random.random((5, 3))
+
+    expected = [[calculate.distance(x_vec, y_vec)**2 for y_vec in y_matrix] for x_vec in x_matrix]
+    assert helpers.approx_equal(calculate.squared_distance_matrix(x_matrix, y_matrix), expected)
+
+def test_distance_matrix_float32():
+    # Close rows far from the origin, where |x|^2 - 2 x.y + |y|^2 cancels
+    x_matrix = (100.0 + numpy.random.random((20, 8))).astype('float32')
+    y_matrix = (100.0 + numpy.random.random((30, 8))).astype('float32')
+    y_matrix[:5] = x_matrix[:5] # Distance 0
+    y_matrix[5:10] = x_matrix[5:10] + 1e-3
+
+    # Direct computation, from differences of rows
+    expected = numpy.sqrt(numpy.sum(
+        (x_matrix[:, None, :] - y_matrix[None, :, :]).astype('float64')**2, axis=-1))
+
+    distances = calculate.distance_matrix(x_matrix, y_matrix)
+    assert distances.dtype == numpy.float32
+    assert (distances >= 0.0).all()
+    assert (distances[range(5), range(5)] == 0.0).all()
+    assert numpy.allclose(distances, expected, rtol=1e-4, atol=1e-6)
+
+def test_distance_matrix_float32_blocks(monkeypatch):
+    monkeypatch.setattr(calculate, '_DIRECT_BLOCK_SIZE', 8)
+    x_matrix = (100.0 + numpy.random.random((6, 4))).astype('float32')
+    expected = numpy.sqrt(numpy.sum(
+        (x_matrix[:, None, :] - x_matrix[None, :, :]).astype('float64')**2, axis=-1))
+    assert numpy.allclose(calculate.distance_matrix(x_matrix, x_matrix), expected,
+                          rtol=1e-4, atol=1e-6)
+
 def test_protvecdiv_no_zero():
     assert (calculate.protvecdiv(
         numpy.array([1.0, 2.0, 3.0]), numpy.array([2.0, 2.0, 2.0]))
@@ -42,6 +87,11 @@ def test_gaussian_transfer():
     assert helpers.approx_equal(calculate.gaussian(numpy.array([-1.0, 0.0, 0.5, 1.0]), variance=0.5),
                                 [0.135335, 1.0, 0.606531, 0.135335])
 
+def test_gaussian_of_squared():
+    x = numpy.array([-1.0, 0.0, 0.5, 1.0])
+    assert helpers.approx_equal(calculate.gaussian_of_squared(x**2, variance=0.5),
+                                calculate.gaussian(x, variance=0.5))
+
 def test_gaussian_gradient():
     helpers.check_gradient(calculate.gaussian,
                            lambda x: calculate.dgaussian(x, calculate.gaussian(x)), f_shape='lin')
@@ -66,10 +116,35 @@ def test_softmax_large_input():
     """
     assert list(calculate.softmax(numpy.array([-1000.0, 1000.0]))) == [0.0, 1.0]
 
+def test_softmax_matrix():
+    matrix = numpy.random.random((3, 4))
+    softmax_matrix = calculate.softmax(matrix)
+    for row, softmax_row in zip(matrix, softmax_matrix):
+        assert helpers.approx_equal(softmax_row, calculate.softmax(row))
+
 def test_softmax_jacobian():
     helpers.check_gradient(calculate.softmax, lambda x: calculate.dsoftmax(calculate.softmax(x)),
                            f_shape='jac')
 
+def test_log_softmax():
+    matrix = numpy.random.random((3, 4))
+    assert helpers.approx_equal(calculate.log_softmax(matrix), numpy.log(calculate.softmax(matrix)))
+
+    # Does not underflow to log(0)
+    assert list(calculate.log_softmax(numpy.array([-1000.0, 1000.0]))) == [-2000.0, 0.0]
+
+def test_softmax_jvp():
+    y = calculate.softmax(numpy.random.random(4))
+    v = numpy.random.random(4)
+    assert helpers.approx_equal(calculate.softmax_jvp(y, v), v.dot(calculate.dsoftmax(y)))
+
+def test_softmax_jvp_matrix():
+    y_matrix = calculate.softmax(numpy.random.random((3, 4)))
+    v_matrix = numpy.random.random((3, 4))
+    jvp_matrix = calculate.softmax_jvp(y_matrix, v_matrix)
+    for y, v, jvp in zip(y_matrix, v_matrix, jvp_matrix):
+        assert helpers.approx_equal(jvp, calculate.softmax_jvp(y, v))
+
 ##############
 # ReLU
 ##############
@@ -101,3 +176,45 @@ def test_relu_gradient():
 def test_big_relu_gradient():
     helpers.check_gradient(calculate.relu, calculate.drelu,
                            inputs=numpy.array([0., 1000.]), f_shape='lin')
+
+def test_relu_derivative_from_output():
+    x = numpy.array([-1000., -1.5, 0., 1., 10., 1000.])
+    assert helpers.approx_equal(calculate.drelu(x, calculate.relu(x)), calculate.drelu(x))
+
+def test_relu_dout():
+    x = numpy.array([-1000., -1.5, 0., 1., 10., 1000.])
+    dout = numpy.empty_like(x)
+    assert helpers.approx_equal(calculate.relu(x, dout=dout), calculate.relu(x))
+    assert helpers.approx_equal(dout, calculate.drelu(x))
+
+    # In place
+    expected = calculate.relu(x)
+    assert calculate.relu(x, out=x, dout=dout) is x
+    assert helpers.approx_equal(x, expected)
+
+
+#####################
+# Out buffers
+#####################
+@pytest.mark.parametrize('func', [calculate.tanh, calculate.dtanh, calculate.gaussian,
+                                  calculate.relu, calculate.drelu, calculate.softmax,
+                                  calculate.log_softmax,
+                                  lambda x, out: calculate.dgaussian(x, calculate.gaussian(x), out=out),
+                                  lambda x, out: calculate.drelu(x, calculate.relu(x), out=out)])
+def test_out(func):
+    x = numpy.random.uniform(-2.0, 2.0, (3, 4))
+    expected = func(x, out=None)
+
+    out = numpy.empty_like(x)
+    assert func(x, out=out) is out
+    assert helpers.approx_equal(out, expected)
+
+    # In place
+    assert func(x, out=x) is x
+    assert helpers.approx_equal(x, expected)
+
+def test_dsoftmax_out():
+    y = calculate.softmax(numpy.random.random(4))
+    out = numpy.empty((4, 4))
+    assert calculate.dsoftmax(y, out=out) is out
+    assert helpers.approx_equal(out, calculate.dsoftmax(y))
@@ -0,0 +1,57 @@
+import pytest
+import numpy
+
+from learning import dtypes, preprocess, MLP
+
+
+@pytest.fixture
+def restore_dtypes(monkeypatch):
+    # set_* change module globals, restored by monkeypatch
+    monkeypatch.setattr(dtypes, '_default_dtype', dtypes.get_default_dtype())
+    monkeypatch.setattr(dtypes, '_accumulate_dtype', dtypes.get_accumulate_dtype())
+
+
+def test_get_dtype():
+    assert dtypes.get_dtype('float32') == numpy.float32
+    assert dtypes.get_dtype(numpy.float64) == numpy.float64
+    assert dtypes.get_dtype(None) == dtypes.get_default_dtype()
+
+
+def test_get_dtype_not_float():
+    with pytest.raises(ValueError):
+        dtypes.get_dtype('int32')
+    with pytest.raises(ValueError):
+        dtypes.get_dtype('float16')
+
+
+def test_set_default_dtype(restore_dtypes):
+    dtypes.set_default_dtype('float32')
+    assert dtypes.get_dtype(None) == numpy.float32
+
+    # Used by models and preprocessing without a dtype
+    assert all(weight_matrix.dtype == numpy.float32
+               for weight_matrix in MLP((2, 3, 1))._weight_matrices)
+    assert preprocess.rescale([[0, 1], [1, 2]]).dtype == numpy.float32
+
+
+def test_mean_keeps_dtype(restore_dtypes):
+    values = numpy.random.random((10, 3)).astype('float32')
+    assert dtypes.mean(values).dtype == numpy.float32
+    assert dtypes.mean(values, axis=0).dtype == numpy.float32
+
+    dtypes.set_accumulate_dtype('float64')
+    assert dtypes.mean(values).dtype == numpy.float32
+    assert dtypes.mean(values, axis=0).dtype == numpy.float32
+
+
+def test_mean_accumulate_dtype(restore_dtypes):
+    values = numpy.random.random(1000).astype('float32')
+
+    dtypes.set_accumulate_dtype('float64')
+    assert dtypes.mean(values) == numpy.float32(numpy.mean(values, dtype='float64'))
+
+
+def test_set_accumulate_dtype_none(restore_dtypes):
+    dtypes.set_accumulate_dtype('float64')
+    dtypes.set_accumulate_dtype(None)
+    assert dtypes.get_accumulate_dtype() is None
@@ -42,6 +42,87 @@ def test_cross_entropy_derivative_equals():
         == [0., -0.5]
     )
 
+@pytest.mark.parametrize('error_func', [error.MSE(), error.CrossEntropy()])
+def test_class_index_target_equals_onehot(error_func):
+    vec_a = numpy.random.random(4)
+    onehot = numpy.array([0., 0., 1., 0.])
+
+    assert helpers.approx_equal(error_func(vec_a, 2), error_func(vec_a, onehot))
+
+    index_error, index_jac = error_func.derivative(vec_a, 2)
+    onehot_error, onehot_jac = error_func.derivative(vec_a, onehot)
+    assert helpers.approx_equal(index_error, onehot_error)
+    assert helpers.approx_equal(index_jac, onehot_jac)
+
+@pytest.mark.parametrize('error_func', [error.MSE(), error.CrossEntropy()])
+def test_matrix_reductions(error_func):
+    matrix_a = numpy.random.random((5, 3))
+    matrix_b = numpy.random.random((5, 3))
+    errors = numpy.array([error_func(vec_a, vec_b) for vec_a, vec_b in zip(matrix_a, matrix_b)])
+
+    assert helpers.approx_equal(error_func(matrix_a, matrix_b, reduction='none'), errors)
+    assert helpers.approx_equal(error_func(matrix_a, matrix_b), numpy.mean(errors))
+    assert helpers.approx_equal(error_func(matrix_a, matrix_b, reduction='sum'), numpy.sum(errors))
+
+    with pytest.raises(ValueError):
+        error_func(matrix_a, matrix_b, reduction='invalid')
+
+@pytest.mark.parametrize('error_func', [error.MSE(), error.CrossEntropy()])
+def test_matrix_derivative(error_func):
+    # Away from 0, where cross entropy is too steep for finite differences
+    matrix_a = numpy.random.uniform(0.1, 1.0, (5, 3))
+    matrix_b = numpy.random.random((5, 3))
+    jacobians = numpy.array([error_func.derivative(vec_a, vec_b)[1]
+                             for vec_a, vec_b in zip(matrix_a, matrix_b)])
+
+    assert helpers.approx_equal(error_func.derivative(matrix_a, matrix_b)[1], jacobians / 5)
+    assert helpers.approx_equal(error_func.derivative(matrix_a, matrix_b, reduction='none')[1],
+                                jacobians)
+    helpers.check_gradient(
+        lambda X: error_func(X.reshape(matrix_a.shape), matrix_b),
+        lambda X: error_func.derivative(X.reshape(matrix_a.shape), matrix_b)[1].ravel(),
+        inputs=matrix_a.ravel(),
+        f_shape='scalar'
+    )
+
+@pytest.mark.parametrize('error_func', [error.MSE(), error.CrossEntropy()])
+def test_matrix_class_index_targets(error_func):
+    matrix_a = numpy.random.random((5, 3))
+    class_indices = numpy.array([0, 2, 1, 1, 0])
+    onehot = numpy.identity(3)[class_indices]
+
+    assert helpers.approx_equal(error_func(matrix_a, class_indices, reduction='none'),
+                                error_func(matrix_a, onehot, reduction='none'))
+    assert helpers.approx_equal(error_func.derivative(matrix_a, class_indices)[1],
+                                error_func.derivative(matrix_a, onehot)[1])
+
+def test_mse_scalar_int_target():
+    # Single output, integer target is a value, not a class index
+    assert error.MSE()(numpy.array([0.5]), 1) == 0.25
+    assert error.MSE()(numpy.array([0.5]), 0) == 0.25
+
+    error_, derivative = error.MSE().derivative(numpy.array([0.5]), 1)
+    assert error_ == 0.25
+    assert (derivative == [-1.0]).all()
+
+@pytest.mark.parametrize('error_func', [error.MSE(), error.CrossEntropy()])
+def test_matrix_binary_int_targets(error_func):
+    # Single output, integer targets are values, not class indices
+    matrix_a = numpy.random.uniform(0.1, 0.9, (5, 1))
+    targets = numpy.array([0, 1, 1, 0, 1])
+
+    assert helpers.approx_equal(error_func(matrix_a, targets, reduction='none'),
+                                error_func(matrix_a, targets[:, None].astype(float),
+                                           reduction='none'))
+    assert helpers.approx_equal(error_func.derivative(matrix_a, targets)[1],
+                                error_func.derivative(matrix_a, targets[:, None].astype(float))[1])
+
+def test_cross_entropy_zero_in_vec_a_is_finite():
+    error_func = error.CrossEntropy()
+    error_, derivative = error_func.derivative(numpy.array([[0., 1.]]), numpy.array([[1., 0.]]))
+    assert numpy.isfinite(error_) and error_ > 0
+    assert numpy.isfinite(derivative).all()
+
 def check_error_gradient(error_func):
     vec_length = random.randint(1, 10)
 
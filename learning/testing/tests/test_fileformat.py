@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from learning import fileformat
+
+
+def test_atomic_path(tmpdir):
+    file_name = str(tmpdir.join('file'))
+    with fileformat.atomic_path(file_name) as temp_path:
+        with open(temp_path, 'wb') as file_:
+            file_.write('data')
+        assert not os.path.exists(file_name)
+
+    assert open(file_name, 'rb').read() == 'data'
+    assert os.listdir(str(tmpdir)) == ['file']
+
+    # Same permissions as files made by open
+    assert os.stat(file_name).st_mode & 0o777 == 0o666 & ~fileformat._UMASK
+
+
+def test_atomic_path_error(tmpdir):
+    file_name = str(tmpdir.join('file'))
+    with pytest.raises(ZeroDivisionError):
+        with fileformat.atomic_path(file_name):
+            1 / 0
+
+    # Temporary file is removed
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_make_header_aligned():
+    header, header_json = fileformat.make_header(
+        'MAGIC123', lambda data_start: {'offset': data_start, 'padding': 'x'*100})
+    assert header['offset'] % fileformat.ALIGNMENT == 0
+    assert len('MAGIC123') + 8 + len(header_json) <= header['offset']
@@ -0,0 +1,160 @@
+import pytest
+import numpy
+
+from learning import frozen, Workspace, MLP
+from learning.architecture import mlp, rbf, pbnn
+from learning.data import datasets
+
+from learning.testing import helpers
+
+
+def _make_models():
+    dataset = datasets.get_xor()
+
+    mlp_model = MLP((2, 3, 2), transfers=mlp.SoftmaxTransfer())
+    mlp_model.logging = False
+    mlp_model.train(*dataset, iterations=5)
+
+    rbf_model = rbf.RBF(2, 4, 2)
+    rbf_model.logging = False
+    rbf_model.train(*dataset, iterations=5)
+
+    pbnn_model = pbnn.PBNN()
+    pbnn_model.train(*dataset)
+
+    return [mlp_model, rbf_model, pbnn_model]
+
+
+def _assert_same_outputs(model, frozen_model, input_matrix):
+    assert helpers.approx_equal(frozen_model.predict(input_matrix),
+                                [model.activate(input_vec) for input_vec in input_matrix])
+
+
+@pytest.mark.parametrize('index', range(3))
+def test_freeze(index):
+    model = _make_models()[index]
+    input_matrix = numpy.random.random((5, 2))
+
+    frozen_model = model.freeze()
+    assert isinstance(frozen_model, frozen.FrozenModel)
+    _assert_same_outputs(model, frozen_model, input_matrix)
+
+    # Outputs are stored in workspace
+    workspace = Workspace()
+    outputs = frozen_model.predict(input_matrix, workspace)
+    _assert_same_outputs(model, frozen_model, input_matrix)
+    assert frozen_model.predict(input_matrix, workspace) is outputs
+
+
+@pytest.mark.parametrize('index', range(3))
+def test_freeze_float32(index):
+    model = _make_models()[index]
+    input_matrix = numpy.random.random((5, 2))
+
+    frozen_model = model.freeze(dtype='float32')
+    outputs = frozen_model.predict(input_matrix)
+    assert outputs.dtype == numpy.float32
+    assert numpy.allclose(outputs, model.activate_batch(input_matrix), atol=1e-5)
+
+
+@pytest.mark.parametrize('index', range(3))
+def test_frozen_model_is_immutable(index):
+    frozen_model = _make_models()[index].freeze()
+
+    with pytest.raises(AttributeError):
+        frozen_model._dtype = numpy.float32
+
+    for attribute in frozen_model._parameter_attributes:
+        value = getattr(frozen_model, attribute)
+        for array in (value if isinstance(value, list) else [value]):
+            if array is not None:
+                assert not array.flags.writeable
+                assert array.flags.c_contiguous
+
+
+def test_freeze_does_not_share_weights():
+    model = MLP((2, 3, 2))
+    frozen_model = model.freeze()
+
+    # Training model does not change frozen model
+    input_matrix = numpy.random.random((5, 2))
+    expected = frozen_model.predict(input_matrix).copy()
+    model._weight_matrices[0] += 1.0
+    assert (frozen_model.predict(input_matrix) == expected).all()
+
+
+@pytest.mark.parametrize('mmap_mode', [None, 'c'])
+@pytest.mark.parametrize('index', range(3))
+def test_frozen_save_load(tmpdir, index, mmap_mode):
+    model = _make_models()[index]
+    frozen_model = model.freeze()
+
+    file_name = str(tmpdir.join('model.lrn'))
+    frozen_model.save(file_name)
+    loaded_model = type(frozen_model).load(file_name, mmap_mode=mmap_mode)
+
+    assert type(loaded_model) == type(frozen_model)
+    _assert_same_outputs(model, loaded_model, numpy.random.random((5, 2)))
+    with pytest.raises(ValueError):
+        model.load(file_name)
+
+
+@pytest.mark.parametrize('index', range(3))
+def test_frozen_serialize(index):
+    model = _make_models()[index]
+    frozen_model = model.freeze()
+
+    _assert_same_outputs(model, type(frozen_model).unserialize(frozen_model.serialize()),
+                         numpy.random.random((5, 2)))
+
+
+@pytest.mark.parametrize('index', range(2))
+def test_frozen_serialize_excludes_training_state(index):
+    # Trained MLP and RBF have BFGS hessians
+    model = _make_models()[index]
+    assert len(model.freeze().serialize()) < len(model.serialize()) / 2
+
+
+def test_freeze_pbnn_class_index_targets():
+    input_matrix, target_matrix = datasets.get_xor()
+    model = pbnn.PBNN()
+    model.train(input_matrix, numpy.argmax(target_matrix, axis=1))
+
+    _assert_same_outputs(model, model.freeze(), numpy.random.random((5, 2)))
+
+
+def test_freeze_pbnn_class_index_targets_keeps_indices(tmpdir):
+    input_matrix = numpy.random.random((20, 2))
+    model = pbnn.PBNN()
+    # Unsorted classes, and class 1 has no samples
+    model.train(input_matrix, numpy.random.choice([0, 2, 3], 20))
+
+    frozen_model = model.freeze()
+    assert frozen_model._target_matrix is None
+    _assert_same_outputs(model, frozen_model, numpy.random.random((5, 2)))
+
+    # Workspace and saved model
+    workspace = Workspace()
+    assert helpers.approx_equal(frozen_model.predict(input_matrix[:5], workspace),
+                                frozen_model.predict(input_matrix[:5]))
+
+    file_name = str(tmpdir.join('model'))
+    frozen_model.save(file_name)
+    _assert_same_outputs(model, frozen.FrozenPBNN.load(file_name), numpy.random.random((5, 2)))
+
+
+def test_freeze_pbnn_empty_class():
+    model = pbnn.PBNN()
+    model.train([[0.0, 0.0], [1.0, 1.0]], [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+
+    _assert_same_outputs(model, model.freeze(), numpy.random.random((5, 2)))
+
+
+def test_freeze_pbnn_untrained():
+    with pytest.raises(ValueError):
+        pbnn.PBNN().freeze()
+
+
+def test_frozen_predict_wrong_shape():
+    with pytest.raises(ValueError):
+        MLP((2, 3, 2)).freeze().predict(numpy.zeros((5, 3)))
@@ -0,0 +1,141 @@
+import struct
+
+import pytest
+import numpy
+
+from learning import modelfile, MLP
+from learning.architecture import rbf, pbnn, multioutputs
+from learning.data import datasets
+
+from learning.testing import helpers
+
+
+def _save_load(model, tmpdir, mmap_mode='c'):
+    file_name = str(tmpdir.join('model.lrn'))
+    modelfile.save(model, file_name)
+    return modelfile.load(file_name, mmap_mode=mmap_mode)
+
+
+def _assert_same_outputs(model, loaded_model, input_matrix):
+    assert type(loaded_model) == type(model)
+    for input_vec in input_matrix:
+        assert helpers.approx_equal(loaded_model.activate(input_vec), model.activate(input_vec))
+
+
+@pytest.mark.parametrize('mmap_mode', [None, 'r', 'c'])
+def test_save_load_mlp(tmpdir, mmap_mode):
+    dataset = datasets.get_xor()
+    model = MLP((2, 3, 2))
+    model.train(*dataset, iterations=5)
+
+    loaded_model = _save_load(model, tmpdir, mmap_mode)
+    _assert_same_outputs(model, loaded_model, dataset[0])
+
+
+def test_save_load_mlp_continue_training(tmpdir):
+    dataset = datasets.get_xor()
+    model = MLP((2, 3, 2))
+    model.logging = False
+    model.train(*dataset, iterations=5)
+
+    # Copy-on-write memory map can be trained, without modifying file
+    loaded_model = _save_load(model, tmpdir, 'c')
+    loaded_model.logging = False
+    loaded_model.train(*dataset, iterations=5)
+    _assert_same_outputs(model, modelfile.load(str(tmpdir.join('model.lrn'))),
+                         dataset[0])
+
+
+def test_save_mlp_resets_optimizer(tmpdir):
+    dataset = datasets.get_xor()
+    model = MLP((2, 3, 2))
+    model.logging = False
+    model.train(*dataset, iterations=5)
+    assert model._optimizer._prev_jacobian is not None
+
+    loaded_model = _save_load(model, tmpdir)
+    assert loaded_model._optimizer._prev_jacobian is None
+    # Given model is not modified
+    assert model._optimizer._prev_jacobian is not None
+
+
+def test_save_excludes_scratch_attributes(tmpdir):
+    model = MLP((2, 3, 2))
+    loaded_model = _save_load(model, tmpdir)
+
+    assert len(loaded_model._weight_inputs) == len(model._weight_inputs)
+    assert len(loaded_model._transfer_inputs) == len(model._transfer_inputs)
+    header = modelfile.read_header(str(tmpdir.join('model.lrn')))
+    assert [array_header['path'] for array_header in header['arrays']] == [
+        '_weight_matrices/0', '_weight_matrices/1']
+
+
+def test_save_load_rbf(tmpdir):
+    dataset = datasets.get_xor()
+    model = rbf.RBF(2, 4, 2)
+    model.train(*dataset, iterations=5)
+
+    _assert_same_outputs(model, _save_load(model, tmpdir), dataset[0])
+
+
+def test_save_load_pbnn(tmpdir):
+    dataset = datasets.get_xor()
+    model = pbnn.PBNN()
+    model.train(*dataset)
+
+    _assert_same_outputs(model, _save_load(model, tmpdir), dataset[0])
+
+
+@pytest.mark.parametrize('shared_trunk', [False, True])
+def test_save_load_multioutputs(tmpdir, shared_trunk):
+    input_matrix = numpy.random.random((5, 3))
+    model = multioutputs.MultiOutputs(MLP((3, 4, 2)), 2, shared_trunk=shared_trunk)
+
+    _assert_same_outputs(model, _save_load(model, tmpdir), input_matrix)
+
+
+def test_save_big_endian(tmpdir):
+    model = MLP((2, 3, 2))
+    model._weight_matrices = [weight_matrix.astype('>f8')
+                              for weight_matrix in model._weight_matrices]
+
+    loaded_model = _save_load(model, tmpdir)
+    header = modelfile.read_header(str(tmpdir.join('model.lrn')))
+    assert [array_header['dtype'] for array_header in header['arrays']] == ['<f8', '<f8']
+    for weight_matrix, loaded_matrix in zip(model._weight_matrices,
+                                            loaded_model._weight_matrices):
+        assert (weight_matrix == loaded_matrix).all()
+
+
+def test_save_arrays_aligned(tmpdir):
+    _save_load(MLP((2, 3, 2)), tmpdir)
+    header = modelfile.read_header(str(tmpdir.join('model.lrn')))
+    for array_header in header['arrays']:
+        assert array_header['offset'] % modelfile.ALIGNMENT == 0
+
+
+def test_load_not_model_file(tmpdir):
+    file_name = tmpdir.join('model.lrn')
+    file_name.write('not a model')
+    with pytest.raises(ValueError):
+        modelfile.load(str(file_name))
+
+
+def test_load_unsupported_version(tmpdir):
+    file_name = str(tmpdir.join('model.lrn'))
+    modelfile.save(MLP((2, 3, 2)), file_name)
+
+    # Overwrite version
+    with open(file_name, 'r+b') as file_:
+        file_.seek(len(modelfile.MAGIC))
+        file_.write(struct.pack('<I', modelfile.FORMAT_VERSION+1))
+
+    with pytest.raises(ValueError):
+        modelfile.load(file_name)
+
+
+def test_load_invalid_mmap_mode(tmpdir):
+    file_name = str(tmpdir.join('model.lrn'))
+    modelfile.save(MLP((2, 3, 2)), file_name)
+    with pytest.raises(ValueError):
+        modelfile.load(file_name, mmap_mode='w+')
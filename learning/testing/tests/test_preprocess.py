@@ -81,6 +81,44 @@ def make_labels():
     assert (preprocess.make_labels(onehot)
             == numpy.array([[0], [1], [0]])).all()
 
+def test_make_onehot_first_appearance_order():
+    assert (preprocess.make_onehot([7, -2, 7, 3])
+            == numpy.array([[1, 0, 0], [0, 1, 0], [1, 0, 0], [0, 0, 1]])).all()
+    assert (preprocess.make_onehot(['b', 'a', 'b'])
+            == numpy.array([[1, 0], [0, 1], [1, 0]])).all()
+    # Large range of integers is sorted instead of counted
+    assert (preprocess.make_onehot([10**9, 0, 10**9])
+            == numpy.array([[1, 0], [0, 1], [1, 0]])).all()
+
+def test_make_onehot_ragged():
+    assert (preprocess.make_onehot([[1, 2], [3], [1, 2]])
+            == numpy.array([[1, 0], [0, 1], [1, 0]])).all()
+
+def test_make_onehot_dtype():
+    assert preprocess.make_onehot([1, 2, 1], dtype='float32').dtype == numpy.float32
+
+def test_make_labels_onehot():
+    onehot = numpy.array([
+        [0, 0, 1],
+        [1, 0, 0],
+        [0, 0, 1],
+        [0, 1, 0]
+    ])
+    assert (preprocess.make_labels(onehot) == numpy.array([[0], [1], [0], [2]])).all()
+
+def test_make_labels_not_onehot():
+    matrix = numpy.array([
+        [0.5, 0.5],
+        [1.0, 0.0],
+        [0.5, 0.5]
+    ])
+    assert (preprocess.make_labels(matrix) == numpy.array([[0], [1], [0]])).all()
+
+def test_make_labels_compact():
+    labels = preprocess.make_labels(preprocess.make_onehot(numpy.arange(300) % 3), compact=True)
+    assert labels.dtype == numpy.uint8
+    assert (labels == numpy.arange(300) % 3).all()
+
 #################
 # Normalization
 #################
@@ -136,6 +174,73 @@ def test_normalize_one_row():
     with pytest.raises(ValueError):
         preprocess.normalize(numpy.array(matrix))
 
+@pytest.mark.parametrize('scaler_class, scale_func', [(preprocess.Rescaler, preprocess.rescale),
+                                                     (preprocess.Normalizer, preprocess.normalize)])
+def test_scaler_partial_fit(scaler_class, scale_func):
+    matrix = numpy.random.random((20, 3))
+
+    scaler = scaler_class()
+    for start in range(0, 20, 6):
+        scaler.partial_fit(matrix[start:start+6])
+    assert helpers.approx_equal(scaler.transform(matrix), scale_func(matrix))
+
+@pytest.mark.parametrize('scaler_class', [preprocess.Rescaler, preprocess.Normalizer])
+def test_scaler_merge(scaler_class):
+    matrix = numpy.random.random((20, 3))
+
+    # Ex. scalers fit in different processes
+    scaler = scaler_class().fit(matrix[:7])
+    scaler.merge(scaler_class().fit(matrix[7:]))
+    assert helpers.approx_equal(scaler.transform(matrix), scaler_class().fit_transform(matrix))
+
+def test_scaler_transform_new_matrix():
+    scaler = preprocess.Rescaler().fit([[0.0, -1.0], [2.0, 1.0]])
+    assert (scaler.transform([[1.0, 0.0], [4.0, 3.0]]) == [[0.0, 0.0], [3.0, 3.0]]).all()
+
+def test_scaler_transform_in_place():
+    matrix = numpy.random.random((10, 3)).astype('float32')
+    expected = preprocess.normalize(matrix)
+
+    scaled_matrix = preprocess.Normalizer().fit(matrix).transform(matrix, out=matrix)
+    assert scaled_matrix is matrix
+    assert scaled_matrix.dtype == numpy.float32
+    assert helpers.approx_equal(scaled_matrix, expected, tol=1e-5)
+
+def test_scaler_transform_dtype():
+    scaler = preprocess.Normalizer().fit(numpy.random.random((10, 3)))
+    assert scaler.transform(numpy.random.random((5, 3)), dtype='float32').dtype == numpy.float32
+
+@pytest.mark.parametrize('scaler_class', [preprocess.Rescaler, preprocess.Normalizer])
+def test_scaler_constant_column(scaler_class):
+    matrix = numpy.array([[1.0, 0.0], [1.0, 1.0], [1.0, 2.0]])
+    scaled_matrix = scaler_class().fit_transform(matrix)
+    assert (scaled_matrix[:, 0] == 0.0).all()
+
+@pytest.mark.parametrize('scaler_class', [preprocess.Rescaler, preprocess.Normalizer])
+def test_scaler_inverse_transform(scaler_class):
+    matrix = numpy.random.random((10, 3))
+    scaler = scaler_class().fit(matrix)
+    assert helpers.approx_equal(scaler.inverse_transform(scaler.transform(matrix)), matrix)
+
+def test_scaler_transform_not_fit():
+    with pytest.raises(ValueError):
+        preprocess.Normalizer().transform([[1.0]])
+
+def test_column_stats_merge():
+    matrix = numpy.random.random((20, 3))
+    stats = preprocess.ColumnStats()
+    stats.update(matrix[:5])
+    other_stats = preprocess.ColumnStats()
+    other_stats.update(matrix[5:])
+    stats.merge(other_stats)
+    stats.merge(preprocess.ColumnStats()) # Empty stats do not change anything
+
+    assert stats.count == 20
+    assert (stats.min == numpy.min(matrix, axis=0)).all()
+    assert (stats.max == numpy.max(matrix, axis=0)).all()
+    assert helpers.approx_equal(stats.mean, numpy.mean(matrix, axis=0))
+    assert helpers.approx_equal(stats.std, numpy.std(matrix, axis=0))
+
 
 ######################
 # Depuration functions
@@ -244,6 +349,11 @@ def test_pca_using_num_dimensions_func():
                                             select_dimensions_func=selection_func),
                              expected)
 
+def test_pca_deterministic():
+    # Large enough for PCA method 'auto' to use a randomized decomposition
+    matrix = _low_rank_matrix(num_rows=600)
+    assert numpy.array_equal(preprocess.pca(matrix, 2), preprocess.pca(matrix, 2))
+
 def test_pca_no_expected_or_func():
     with pytest.raises(ValueError):
         preprocess.pca([], None, None)
@@ -252,6 +362,73 @@ def test_pca_both_expected_and_func():
     with pytest.raises(ValueError):
         preprocess.pca([], 1, lambda x: [0])
 
+def _low_rank_matrix(num_rows=200, num_columns=30, rank=3):
+    # Variance mostly in rank directions, with distinct singular values
+    basis = numpy.linalg.qr(numpy.random.normal(size=(num_columns, rank)))[0].T
+    weights = numpy.random.normal(size=(num_rows, rank)) * [10.0, 5.0, 2.0][:rank]
+    return (weights.dot(basis) + 0.01*numpy.random.normal(size=(num_rows, num_columns))
+            + numpy.random.normal(size=num_columns))
+
+def test_pca_matches_covariance_method():
+    matrix = _low_rank_matrix()
+    model = preprocess.PCA(3, method='full').fit(matrix)
+
+    eigen_values, eigen_vectors = numpy.linalg.eigh(numpy.cov(matrix, rowvar=False, bias=True))
+    order = numpy.argsort(eigen_values)[::-1][:3]
+    assert helpers.approx_equal(model.explained_variance, eigen_values[order])
+    assert helpers.approx_equal(numpy.abs(model.components), numpy.abs(eigen_vectors[:, order].T))
+
+def test_pca_randomized():
+    matrix = _low_rank_matrix()
+    expected = preprocess.PCA(3, method='full').fit(matrix)
+    model = preprocess.PCA(3, method='randomized').fit(matrix)
+
+    assert helpers.approx_equal(model.explained_variance, expected.explained_variance)
+    # Same signs, from sign convention
+    assert helpers.approx_equal(model.components, expected.components)
+
+def test_pca_partial_fit():
+    matrix = _low_rank_matrix()
+    expected = preprocess.PCA(3, method='full').fit(matrix)
+
+    model = preprocess.PCA(3)
+    for start in range(0, len(matrix), 30):
+        model.partial_fit(matrix[start:start+30])
+
+    assert helpers.approx_equal(model.mean, expected.mean)
+    assert helpers.approx_equal(model.explained_variance, expected.explained_variance)
+    assert helpers.approx_equal(model.components, expected.components)
+
+def test_pca_transform_new_matrix():
+    matrix = _low_rank_matrix()
+    model = preprocess.PCA(2).fit(matrix[:150])
+
+    reduced_matrix = model.transform(matrix[150:])
+    assert reduced_matrix.shape == (50, 2)
+    assert helpers.approx_equal(reduced_matrix,
+                                (matrix[150:] - model.mean).dot(model.components.T))
+
+def test_pca_whiten():
+    matrix = _low_rank_matrix()
+    reduced_matrix = preprocess.PCA(3, whiten=True).fit_transform(matrix)
+    assert helpers.approx_equal(numpy.std(reduced_matrix, axis=0), [1.0, 1.0, 1.0])
+
+def test_pca_float32():
+    matrix = _low_rank_matrix().astype('float32')
+    model = preprocess.PCA(3, method='randomized').fit(matrix)
+    assert model.components.dtype == numpy.float32
+    assert model.transform(matrix).dtype == numpy.float32
+
+def test_pca_invalid_arguments():
+    with pytest.raises(ValueError):
+        preprocess.PCA(0)
+    with pytest.raises(ValueError):
+        preprocess.PCA(1, method='invalid')
+    with pytest.raises(ValueError):
+        preprocess.PCA(3).fit([[1.0, 2.0]])
+    with pytest.raises(ValueError):
+        preprocess.PCA(1).transform([[1.0, 2.0]])
+
 ###########################
 # Default cleaning function
 ###########################
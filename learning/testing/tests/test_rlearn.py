@@ -4,6 +4,8 @@ import pytest
 
 from learning import rlearn
 
+from learning.testing import helpers
+
 #######################
 # RLTable initial table
 #######################
@@ -184,3 +186,112 @@ def test_rltable_delete_action_that_doesnt_exist():
     with pytest.raises(KeyError):
         rl.delete_action(1, 0)
     assert rl._reward_table == {0: {0: rl._initial_reward}}
+
+#######################
+# ArrayRLTable
+#######################
+def test_arrayrltable_initial_reward():
+    rl = rlearn.ArrayRLTable([0, 1], ['a', 'b'], initial_reward=1.5)
+    for state in [0, 1]:
+        for action in ['a', 'b']:
+            assert rl.get_reward(state, action) == 1.5
+
+def test_arrayrltable_duplicate_action():
+    with pytest.raises(ValueError):
+        rlearn.ArrayRLTable([0], [0, 0])
+
+def test_arrayrltable_get_action():
+    rl = rlearn.ArrayRLTable([0], [0, 1, 2], initial_reward=1.0, update_rate=1.0)
+    rl.update(0, 2, 5.0)
+    assert rl.get_action(0) == 2
+
+    rl.update(0, 2, -5.0)
+    assert rl.get_action(0) in [0, 1]
+
+def test_arrayrltable_update_matches_rltable():
+    states = [0, 1]
+    actions = range(5)
+    rl = rlearn.RLTable(states, actions, initial_reward=1.0,
+                        update_rate=0.25, reward_growth=0.01)
+    array_rl = rlearn.ArrayRLTable(states, actions, initial_reward=1.0,
+                                   update_rate=0.25, reward_growth=0.01)
+
+    for _ in range(100):
+        state = random.choice(states)
+        action = random.choice(actions)
+        new_reward = random.uniform(-1, 1)
+        rl.update(state, action, new_reward)
+        array_rl.update(state, action, new_reward)
+
+    for state in states:
+        for action in actions:
+            assert helpers.approx_equal(array_rl.get_reward(state, action),
+                                        rl._reward_table[state][action], tol=1e-10)
+
+def test_arrayrltable_reward_offset_precision(monkeypatch):
+    monkeypatch.setattr(rlearn, 'MAX_REWARD_OFFSET', 1.0)
+
+    rl = rlearn.ArrayRLTable([0], [0, 1], initial_reward=1.0,
+                             update_rate=1.0, reward_growth=0.3)
+    for _ in range(10):
+        rl.update(0, 0, 0.0)
+
+    # Offset is folded into rewards when it grows too large
+    assert abs(rl._reward_offset) <= 1.0
+    assert helpers.approx_equal(rl.get_reward(0, 0), 0.3)
+    assert helpers.approx_equal(rl.get_reward(0, 1), 4.0)
+
+def test_arrayrltable_add_delete_action():
+    rl = rlearn.ArrayRLTable([], [], initial_reward=1.0)
+
+    for action in range(100):
+        rl.add_action('s', action)
+    rl.add_action('t', 0)
+    assert rl.get_reward('s', 99) == 1.0
+    assert rl.get_reward('t', 0) == 1.0
+
+    with pytest.raises(ValueError):
+        rl.add_action('s', 0)
+
+    # Action is never selected after delete
+    rl.update('s', 50, 10.0)
+    rl.delete_action('s', 50)
+    assert rl.get_action('s') != 50
+    with pytest.raises(KeyError):
+        rl.get_reward('s', 50)
+
+    # Deleting only action of state removes state
+    rl.delete_action('t', 0)
+    with pytest.raises(KeyError):
+        rl.get_action('t')
+
+    # Re-added state starts with only new action
+    rl.add_action('u', 3)
+    assert rl.get_action('u') == 3
+
+def test_arrayrltable_delete_action_that_doesnt_exist():
+    rl = rlearn.ArrayRLTable([0], [0])
+
+    with pytest.raises(KeyError):
+        rl.delete_action(0, 1)
+    with pytest.raises(KeyError):
+        rl.delete_action(1, 0)
+
+@pytest.mark.parametrize('selection', ['softmax', 'epsilon'])
+def test_arrayrltable_stochastic_selection(selection):
+    rl = rlearn.ArrayRLTable([0], [0, 1, 2], initial_reward=0.0, update_rate=1.0,
+                             selection=selection, temperature=0.5, epsilon=0.3)
+    rl.update(0, 1, 2.0)
+    rl.delete_action(0, 2)
+
+    counts = {0: 0, 1: 0, 2: 0}
+    for _ in range(1000):
+        counts[rl.get_action(0)] += 1
+
+    # Best action is usually selected, deleted action never is
+    assert counts[1] > counts[0] > 0
+    assert counts[2] == 0
+
+def test_arrayrltable_invalid_selection():
+    with pytest.raises(ValueError):
+        rlearn.ArrayRLTable([0], [0], selection='invalid')
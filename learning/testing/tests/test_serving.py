@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+import numpy
+
+from learning import serving, MLP
+
+from learning.testing import helpers
+
+
+def test_batch_server_activate():
+    model = MLP((2, 3, 2))
+    input_vec = numpy.random.random(2)
+
+    with serving.BatchServer(model) as server:
+        assert helpers.approx_equal(server.activate(input_vec), model.activate(input_vec))
+
+
+def test_batch_server_frozen_model():
+    model = MLP((2, 3, 2))
+    input_vec = numpy.random.random(2)
+
+    with serving.BatchServer(model.freeze()) as server:
+        assert helpers.approx_equal(server.activate(input_vec), model.activate(input_vec))
+
+
+def test_batch_server_max_batch_size():
+    model = MLP((2, 3, 2))
+    server = serving.BatchServer(model, max_batch_size=4)
+
+    # Rows queued before start are coalesced
+    input_matrix = numpy.random.random((10, 2))
+    futures = [server.submit(input_vec) for input_vec in input_matrix]
+    with server:
+        outputs = [future.result(timeout=5.0) for future in futures]
+
+    assert helpers.approx_equal(outputs, model.activate_batch(input_matrix))
+    assert server.num_batches == 3
+    assert server.num_rows == 10
+
+
+def test_batch_server_concurrent_clients():
+    model = MLP((4, 8, 3))
+    input_matrices = [numpy.random.random((50, 4)) for _ in range(8)]
+    outputs = [None]*len(input_matrices)
+
+    def client(i):
+        outputs[i] = [server.activate(input_vec, timeout=5.0) for input_vec in input_matrices[i]]
+
+    with serving.BatchServer(model, max_batch_size=16, max_wait=0.01) as server:
+        threads = [threading.Thread(target=client, args=(i, )) for i in range(len(input_matrices))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for output_matrix, input_matrix in zip(outputs, input_matrices):
+        assert helpers.approx_equal(output_matrix, model.activate_batch(input_matrix))
+    assert server.num_rows == 400
+    assert server.num_batches < server.num_rows
+
+
+def test_batch_server_bad_row_fails_alone():
+    model = MLP((2, 3, 2))
+    server = serving.BatchServer(model)
+
+    good_future = server.submit([0.5, 0.5])
+    bad_future = server.submit([0.5, 0.5, 0.5])
+    with server:
+        assert helpers.approx_equal(good_future.result(timeout=5.0), model.activate([0.5, 0.5]))
+        with pytest.raises(ValueError):
+            bad_future.result(timeout=5.0)
+
+
+def test_batch_server_submit_after_stop():
+    server = serving.BatchServer(MLP((2, 3, 2)))
+    server.start()
+    server.stop()
+
+    with pytest.raises(ValueError):
+        server.submit([0.5, 0.5])
+
+
+def test_batch_server_stop_before_start():
+    server = serving.BatchServer(MLP((2, 3, 2)))
+    future = server.submit([0.5, 0.5])
+    server.stop()
+
+    # Pending rows fail, instead of waiting forever
+    assert future.done()
+    with pytest.raises(ValueError):
+        future.result(timeout=0.0)
+
+    with pytest.raises(ValueError):
+        server.start()
+    server.stop() # Stopping again does nothing
+
+
+def test_future_result_timeout():
+    # Not started, so never activated
+    server = serving.BatchServer(MLP((2, 3, 2)))
+    future = server.submit([0.5, 0.5])
+
+    assert not future.done()
+    with pytest.raises(serving.TimeoutError):
+        future.result(timeout=0.0)
+
+
+@pytest.mark.parametrize('kwargs', [{'max_batch_size': 0}, {'max_wait': -1.0}])
+def test_batch_server_invalid_args(kwargs):
+    with pytest.raises(ValueError):
+        serving.BatchServer(MLP((2, 3, 2)), **kwargs)
@@ -195,6 +195,7 @@ _COMPARE_STATS = {'model': _BENCHMARK_STATS,
 def test_isdataset():
     assert validation._isdataset(datasets.get_xor()) is True
     assert validation._isdataset([datasets.get_and(), datasets.get_xor()]) is False
+    assert validation._isdataset((numpy.array([[0.0], [1.0]]), numpy.array([0, 1]))) is True
 
 
 #################
@@ -223,6 +224,39 @@ def test_get_error():
         error_func=error.MSE()) == 0.25
 
 
+def test_get_error_batch_equals_per_sample():
+    model = helpers.SetOutputModel([0.25, 0.75])
+    input_matrix = numpy.zeros((3, 1))
+    target_matrix = numpy.array([[0.0, 1.0], [1.0, 0.0], [0.5, 0.5]])
+
+    for error_func in [error.MSE(), error.CrossEntropy()]:
+        expected = numpy.mean([error_func(model.activate(input_vec), target_vec)
+                               for input_vec, target_vec in zip(input_matrix, target_matrix)])
+        assert helpers.approx_equal(
+            validation.get_error(model, input_matrix, target_matrix, error_func=error_func),
+            expected)
+
+
+def test_get_error_custom_error_func():
+    model = helpers.SetOutputModel([0.25, 0.75])
+    input_matrix = numpy.zeros((3, 1))
+    target_matrix = numpy.array([[0.0, 1.0], [1.0, 0.0], [0.5, 0.5]])
+
+    # Called with vectors, like error functions without reduction
+    def max_error(output_vec, target_vec):
+        assert numpy.ndim(output_vec) == 1
+        return numpy.max(numpy.abs(output_vec - target_vec))
+
+    class MaxError(error.ErrorFunc):
+        def __call__(self, vec_a, vec_b):
+            return max_error(vec_a, vec_b)
+
+    for error_func in [max_error, MaxError()]:
+        assert helpers.approx_equal(
+            validation.get_error(model, input_matrix, target_matrix, error_func=error_func),
+            numpy.mean([0.25, 0.75, 0.25]))
+
+
 def test_get_accuracy():
     model = helpers.SetOutputModel([1])
     assert validation.get_accuracy(model,
@@ -236,6 +270,27 @@ def test_get_accuracy():
                                    numpy.array([[0], [0]])) == 0.0
 
 
+def test_get_accuracy_class_indices():
+    model = helpers.SetOutputModel([0.0, 1.0])
+    assert validation.get_accuracy(model,
+                                   numpy.array([[1], [1]]),
+                                   numpy.array([1, 0])) == 0.5
+
+
+def test_validate_model_class_indices(monkeypatch):
+    monkeypatch.setattr(time, 'clock', lambda: 0.0)
+
+    model = helpers.SetOutputModel([0.0, 1.0])
+    stats = validation._validate_model(model, (numpy.array([[1], [1]]), numpy.array([1, 0])),
+                                       (numpy.array([[1]]), numpy.array([1])),
+                                       iterations=0, _classification=True)
+    assert stats['training_error'] == 0.5
+    assert stats['testing_error'] == 0.0
+    assert stats['training_accuracy'] == 0.5
+    assert (stats['training_confusion_matrix'] == numpy.array([[0, 1], [0, 1]])).all()
+    assert stats['testing_accuracy'] == 1.0
+
+
 def test__get_accuracy():
     assert validation._get_accuracy(
         numpy.array([0, 1, 2, 3]),
@@ -374,6 +429,35 @@ def test_split_dataset():
                                 and (pattern[1] == other_pattern[1]).all())
 
 
+def test_split_dataset_views():
+    input_matrix, target_matrix = datasets.get_random_regression(10, 2, 1)
+    sets = validation._split_dataset(input_matrix, target_matrix, 3)
+
+    assert [len(set_[0]) for set_ in sets] == [3, 3, 4]
+    for set_input_matrix, set_target_matrix in sets:
+        assert numpy.may_share_memory(set_input_matrix, input_matrix)
+        assert numpy.may_share_memory(set_target_matrix, target_matrix)
+
+
+def test_make_cross_validation_sets():
+    input_matrix, target_matrix = datasets.get_random_regression(10, 2, 1)
+    train_test_sets = validation.make_cross_validation_sets(input_matrix, target_matrix, 3)
+
+    for (training_set, testing_set) in train_test_sets:
+        assert len(training_set[0]) + len(testing_set[0]) == 10
+        assert (numpy.sort(numpy.concatenate([training_set[0], testing_set[0]]), axis=0)
+                == numpy.sort(input_matrix, axis=0)).all()
+
+
+def test_make_train_test_sets_object_labels():
+    inputs = numpy.array([[0.0], [1.0], [2.0], [3.0]])
+    labels = numpy.array([['a', 1], ['b', 2], ['a', 1], ['b', 2]], dtype=object)
+
+    training_set, testing_set = validation.make_train_test_sets(inputs, labels, 1)
+    assert (training_set[0] == inputs[:2]).all()
+    assert (testing_set[0] == inputs[2:]).all()
+
+
 #############################
 # Statistics
 #############################
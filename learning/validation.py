@@ -26,12 +26,15 @@ import math
 import time
 import numbers
 import copy
+import inspect
 import logging
 import collections
 
 import numpy
 
 from learning import error
+from learning import dtypes
+from learning import preprocess
 
 
 def compare(names, models, datasets, num_folds=3, num_runs=30, all_kwargs={}):
@@ -96,7 +99,8 @@ def _isdataset(object_):
     if not isinstance(object_[0][0], collections.Iterable):
         return False
 
-    if not isinstance(object_[1][0], collections.Iterable):
+    # Targets can be vectors, or class indices
+    if not isinstance(object_[1][0], (collections.Iterable, numbers.Number)):
         return False
 
     # Each item should not be a dataset itself
@@ -192,7 +196,21 @@ def _validate_model(model,
     stats['testing_error'] = get_error(model, *testing_set)
 
     if _classification:
-        if len(training_set[1][0]) == 1:
+        all_actual_training = _get_classes(
+            numpy.array(
+                [model.activate(inp_vec) for inp_vec in training_set[0]]))
+        all_expected_training = _get_classes(training_set[1])
+        all_actual_testing = _get_classes(
+            numpy.array(
+                [model.activate(inp_vec) for inp_vec in testing_set[0]]))
+        all_expected_testing = _get_classes(testing_set[1])
+
+        if numpy.ndim(training_set[1]) == 1:
+            # Class indices, outputs may not include every class
+            num_classes = max(
+                numpy.max(classes) for classes in (all_actual_training, all_expected_training,
+                                                   all_actual_testing, all_expected_testing)) + 1
+        elif len(training_set[1][0]) == 1:
             # Labels (assumed to start at 0)
             # TODO: Optimize
             num_classes = numpy.max(
@@ -201,22 +219,12 @@ def _validate_model(model,
             num_classes = len(training_set[1][0])
 
         # Get accuracy and confusion matrix for training set
-        all_actual_training = _get_classes(
-            numpy.array(
-                [model.activate(inp_vec) for inp_vec in training_set[0]]))
-        all_expected_training = _get_classes(training_set[1])
-
         stats['training_accuracy'] = _get_accuracy(all_actual_training,
                                                    all_expected_training)
         stats['training_confusion_matrix'] = _get_confusion_matrix(
             all_actual_training, all_expected_training, num_classes)
 
         # Get accuracy and confusion matrix for testing set
-        all_actual_testing = _get_classes(
-            numpy.array(
-                [model.activate(inp_vec) for inp_vec in testing_set[0]]))
-        all_expected_testing = _get_classes(testing_set[1])
-
         stats['testing_accuracy'] = _get_accuracy(all_actual_testing,
                                                   all_expected_testing)
         stats['testing_confusion_matrix'] = _get_confusion_matrix(
@@ -229,13 +237,59 @@ def _validate_model(model,
 # Metrics
 ######################
 def get_error(model, input_matrix, target_matrix, error_func=error.MSE()):
-    """Return mean error of model on given dataset."""
-    return numpy.mean([
+    """Return mean error of model on given dataset.
+
+    For an error.ErrorFunc with a reduction argument,
+    errors of all samples are computed with a single error_func call,
+    on outputs of model.activate_batch,
+    unless outputs do not match the shape of target_matrix.
+    Any other error_func is called with one output and target vector at a time.
+    """
+    if _supports_matrices(error_func):
+        output_matrix = _get_output_matrix(model, input_matrix, target_matrix)
+        if output_matrix is not None:
+            return error_func(output_matrix, target_matrix)
+
+    # Fallback to per-sample error
+    return dtypes.mean([
         error_func(model.activate(input_vec), target_vec)
         for input_vec, target_vec in zip(input_matrix, target_matrix)
     ])
 
 
+def _supports_matrices(error_func):
+    """Return True if error_func returns the mean error of rows, for matrices.
+
+    Only error.ErrorFunc with a reduction argument is known to,
+    other functions may expect vectors.
+    """
+    return (isinstance(error_func, error.ErrorFunc)
+            and 'reduction' in inspect.getargspec(type(error_func).__call__).args)
+
+
+def _get_output_matrix(model, input_matrix, target_matrix):
+    """Return model.activate_batch(input_matrix), or None if it does not match target_matrix.
+
+    target_matrix can have a target vector, or class index, for each output.
+    """
+    try:
+        output_matrix = model.activate_batch(input_matrix)
+    except ValueError:
+        # Outputs cannot be stacked, ex. MultiOutputs with different output sizes
+        return None
+
+    target_matrix = numpy.asarray(target_matrix)
+    if (output_matrix.dtype == object or target_matrix.dtype == object
+            or output_matrix.ndim < 2):
+        return None
+
+    if (output_matrix.shape == target_matrix.shape
+            or (output_matrix.shape[:-1] == target_matrix.shape
+                and target_matrix.dtype.kind in 'iu')):
+        return output_matrix
+    return None
+
+
 def get_accuracy(model, input_matrix, target_matrix):
     """Return accuracy of model on given dataset."""
     return _get_accuracy(
@@ -248,9 +302,14 @@ def get_accuracy(model, input_matrix, target_matrix):
 def _get_classes(matrix):
     """Return a list of classes given a matrix.
 
-    Matrix can be column vector of labels,
+    Matrix can be vector or column vector of labels,
     or matrix of onehot, or onehot like rows.
     """
+    matrix = numpy.asarray(matrix)
+    if matrix.ndim == 1:
+        # Labels, such as integer class indices
+        return matrix
+
     # If column matrix, we assume each element is a label
     if matrix.shape[1] == 1:
         # Labels
@@ -306,26 +365,24 @@ def make_cross_validation_sets(input_matrix, target_matrix, num_folds=3):
 
 
 def _split_dataset(input_matrix, target_matrix, num_sets):
-    """Split patterns into num_sets disjoint sets."""
-    # Zip for easier splitting
-    patterns = zip(input_matrix, target_matrix)
+    """Split patterns into num_sets disjoint sets.
+
+    Each set is a view of given matrices, without copying.
+    """
+    input_matrix = numpy.asarray(input_matrix)
+    target_matrix = numpy.asarray(target_matrix)
 
     sets = []
-    start_pos = 0
-    set_size = len(patterns) / num_sets  # rounded down
+    set_size = len(input_matrix) // num_sets  # rounded down
     for i in range(num_sets):
+        start_pos = i*set_size
         # For the last set, add all remaining items (in case sets don't split evenly)
         if i == num_sets - 1:
-            new_set = patterns[start_pos:]
+            end_pos = len(input_matrix)
         else:
-            new_set = patterns[start_pos:start_pos + set_size]
-
-        # Transpose back into (input_matrix, target_matrix)
-        set_input_matrix, set_target_matrix = zip(*new_set)
-        sets.append((numpy.array(set_input_matrix),
-                     numpy.array(set_target_matrix)))
+            end_pos = start_pos + set_size
 
-        start_pos += set_size
+        sets.append((input_matrix[start_pos:end_pos], target_matrix[start_pos:end_pos]))
 
     return sets
 
@@ -338,38 +395,23 @@ def make_train_test_sets(input_matrix, label_matrix, train_per_class):
         label_matrix: labels matrix. Each row is sample, each column is label.
         train_per_class: Number of samples for each class in training set.
     """
-    training_inputs = []
-    training_labels = []
-    testing_inputs = []
-    testing_labels = []
-    label_counts = {}
+    input_matrix = numpy.asarray(input_matrix)
+    label_matrix = numpy.asarray(label_matrix)
 
     # Add each row to training or testing set depending on count of labels
-    for input_, label in zip(input_matrix, label_matrix):
-        key = tuple(label)
-        try:
-            count = label_counts[key]
-        except KeyError:
-            # First time seeing label, count is 0
-            count = 0
-
-        if count < train_per_class:
-            # Still need more training samples for this label
-            training_inputs.append(input_)
-            training_labels.append(label)
-        else:
-            # We have enough training samples for this label,
-            # add to testing set instead
-            testing_inputs.append(input_)
-            testing_labels.append(label)
-
-        label_counts[key] = count + 1
-
-    if testing_inputs == []:
+    # Rank is number of previous rows with the same label
+    label_indices, _ = preprocess._get_class_indices(label_matrix)
+    order = numpy.argsort(label_indices, kind='mergesort') # Stable, keeps row order
+    sorted_indices = label_indices[order]
+    ranks = numpy.empty(len(order), dtype=int)
+    ranks[order] = numpy.arange(len(order)) - numpy.searchsorted(sorted_indices, sorted_indices)
+
+    in_training = ranks < train_per_class
+    if in_training.all():
         raise ValueError('train_per_class too high, no testing set')
 
-    return ((numpy.array(training_inputs), numpy.array(training_labels)),
-            (numpy.array(testing_inputs), numpy.array(testing_labels)))
+    return ((input_matrix[in_training], label_matrix[in_training]),
+            (input_matrix[~in_training], label_matrix[~in_training]))
 
 
 def _create_train_test_sets(sets):
@@ -384,17 +426,13 @@ def _create_train_test_sets(sets):
     for i in range(num_folds):
         test_set = sets[i]
 
-        # Train set is all other sets
-        train_set = [[], []]
-        for j in range(num_folds):
-            if i != j:
-                train_set[0].extend(list(sets[j][0]))
-                train_set[1].extend(list(sets[j][1]))
+        # Train set is all other sets, copied once into contiguous matrices
+        other_sets = sets[:i] + sets[i+1:]
+        train_set = (numpy.concatenate([set_[0] for set_ in other_sets]),
+                     numpy.concatenate([set_[1] for set_ in other_sets]))
 
         # Train, test tuples
-        train_set[0] = numpy.array(train_set[0])
-        train_set[1] = numpy.array(train_set[1])
-        train_test_sets.append((tuple(train_set), test_set))
+        train_test_sets.append((train_set, test_set))
 
     return train_test_sets
 